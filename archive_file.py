@@ -0,0 +1,201 @@
+"""Compact archive files: the elites of a MAP-Elites archive as their genomes and stats, one record per cell.
+
+Layout of a file (all integers little-endian):
+
+    header   magic (8 bytes), version (uint32), flags (uint32, unused), index offset (uint64)
+    records  one zlib-compressed JSON record per elite: its genome (see `Genome.as_dict`), score, BC values,
+             number of simulations, instance entropy and what it takes to rebuild the individual (config file,
+             fitness type, BCs, init seed and log level)
+    index    length of the index metadata (uint64), the metadata as JSON (archive shape, config values and number
+             of cells) and an int64 array with one (x, y, offset, length) row per elite
+
+The index is at the end so the records can be streamed out, and a reader only has to load the index to read any
+single cell. Nothing is pickled, so reading an archive can't run code. Use `python archive_file.py` to convert the
+pickled archives (`archive_gen-N.pkl` etc.) of older runs.
+"""
+import argparse
+import json
+import os
+import pickle
+import struct
+import zlib
+from typing import Tuple
+
+import numpy as np
+
+from genome import Genome
+from simconfig import SimConfig
+
+ARCHIVE_MAGIC = b"AGKARCH\0"
+ARCHIVE_VERSION = 1     # bump when the layout changes (older files are refused instead of being misread)
+ARCHIVE_EXT = ".agk"
+_HEADER = struct.Struct("<8sIIQ")
+_INDEX_LEN = struct.Struct("<Q")
+
+
+def encode_individual(ind) -> dict:
+    """The record of an individual: its genome and its stats (the engine is left out, it is rebuilt on use)."""
+    return {
+        'genome': ind.genome.as_dict(),
+        'score': float(ind.score),
+        'bc_sim_vals': [float(v) for v in ind.bc_sim_vals],
+        'n_sims': int(ind.n_sims),
+        'instance_entropy': float(getattr(ind, 'instance_entropy', 0)),
+        'config_file': ind.config_file,
+        'fitness_type': ind.fitness_type,
+        'bcs': list(ind.bcs),
+        'init_seed': int(ind.init_seed),
+        'log_level': ind.log_level,
+    }
+
+
+def decode_individual(rec: dict, config: SimConfig):
+    """The individual of a record made by `encode_individual`."""
+    from evo_utils import EvoIndividual
+    genome = Genome.from_dict(rec['genome'], config)
+    ind = EvoIndividual(rec['config_file'], rec['fitness_type'], rec['bcs'], init_seed=rec['init_seed'],
+                        log_level=rec['log_level'], genome=genome)
+    ind.score = rec['score']
+    ind.bc_sim_vals = tuple(rec['bc_sim_vals'])
+    ind.n_sims = rec['n_sims']
+    ind.instance_entropy = rec['instance_entropy']
+    return ind
+
+
+def save_archive(archive: np.ndarray, filename: str):
+    """Write an archive (2D object array of individuals, None in the empty cells) to a compact archive file."""
+    cells = np.argwhere(archive != None)
+    config = archive[tuple(cells[0])].genome.CONFIG.asDict() if len(cells) > 0 else None
+
+    # written next to the file and moved in place, so a run killed while saving keeps its last archive
+    tmp = filename + ".tmp"
+    index = np.zeros((len(cells), 4), dtype=np.int64)
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, 0, 0))
+        for i, (x, y) in enumerate(cells):
+            rec = zlib.compress(json.dumps(encode_individual(archive[x, y])).encode('utf-8'))
+            index[i] = (x, y, f.tell(), len(rec))
+            f.write(rec)
+        index_offset = f.tell()
+        meta = json.dumps({'shape': list(archive.shape), 'config': config, 'n_cells': len(cells)}).encode('utf-8')
+        f.write(_INDEX_LEN.pack(len(meta)))
+        f.write(meta)
+        f.write(index.astype('<i8').tobytes())
+        f.seek(0)
+        f.write(_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, 0, index_offset))
+    os.replace(tmp, filename)
+
+
+class ArchiveFile():
+    """An open archive file. Only the index is read when opening; the elites are read (and decoded) cell by cell.
+
+    `archive[x, y]` is the individual of a cell (None if it is empty), `cells` the (x, y) of the elites in the order
+    they were written, and `load()` the whole archive as a 2D object array.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        head = self.file.read(_HEADER.size)
+        if len(head) < _HEADER.size:
+            self.file.close()
+            raise EOFError(f"{filename} is truncated")
+        magic, version, _, index_offset = _HEADER.unpack(head)
+        if magic != ARCHIVE_MAGIC:
+            self.file.close()
+            raise ValueError(f"{filename} is not an archive file")
+        if version != ARCHIVE_VERSION:
+            self.file.close()
+            raise ValueError(f"Archive version {version} is not supported (expected {ARCHIVE_VERSION})")
+
+        self.file.seek(index_offset)
+        meta_len, = _INDEX_LEN.unpack(self.file.read(_INDEX_LEN.size))
+        meta = json.loads(self.file.read(meta_len).decode('utf-8'))
+        index = np.frombuffer(self.file.read(meta['n_cells'] * 32), dtype='<i8').reshape(-1, 4)
+        self.shape = tuple(meta['shape'])
+        self.config = None if meta['config'] is None else SimConfig(meta['config'])
+        self.cells = index[:, :2].astype(int)
+        self.index = {(int(x), int(y)): (int(o), int(n)) for x, y, o, n in index}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, xy: Tuple[int, int]):
+        return tuple(xy) in self.index
+
+    def __getitem__(self, xy: Tuple[int, int]):
+        entry = self.index.get(tuple(int(v) for v in xy))
+        if entry is None:
+            return None
+        return decode_individual(self.read_record(xy), self.config)
+
+    def read_record(self, xy: Tuple[int, int]) -> dict:
+        """The record of a cell as a dictionary, without making an individual out of it."""
+        offset, length = self.index[tuple(int(v) for v in xy)]
+        self.file.seek(offset)
+        return json.loads(zlib.decompress(self.file.read(length)).decode('utf-8'))
+
+    def load(self) -> np.ndarray:
+        """The whole archive as a 2D object array of individuals (None in the empty cells)."""
+        archive = np.full(self.shape, None, dtype=object)
+        for xy in self.index:
+            archive[xy] = self[xy]
+        return archive
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def is_archive_file(filename: str) -> bool:
+    with open(filename, 'rb') as f:
+        return f.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+
+
+def load_archive(filename: str) -> np.ndarray:
+    """Load a whole archive, from an archive file or from a pickled object array (as older runs saved them)."""
+    if is_archive_file(filename):
+        with ArchiveFile(filename) as f:
+            return f.load()
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
+
+
+def convert_archive(pkl_filename: str, filename: str = None) -> str:
+    """Convert a pickled archive to an archive file (next to it, with the archive extension, by default)."""
+    if filename is None:
+        filename = os.path.splitext(pkl_filename)[0] + ARCHIVE_EXT
+    with open(pkl_filename, 'rb') as f:
+        archive = pickle.load(f)
+    save_archive(archive, filename)
+    return filename
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert pickled archives to compact archive files.")
+    parser.add_argument('paths', nargs='+', help="pickled archives, or directories to search for them")
+    parser.add_argument('-d', '--delete', action='store_true', help="delete each pickle once it is converted")
+    args = parser.parse_args()
+
+    pkl_files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                pkl_files += [os.path.join(root, f) for f in sorted(files) if f.endswith(".pkl")]
+        else:
+            pkl_files.append(path)
+
+    for pkl_file in pkl_files:
+        try:
+            out = convert_archive(pkl_file)
+        except (pickle.UnpicklingError, EOFError, AttributeError, TypeError) as e:
+            print(f"Skipping {pkl_file} ({e})")
+            continue
+        print(f"{pkl_file} ({os.path.getsize(pkl_file)} B) -> {out} ({os.path.getsize(out)} B)")
+        if args.delete:
+            os.remove(pkl_file)
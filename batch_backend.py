@@ -0,0 +1,603 @@
+import numpy as np
+
+from fortress import Fortress
+from snapshot import FortSnapshot
+from entities import NODE_OPS
+from soa_backend import FSMTables, OP_MOVE, OP_DIE, OP_CLONE, OP_TAKE, OP_CHASE, OP_PUSH, OP_ADD, OP_TRANSFORM, OP_WALL, \
+    E_NONE, E_STEP, E_NEAR, POS_MOD
+
+
+# the node actions with a property, as a table indexed by opcode
+def _opTable(*ops):
+    table = np.zeros(len(NODE_OPS), dtype=bool)
+    table[list(ops)] = True
+    return table
+
+WRITES_OWN = _opTable(OP_MOVE, OP_DIE, OP_CHASE, OP_WALL, OP_CLONE, OP_PUSH, OP_TRANSFORM)  # moves, kills or creates its own char
+WRITES_ARG = _opTable(OP_TAKE, OP_PUSH, OP_ADD, OP_TRANSFORM)   # moves, kills or creates the char of its argument
+HITS_ARG = _opTable(OP_TAKE, OP_PUSH)                           # moves or kills another entity (of the char of its argument)
+READS_ARG = _opTable(OP_TAKE, OP_CHASE, OP_PUSH)                # goes for the closest entity of the char of its argument
+READS_ANY = _opTable(OP_WALL, OP_CLONE, OP_ADD)                 # looks at whatever is on a random adjacent cell
+DRAWS = _opTable(OP_MOVE, OP_PUSH, OP_WALL, OP_CLONE, OP_ADD)   # draws a random direction (chase only draws between two)
+
+
+# struct-of-arrays backend for many episodes at once (e.g. every episode of a generation, see evo_utils.simulate_batch)
+#   the entities of episode e are row e of (episode, slot) columns, in the order its fortress would update them (a new
+#   entity takes the next free slot of its episode), and a tick updates every running episode together
+#   each episode runs as it would on its own engine: its random directions come from its own generator (drawn as
+#   Fortress.randDir draws them), it ends on the checks of Fortress.terminate / inactive / overpop or after the
+#   number of steps, and it records the same tree visits - so it gives the same result as an episode on the reference
+#   engine with the same generator (see equivalence.py)
+#   a tick runs in phases: every phase runs, for each episode, the next chunk of its entities that can run together
+#   (see update), so the entities of an episode still take effect one after another in their order, while the same
+#   kernels run the episodes side by side
+#   an episode that raises an error (like the reference engine would) stops there, and the error is kept for it
+class BatchBackend(FSMTables):
+    def __init__(self):
+        self.groups = []        # the species dictionaries of the episodes (the episodes of one fortress or genome share one)
+        self.group_ids = {}     # id of a species dictionary -> group
+        self.pending = []       # the episodes added since the columns were built
+        self.K = 0              # number of episodes
+        self.steps = 0          # ticks run (the same for every episode still running)
+        self.built = False
+        self.rng_block = 256    # number of 32-bit words drawn from a generator at a time (see Fortress.rng_block)
+        self.errors = {}        # episode -> the error it stopped on
+        self.walkmaps = {}      # (width, height) -> walkable grid of a blank fortress of that size
+
+
+    #######     LOADING     #######
+
+    # add an episode of a genome (see genome.py) per random generator, starting as a reset fortress of the genome
+    #   returns the episode ids
+    def addGenome(self, genome, rngs):
+        snap = FortSnapshot(genome.init_ents)
+        g = self._group(genome.species)
+        species = [genome.species[c] for c in snap.chars]
+        ents = [(species[s], x, y, 0, 0, None) for s, (x, y) in zip(snap.cid, snap.cells)]
+        size = (genome.width, genome.height)
+        if size not in self.walkmaps:
+            f = Fortress(genome.CONFIG, genome.width, genome.height, seed=0)
+            f.blankFortress()
+            self.walkmaps[size] = f.walkmap
+        visits = {c: {'nodes':set(),'edges':set()} for c in genome.species}
+        return [self._addEpisode(g, ents, self.walkmaps[size], genome.max_entities, genome.CONFIG.inactive_limit,
+                                 rng, [], 0, visits) for rng in rngs]
+
+    # add an episode that continues from the current state of a fortress (with its own generator rng_sim)
+    #   returns the episode id
+    def addFortress(self, f):
+        assert not f.rng_compat, "The batch only draws the random directions by blocks of words"
+        g = self._group(f.CHARACTER_DICT)
+        ents = [(ent.species, int(ent.pos[0]), int(ent.pos[1]), ent.cur_node, ent.cur_step, ent.moved_edge)
+                for ent in f.entities.values()]
+        for _, x, y, _, _, _ in ents:
+            assert 0 <= x < f.width and 0 <= y < f.height, "The batch only keeps entities on the map"
+        words = f.dir_words[f.dir_i:] if f.dir_src is f.rng_sim else []
+        visits = {c: {'nodes':set(v['nodes']),'edges':set(v['edges'])} for c, v in f.CHAR_VISIT_TREE.items()}
+        return self._addEpisode(g, ents, f.walkmap, f.max_entities, f.CONFIG.inactive_limit, f.rng_sim, words,
+                                f.last_activity - f.steps, visits)
+
+    # the group of a species dictionary
+    def _group(self, species_dict):
+        if id(species_dict) not in self.group_ids:
+            self.group_ids[id(species_dict)] = len(self.groups)
+            self.groups.append({'dict': species_dict, 'species': list(species_dict.values())})
+        return self.group_ids[id(species_dict)]
+
+    # add an episode to the ones built into the columns at the next tick
+    def _addEpisode(self, g, ents, walkmap, max_entities, inactive_limit, rng, words, last_activity, visits):
+        assert not self.built, "Episodes can only be added before the first tick"
+        grp = self.groups[g]
+        for species, _, _, _, _, _ in ents:
+            if species not in grp['species']:
+                grp['species'].append(species)
+        self.pending.append({'group': g, 'ents': ents, 'walk': walkmap, 'max_entities': max_entities,
+                             'inactive_limit': inactive_limit, 'rng': rng, 'words': words,
+                             'last_activity': last_activity, 'visits': visits})
+        self.K += 1
+        return self.K - 1
+
+    # register the species of every group (each group's species, nodes and edge keys get contiguous ids, so the
+    #   visits of an episode are kept by node and edge key within its group) and fill the columns
+    def _build(self):
+        self.chars, self.char_ids, self.species, self.sp_fsm, self.keys, self.key_ids = [], {}, [], [], [], {}
+        eps = self.pending
+        sp_ids = []             # group -> species -> species id
+        grp_k0 = []
+        for g, grp in enumerate(self.groups):
+            first = len(self.species)
+            sp_ids.append({})
+            for species in grp['species']:
+                sp_ids[g][species] = len(self.species)
+                self.species.append(species)
+                self.sp_fsm.append(species.compileFSM())
+                self._charId(species.char)
+            grp_k0.append(len(self.keys))
+            for s in range(first, len(self.species)):
+                for edges in self.sp_fsm[s].out_edges:
+                    for _, _, _, key in edges:
+                        self._keyId(s, key)
+            # (the edges the entities come in with may have left the FSMs since)
+            for ep in eps:
+                if ep['group'] == g:
+                    for species, _, _, _, _, key in ep['ents']:
+                        if key is not None:
+                            self._keyId(sp_ids[g][species], key)
+        grp_k0.append(len(self.keys))
+        self._buildTables()
+        assert len(self.chars) < 63, "The batch keeps the chars a node checks for in the bits of an int64"
+        self.g_tmask = self.g_targets.astype(np.int64)
+
+        # the ranges of the global node and edge key ids of each group
+        n_groups = len(self.groups)
+        sp_first = np.array([min(ids.values(), default=0) for ids in sp_ids], dtype=np.int64)
+        self.grp_nbase = self.node_base[sp_first] if len(self.species) else np.zeros(n_groups, dtype=np.int64)
+        grp_nodes = [int(self.sp_nodes[list(ids.values())].sum()) for ids in sp_ids]
+        self.grp_kbase = np.array(grp_k0[:-1], dtype=np.int64)
+        grp_keys = np.diff(grp_k0)
+        # the species of each char in a group (what add and transform create), -1 if the group has none
+        for grp in self.groups:
+            for c in grp['dict']:
+                self._charId(c)
+        self.grp_sp = np.full((n_groups, len(self.chars)), -1, dtype=np.int64)
+        for g, grp in enumerate(self.groups):
+            for c, species in grp['dict'].items():
+                self.grp_sp[g, self.char_ids[c]] = sp_ids[g][species]
+
+        K = self.K
+        self.ep_grp = np.array([ep['group'] for ep in eps], dtype=np.int64)
+        self.n = np.array([len(ep['ents']) for ep in eps], dtype=np.int64)     # slots in use (dead slots stay until compacted)
+        self.n_alive = self.n.copy()
+        self.last_activity = np.array([ep['last_activity'] for ep in eps], dtype=np.int64)
+        self.max_entities = np.array([ep['max_entities'] for ep in eps], dtype=np.int64)
+        self.inactive_limit = np.array([ep['inactive_limit'] for ep in eps], dtype=np.int64)
+        self.running = np.ones(K, dtype=bool)
+
+        # the walkable grids, padded with walls to the largest map
+        H = max([ep['walk'].shape[0] for ep in eps] + [1])
+        W = max([ep['walk'].shape[1] for ep in eps] + [1])
+        self.walk = np.zeros((K, H, W), dtype=bool)
+        for e, ep in enumerate(eps):
+            h, w = ep['walk'].shape
+            self.walk[e, :h, :w] = ep['walk']
+
+        # the random direction words of each episode (words[e, wptr[e]:wend[e]] are drawn but not used yet)
+        self.rngs = [ep['rng'] for ep in eps]
+        cap = max([2*self.rng_block] + [len(ep['words']) for ep in eps])
+        self.words = np.zeros((K, cap), dtype=np.int64)
+        self.wptr = np.zeros(K, dtype=np.int64)
+        self.wend = np.zeros(K, dtype=np.int64)
+        for e, ep in enumerate(eps):
+            self.words[e, :len(ep['words'])] = ep['words']
+            self.wend[e] = len(ep['words'])
+
+        self._alloc(max([16] + [2*len(ep['ents']) for ep in eps]))
+        for e, ep in enumerate(eps):
+            g = ep['group']
+            for r, (species, x, y, node, step, key) in enumerate(ep['ents']):
+                s = sp_ids[g][species]
+                self.x[e,r], self.y[e,r], self.sp[e,r], self.cid[e,r] = x, y, s, self.sp_cid[s]
+                self.node[e,r], self.step[e,r] = node, step
+                self.medge[e,r] = -1 if key is None else self.key_ids[(s, key)]
+                self.alive[e,r] = True
+
+        # the visits recorded by the batch (by node and edge key id within the group), on top of those each episode
+        #   came in with (and the visits of nodes past the end of an FSM, which only a broken edge can lead to)
+        self.vnode = np.zeros((K, max(grp_nodes + [1])), dtype=bool)
+        self.vedge = np.zeros((K, max(list(grp_keys) + [1])), dtype=bool)
+        self.init_visits = [ep['visits'] for ep in eps]
+        self.extra_visits = {}
+        self.pending = None
+        self.built = True
+
+    # allocate the columns
+    def _alloc(self, size):
+        K = self.K
+        self.x = np.zeros((K, size), dtype=np.int64)        # position
+        self.y = np.zeros((K, size), dtype=np.int64)
+        self.sp = np.zeros((K, size), dtype=np.int64)       # species id
+        self.cid = np.zeros((K, size), dtype=np.int64)      # char id
+        self.node = np.zeros((K, size), dtype=np.int64)     # current node
+        self.step = np.zeros((K, size), dtype=np.int64)     # current step
+        self.medge = np.full((K, size), -1, dtype=np.int64) # edge key id of the last edge taken (-1 for none)
+        self.alive = np.zeros((K, size), dtype=bool)
+
+    # double the number of slots of the columns
+    def _grow(self):
+        for name in ('x', 'y', 'sp', 'cid', 'node', 'step', 'medge', 'alive'):
+            col = getattr(self, name)
+            new_col = np.full((self.K, 2*col.shape[1]), -1 if name == 'medge' else 0, dtype=col.dtype)
+            new_col[:, :col.shape[1]] = col
+            setattr(self, name, new_col)
+
+    # drop the dead slots of every episode (keeps the update order)
+    def _compact(self):
+        order = np.argsort(~self.alive, axis=1, kind='stable')
+        for name in ('x', 'y', 'sp', 'cid', 'node', 'step', 'medge', 'alive'):
+            setattr(self, name, np.take_along_axis(getattr(self, name), order, axis=1))
+        self.n = self.alive.sum(axis=1)
+
+
+    #######     UPDATES AND LOOPS    #######
+
+    # run every episode until it ends or has run n_steps ticks
+    def run(self, n_steps):
+        while self.stopEnded(n_steps):
+            self.update()
+
+    # take the episodes that are over out of the running ones (checked before each tick, as Episode.step does)
+    #   returns if any episode is still running
+    def stopEnded(self, n_steps):
+        if not self.built:
+            self._build()
+        ended = (self.n_alive == 0) | (self.steps - self.last_activity > self.inactive_limit) | \
+            (self.n_alive > self.max_entities) | (self.steps >= n_steps)
+        self.running &= ~ended
+        return bool(self.running.any())
+
+    # update every living entity of every running episode once
+    def update(self):
+        if not self.built:
+            self._build()
+        self.steps += 1
+        eps = np.flatnonzero(self.running)
+        if len(eps) == 0:
+            return
+        m = int(self.n[eps].max())
+        if m > 64 and 2*self.n_alive[eps].sum() < self.n[eps].sum():
+            self._compact()
+            m = int(self.n[eps].max())
+
+        # the entities alive at the start of the tick, in update order (entities created during the tick are not
+        #   updated) - an entity in a node its FSM doesn't have stops its episode on its turn
+        i, fs = np.nonzero(self.alive[eps, :m])
+        fe = eps[i]
+        N = len(fe)
+        if N == 0:
+            return
+        sp = self.sp[fe, fs]
+        node = self.node[fe, fs]
+        bad = node >= self.sp_nodes[sp]
+        g = np.where(bad, 0, self.node_base[sp] + node)
+        ops = self.g_op[g]
+
+        # the chars each entity's update changes and looks at, as bit masks of char ids: the chars of the entities its
+        #   action moves, kills or creates, of the other entities its action moves or kills, and the chars its action
+        #   looks for (see the tables above)
+        own = 1 << self.cid[fe, fs]
+        arg = np.where(self.g_carg[g] >= 0, 1 << np.maximum(self.g_carg[g], 0), 0)
+        writes = np.where(WRITES_OWN[ops], own, 0) | np.where(WRITES_ARG[ops], arg, 0)
+        hits = np.where(HITS_ARG[ops], arg, 0)
+        reads = np.where(READS_ARG[ops], arg, 0) | np.where(READS_ANY[ops], (1 << len(self.chars)) - 1, 0)
+        # the chars its edges look for (and its own position they are measured from)
+        checks = self.g_tmask[g]
+        checks |= np.where(checks != 0, own, 0)
+
+        # the last earlier entity of its episode each entity can't run in the same chunk as: all the actions of a chunk
+        #   run on the state before the chunk, and then all the edges on the state after it - so an entity can't look
+        #   for the chars an earlier one changes, be moved or killed by an earlier one, or change the chars an earlier
+        #   one's edges look for
+        last = np.maximum.reduce([self._lastBefore(writes, reads), self._lastBefore(hits, own), self._lastBefore(checks, writes)])
+        idx = np.arange(N)
+        last[bad] = idx[bad]
+
+        # the rows of each episode - every phase runs, in each episode, the chunk from its next entity to update up to
+        #   the first entity that can't run with the ones before it in the chunk
+        starts = np.flatnonzero(np.concatenate(([True], fe[1:] != fe[:-1])))
+        ends = np.append(starts[1:], N)
+        row_ep = np.repeat(np.arange(len(starts)), ends - starts)
+        cur = starts.copy()
+        act = np.arange(len(starts))
+        while True:
+            act = act[(cur[act] < ends[act]) & self.running[fe[starts[act]]]]
+            h = cur[act]
+            stuck = bad[h] & self.alive[fe[h], fs[h]]
+            for r in h[stuck].tolist():
+                self._fail(fe[r], AssertionError(f"Current node {node[r]} is greater than the number of nodes {self.sp_nodes[sp[r]]}"))
+            act, h = act[~stuck], h[~stuck]
+            if len(act) == 0:
+                break
+
+            head = np.full(len(starts), N)
+            head[act] = h
+            hr = head[row_ep]
+            cut = np.flatnonzero((last >= hr) & (idx > hr))
+            k = np.searchsorted(cut, h + 1)
+            end = np.minimum(np.append(cut, N)[k], ends[act])
+
+            n_rows = end - h
+            rows = np.repeat(h - np.cumsum(n_rows) + n_rows, n_rows) + np.arange(n_rows.sum())
+            rows = rows[self.alive[fe[rows], fs[rows]]]
+            e, s = fe[rows], fs[rows]
+            self._runActions(e, s, ops[rows], g[rows])
+            self.step[e, s] += 1
+            self._evalEdges(e, s)
+            self._addVisits(e, s)
+            cur[act] = end
+
+    # for each entity, the last earlier one whose mask a shares a bit with its mask b (-1 if there is none)
+    def _lastBefore(self, a, b):
+        bits = np.arange(len(self.chars))
+        idx = np.arange(len(a))
+        seen = np.maximum.accumulate(np.where((a[:,None] >> bits) & 1, idx[:,None], -1), axis=0)
+        seen = np.concatenate((np.full((1, len(bits)), -1), seen[:-1]))
+        return np.where((b[:,None] >> bits) & 1, seen, -1).max(axis=1, initial=-1)
+
+    # run the node actions of the entities of a chunk of each episode (by episode and then slot, in update order) on
+    #   the state before the chunk, as Entity.update runs them one by one (only the parts for the actions there are)
+    def _runActions(self, e, s, op, g):
+        if len(e) == 0:
+            return
+        has = (np.bincount(op, minlength=len(NODE_OPS)) > 0).tolist()
+        c = self.g_carg[g]
+        x, y = self.x[e, s], self.y[e, s]
+        n = len(e)
+
+        # the closest entity of the char take, chase and push go for
+        if has[OP_TAKE] or has[OP_CHASE] or has[OP_PUSH]:
+            aim = READS_ARG[op]
+            o = np.zeros(n, dtype=np.int64)
+            found = np.zeros(n, dtype=bool)
+            o[aim], found[aim] = self._closest(e[aim], s[aim], c[aim])
+        # the species add and transform create
+        if has[OP_ADD] or has[OP_TRANSFORM]:
+            make = (op == OP_ADD) | (op == OP_TRANSFORM)
+            new_sp = np.full(n, -1, dtype=np.int64)
+            new_sp[make] = self._groupSpecies(e[make], c[make])
+
+        # the entities that move or put a new entity next to them, and where to
+        if has[OP_MOVE] or has[OP_CHASE] or has[OP_PUSH] or has[OP_WALL] or has[OP_CLONE] or has[OP_ADD]:
+            draws = DRAWS[op]
+            if has[OP_PUSH]:
+                push = (op == OP_PUSH) & found
+                draws &= push | (op != OP_PUSH)
+            if has[OP_ADD]:
+                draws &= (new_sp >= 0) | (op != OP_ADD)
+            # chase goes east or west and then south or north (a random one of the two if both get closer)
+            if has[OP_CHASE]:
+                hx, hy = np.sign(self.x[e, o] - x), np.sign(self.y[e, o] - y)
+                chase = (op == OP_CHASE) & found & ((hx != 0) | (hy != 0))
+                both = chase & (hx != 0) & (hy != 0)
+                draws |= both
+            w = np.zeros(n, dtype=np.int64)
+            w[draws] = self._draw(e[draws])
+            d = w >> 30
+            dx, dy = POS_MOD[d,0], POS_MOD[d,1]
+            moves = draws & (op != OP_CLONE) & (op != OP_ADD)
+            if has[OP_CHASE]:
+                vert = np.where(both, (w >> 31) == 1, hx == 0)
+                dx = np.where(chase, np.where(vert, 0, hx), dx)
+                dy = np.where(chase, np.where(vert, hy, 0), dy)
+                moves |= chase
+            nx, ny = x + dx, y + dy
+            # push moves the target along if it steps onto it (and then the target's new position has to be walkable)
+            if has[OP_PUSH]:
+                onto = push & (nx == self.x[e, o]) & (ny == self.y[e, o])
+                valid = self._valid(e, np.where(onto, nx + dx, nx), np.where(onto, ny + dy, ny))
+            else:
+                valid = self._valid(e, nx, ny)
+
+            # the earliest entity on the new position of move_wall, clone and add
+            if has[OP_WALL] or has[OP_CLONE] or has[OP_ADD]:
+                at = draws & valid & READS_ANY[op]
+                occupied = np.zeros(n, dtype=bool)
+                blocked = np.zeros(n, dtype=bool)
+                oa, occupied[at] = self._entAt(e[at], nx[at], ny[at])
+                blocked[at] = occupied[at] & (self.cid[e[at], oa] == c[at])
+                moves &= ~blocked
+                born = at & ~occupied & (op != OP_WALL)
+                self._birth(e[born], np.where(op == OP_CLONE, self.sp[e, s], new_sp if has[OP_ADD] else 0)[born], nx[born], ny[born])
+
+            moved = moves & valid
+            if has[OP_PUSH]:
+                pushed = onto & valid
+                self._setPos(np.concatenate((e[moved], e[pushed])), np.concatenate((s[moved], o[pushed])),
+                             np.concatenate((nx[moved], nx[pushed] + dx[pushed])), np.concatenate((ny[moved], ny[pushed] + dy[pushed])))
+            else:
+                self._setPos(e[moved], s[moved], nx[moved], ny[moved])
+
+        # transform puts the new entity in place of the entity (after the entities clone and add create)
+        if has[OP_TRANSFORM]:
+            into = (op == OP_TRANSFORM) & (new_sp >= 0)
+            self._birth(e[into], new_sp[into], x[into], y[into])
+
+        # take kills the target, die and transform the entity itself
+        if has[OP_TAKE] or has[OP_DIE] or has[OP_TRANSFORM]:
+            gone = op == OP_DIE
+            if has[OP_TRANSFORM]:
+                gone |= into
+            if has[OP_TAKE]:
+                took = (op == OP_TAKE) & found
+                self._die(np.concatenate((e[took], e[gone])), np.concatenate((o[took], s[gone])))
+            else:
+                self._die(e[gone], s[gone])
+
+    # evaluate the edges leaving the current node of each entity (highest priority first, the first one that holds is taken)
+    #   the unconditional and step edges are checked at once, then the near edges in order of priority for the entities
+    #   that haven't taken an edge before them (the conditions don't change anything, so skipping them is safe)
+    def _evalEdges(self, e, s):
+        if len(e) == 0:
+            return
+        g = self.node_base[self.sp[e, s]] + self.node[e, s]
+        op = self.e_op[g]
+        narg = self.e_narg[g]
+        cond = op == E_NONE
+        step = op == E_STEP
+        if step.any():
+            cond |= step & (self.step[e, s][:,None] % np.where(step, narg, 1) == 0)
+        near = op == E_NEAR
+        if near.any():
+            near &= np.arange(op.shape[1]) < np.where(cond.any(axis=1), np.argmax(cond, axis=1), op.shape[1])[:,None]
+            for k in np.flatnonzero(near.any(axis=0)).tolist():
+                i = np.flatnonzero(near[:,k] & ~cond[:,:k].any(axis=1))
+                cond[i, k] = self._near(e[i], s[i], self.e_carg[g[i], k], narg[i, k])
+        k = np.argmax(cond, axis=1)
+        hit = cond[np.arange(len(e)), k]
+        self.node[e[hit], s[hit]] = self.e_dst[g[hit], k[hit]]
+        self.medge[e[hit], s[hit]] = self.e_key[g[hit], k[hit]]
+        # the last edge taken is cleared only if the node has edges and none of them held
+        clear = self.g_has_edges[g] & ~hit
+        self.medge[e[clear], s[clear]] = -1
+
+
+    #######     ENTITY HELPERS     #######
+
+    # the episodes of e (grouped by episode), how many times each one appears, and the rank of each entry in its episode
+    @staticmethod
+    def _ranks(e):
+        starts = np.flatnonzero(np.concatenate(([True], e[1:] != e[:-1])))
+        count = np.diff(np.append(starts, len(e)))
+        return e[starts], count, np.arange(len(e)) - np.repeat(starts, count)
+
+    # the next random direction word of each entry of e (an episode can appear many times, grouped, in the order
+    #   its words are drawn)
+    def _draw(self, e):
+        if len(e) == 0:
+            return np.zeros(0, dtype=np.int64)
+        ue, count, rank = self._ranks(e)
+        short = self.wptr[ue] + count > self.wend[ue]
+        for u, k in zip(ue[short].tolist(), count[short].tolist()):
+            self._drawWords(u, k)
+        words = self.words[e, self.wptr[e] + rank]
+        self.wptr[ue] += count
+        return words
+
+    # draw blocks of words from the generator of an episode until it has k words not used yet
+    def _drawWords(self, e, k):
+        blocks = [self.words[e, self.wptr[e]:self.wend[e]]]
+        have = len(blocks[0])
+        while have < k:
+            blocks.append(self.rngs[e].integers(0, 2**32, size=self.rng_block, dtype=np.uint32))
+            have += self.rng_block
+        if have > self.words.shape[1]:
+            words = np.zeros((self.K, max(have, 2*self.words.shape[1])), dtype=np.int64)
+            words[:, :self.words.shape[1]] = self.words
+            self.words = words
+        self.words[e, :have] = np.concatenate(blocks)
+        self.wptr[e] = 0
+        self.wend[e] = have
+
+    # check if positions are walkable in the map of their episode
+    def _valid(self, e, x, y):
+        ok = (x >= 0) & (x < self.walk.shape[2]) & (y >= 0) & (y < self.walk.shape[1])
+        ok[ok] = self.walk[e[ok], y[ok], x[ok]]
+        return ok
+
+    # nearest living entity of a char id to each entity, not counting the entity itself (ties go to the earliest slot)
+    #   returns the slots and if there is one
+    def _closest(self, e, s, c):
+        m = int(self.n[e].max()) if len(e) else 1
+        ar = np.arange(len(e))
+        cand = self.alive[e, :m] & (self.cid[e, :m] == c[:,None])
+        cand[ar, s] = False
+        d = np.abs(self.x[e, :m] - self.x[e, s][:,None]) + np.abs(self.y[e, :m] - self.y[e, s][:,None])
+        o = np.argmin(np.where(cand, d, np.iinfo(np.int64).max), axis=1)
+        return o, cand[ar, o]
+
+    # earliest living entity on a position of each episode - returns the slots and if there is one
+    def _entAt(self, e, x, y):
+        m = int(self.n[e].max()) if len(e) else 1
+        on = self.alive[e, :m] & (self.x[e, :m] == x[:,None]) & (self.y[e, :m] == y[:,None])
+        o = np.argmax(on, axis=1)
+        return o, on[np.arange(len(e)), o]
+
+    # check if another living entity of a char id is within a range of each entity
+    def _near(self, e, s, c, rng):
+        m = int(self.n[e].max()) if len(e) else 1
+        hit = (self.alive[e, :m] & (self.cid[e, :m] == c[:,None]) &
+               (np.abs(self.x[e, :m] - self.x[e, s][:,None]) <= rng[:,None]) &
+               (np.abs(self.y[e, :m] - self.y[e, s][:,None]) <= rng[:,None]))
+        hit[np.arange(len(e)), s] = False
+        return hit.any(axis=1)
+
+    # the species of a char id in the species dictionary of each episode (an episode without one stops on the
+    #   KeyError the reference engine raises)
+    def _groupSpecies(self, e, c):
+        sp = self.grp_sp[self.ep_grp[e], c]
+        for ei, ci in zip(e[sp < 0].tolist(), c[sp < 0].tolist()):
+            self._fail(ei, KeyError(self.chars[ci]))
+        return sp
+
+    # move entities
+    def _setPos(self, e, s, x, y):
+        self.x[e, s] = x
+        self.y[e, s] = y
+        self.last_activity[e] = self.steps
+
+    # remove entities
+    def _die(self, e, s):
+        self.alive[e, s] = False
+        np.subtract.at(self.n_alive, e, 1)
+        self.last_activity[e] = self.steps
+
+    # create new entities of species ids on positions in the next free slots of their episodes (grouped by episode,
+    #   in the order they are created)
+    def _birth(self, e, sp, x, y):
+        if len(e) == 0:
+            return
+        ue, count, rank = self._ranks(e)
+        while (self.n[ue] + count).max() > self.x.shape[1]:
+            self._grow()
+        r = self.n[e] + rank
+        self.x[e, r], self.y[e, r] = x, y
+        self.sp[e, r] = sp
+        self.cid[e, r] = self.sp_cid[sp]
+        self.node[e, r] = 0
+        self.step[e, r] = 0
+        self.medge[e, r] = -1
+        self.alive[e, r] = True
+        self.n[ue] += count
+        self.n_alive[ue] += count
+        self.last_activity[ue] = self.steps
+
+    # stop an episode on an error
+    def _fail(self, e, error):
+        self.errors[e] = error
+        self.running[e] = False
+
+    # record the visited nodes and taken edges of updated entities
+    def _addVisits(self, e, s):
+        grp = self.ep_grp[e]
+        sp = self.sp[e, s]
+        node = self.node[e, s]
+        ok = node < self.sp_nodes[sp]
+        self.vnode[e[ok], (self.node_base[sp] + node - self.grp_nbase[grp])[ok]] = True
+        for ei, si, ni in zip(e[~ok].tolist(), sp[~ok].tolist(), node[~ok].tolist()):
+            self.extra_visits.setdefault(ei, set()).add((si, ni))
+        k = self.medge[e, s]
+        took = k >= 0
+        self.vedge[e[took], (k - self.grp_kbase[grp])[took]] = True
+
+
+    #######     EPISODE RESULTS     #######
+
+    # the chars of the living entities of an episode (in update order)
+    def entChars(self, e):
+        if not self.built:
+            self._build()
+        return [self.chars[c] for c in self.cid[e, :self.n[e]][self.alive[e, :self.n[e]]].tolist()]
+
+    # (char, x, y, node) of the living entities of an episode (in update order)
+    def entStates(self, e):
+        if not self.built:
+            self._build()
+        r = np.flatnonzero(self.alive[e, :self.n[e]])
+        return [(self.chars[c], x, y, node) for c, x, y, node in
+                zip(self.cid[e, r].tolist(), self.x[e, r].tolist(), self.y[e, r].tolist(), self.node[e, r].tolist())]
+
+    # the visited nodes and taken edges of an episode by character (like Fortress.CHAR_VISIT_TREE)
+    def visitTree(self, e):
+        if not self.built:
+            self._build()
+        visits = {c: {'nodes':set(v['nodes']),'edges':set(v['edges'])} for c, v in self.init_visits[e].items()}
+        g = self.ep_grp[e]
+        for i in np.flatnonzero(self.vnode[e]).tolist():
+            node = self.grp_nbase[g] + i
+            s = int(np.searchsorted(self.node_base, node, side='right')) - 1
+            visits.setdefault(self.species[s].char, {'nodes':set(),'edges':set()})['nodes'].add(int(node - self.node_base[s]))
+        for s, node in self.extra_visits.get(e, ()):
+            visits.setdefault(self.species[s].char, {'nodes':set(),'edges':set()})['nodes'].add(node)
+        for i in np.flatnonzero(self.vedge[e]).tolist():
+            s, key = self.keys[self.grp_kbase[g] + i]
+            visits.setdefault(self.species[s].char, {'nodes':set(),'edges':set()})['edges'].add(key)
+        return visits
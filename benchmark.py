@@ -0,0 +1,123 @@
+# times the simulation of the bundled fortresses (FORTS/*.txt) the way the evolution runs them
+# every fortress is run once per log level with the same seeds, and the end states are checked to be the same
+# Usage: python benchmark.py [-b backend] [-n n_sim_steps] [-s n_seeds] [-r repeats] [-l log levels]
+#        python benchmark.py -i [-r repeats] [-t max seconds]   (time importing the simulation modules instead)
+
+import sys
+import json
+import glob
+import time
+import argparse
+import subprocess
+
+from engine import Engine
+from fortress import LOG_LEVELS
+from equivalence import setupScenario, fortressDigest
+
+
+# the modules a simulation worker imports, and the packages they must leave to the code that needs them
+#   (plotting, rendering, Ray, TensorBoard, Hydra and SciPy are imported where they are used)
+CORE_MODULES = ('entities', 'fortress', 'engine', 'evo_utils')
+HEAVY_MODULES = ('scipy', 'matplotlib', 'ray', 'tensorboardX', 'hydra', 'omegaconf', 'tqdm', 'curses', 'render_curses', 'yaml')
+
+
+# run a fortress until it ends (or for n_sim_steps) - returns (seconds, ticks, end state)
+#   only the simulation is timed, not loading the config and the fortress definition
+def runFortress(filename, seed, backend, log_level, n_sim_steps=100, config_file="CONFIGS/gamma_config.yaml"):
+    engine = Engine(config_file, init_seed=seed, backend=backend, log_level=log_level)
+    setupScenario(engine, 'fort', filename, seed)
+    fortress = engine.fortress
+    start = time.perf_counter()
+    ticks = 0
+    while ticks < n_sim_steps and not (fortress.terminate() or fortress.inactive() or fortress.overpop()):
+        engine.update(True)
+        ticks += 1
+    elapsed = time.perf_counter() - start
+    return elapsed, ticks, (fortressDigest(fortress), fortress.end_cause, fortress.steps)
+
+
+# time every fortress at each log level - returns {filename: {log level: seconds}} and the fortresses that ended differently
+#   the levels take turns and each run is repeated, keeping the fastest time (the runs are short enough for the noise to matter)
+def benchmarkLogLevels(forts, seeds, levels, backend=None, n_sim_steps=100, config_file="CONFIGS/gamma_config.yaml", repeats=3):
+    times = {}
+    mismatched = []
+    for filename in forts:
+        times[filename] = {lvl: 0.0 for lvl in levels}
+        for seed in seeds:
+            best = {lvl: float('inf') for lvl in levels}
+            ends = {}
+            for _ in range(repeats):
+                for lvl in levels:
+                    elapsed, _, end = runFortress(filename, seed, backend, lvl, n_sim_steps, config_file)
+                    best[lvl] = min(best[lvl], elapsed)
+                    ends[lvl] = end
+            for lvl in levels:
+                times[filename][lvl] += best[lvl]
+            if any(e != ends[levels[0]] for e in ends.values()):
+                mismatched.append((filename, seed))
+    return times, mismatched
+
+
+# time importing each module in a new interpreter - returns {module: (seconds, heavy packages it loaded)}
+#   each import is repeated in a new process, keeping the fastest time
+def benchmarkImports(modules=CORE_MODULES, repeats=5):
+    code = ("import sys, time, json\n"
+            "start = time.perf_counter()\n"
+            "import {0}\n"
+            "elapsed = time.perf_counter() - start\n"
+            "print(json.dumps([elapsed, sorted(set(m.split('.')[0] for m in sys.modules) & set({1!r}))]))")
+    results = {}
+    for module in modules:
+        best, heavy = float('inf'), []
+        for _ in range(repeats):
+            out = subprocess.run([sys.executable, "-c", code.format(module, HEAVY_MODULES)],
+                                 capture_output=True, text=True, check=True).stdout
+            elapsed, heavy = json.loads(out.splitlines()[-1])
+            best = min(best, elapsed)
+        results[module] = (best, heavy)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", "--backend", type=str, default=None, help='Simulation backend (object, scheduled or soa - default from the config)')
+    parser.add_argument("-n", "--n_sim_steps", type=int, default=100, help='Number of simulation steps per run')
+    parser.add_argument("-s", "--n_seeds", type=int, default=5, help='Number of seeds per fortress')
+    parser.add_argument("-l", "--log_levels", type=str, nargs="+", default=['all', 'none'], help='Log levels to compare (the first one is the baseline)')
+    parser.add_argument("-r", "--repeats", type=int, default=3, help='Number of times each run is repeated (the fastest one counts)')
+    parser.add_argument("-c", "--config", type=str, default="CONFIGS/gamma_config.yaml", help='Config file')
+    parser.add_argument("-i", "--imports", action="store_true", help='Time importing the simulation modules instead')
+    parser.add_argument("-t", "--max_import_time", type=float, default=None, help='Fail if importing a module takes longer (seconds)')
+    args = parser.parse_args()
+
+    if args.imports:
+        failed = False
+        print(f"{'module':<28}{'import':>10}  heavy packages loaded")
+        for module, (elapsed, heavy) in benchmarkImports(CORE_MODULES, args.repeats).items():
+            slow = args.max_import_time is not None and elapsed > args.max_import_time
+            failed = failed or slow or bool(heavy)
+            print(f"{module:<28}{elapsed:>9.3f}s  {', '.join(heavy) if heavy else '-'}{'  (too slow)' if slow else ''}")
+        sys.exit(1 if failed else 0)
+
+    for lvl in args.log_levels:
+        assert lvl in LOG_LEVELS, f"Unknown log level {lvl}"
+
+    forts = sorted(glob.glob("FORTS/*.txt"))
+    times, mismatched = benchmarkLogLevels(forts, range(args.n_seeds), args.log_levels, args.backend, args.n_sim_steps, args.config, args.repeats)
+
+    base = args.log_levels[0]
+    print(f"{'fortress':<28}" + "".join(f"{lvl:>10}" for lvl in args.log_levels) + "".join(f"{'x ' + lvl:>10}" for lvl in args.log_levels[1:]))
+    totals = {lvl: 0.0 for lvl in args.log_levels}
+    for filename, t in times.items():
+        for lvl in args.log_levels:
+            totals[lvl] += t[lvl]
+        row = "".join(f"{t[lvl]:>9.3f}s" for lvl in args.log_levels)
+        row += "".join(f"{t[base] / t[lvl]:>9.2f}x" for lvl in args.log_levels[1:])
+        print(f"{filename:<28}{row}")
+    row = "".join(f"{totals[lvl]:>9.3f}s" for lvl in args.log_levels)
+    row += "".join(f"{totals[base] / totals[lvl]:>9.2f}x" for lvl in args.log_levels[1:])
+    print(f"{'total':<28}{row}")
+
+    for filename, seed in mismatched:
+        print(f"DIFFERENT END: {filename} (seed {seed})")
+    sys.exit(1 if mismatched else 0)
@@ -0,0 +1,206 @@
+import os
+import gc
+import json
+
+import numpy as np
+
+from entities import Entity, Species
+from fortress import Fortress
+from eventlog import EventLog
+from soa_backend import SoABackend
+from scheduler import Scheduler
+from simconfig import SimConfig
+
+
+CHECKPOINT_MAGIC = "agentik-checkpoint"
+CHECKPOINT_VERSION = 1      # bump when the layout changes (older files are refused instead of being misread)
+
+
+# the whole state of an engine in the middle of an episode, written to a file the run can be resumed from
+#   the file is an uncompressed .npz archive: the entities as numpy columns in update order (id, species, position,
+#   seq, step, node and the edge they last moved through), the map, the unused random direction words and the log
+#   events as arrays, and everything else (config, counters, species FSMs, visit trees, log texts and the exact
+#   bit-generator states of rng_sim and rng_init) as one JSON array
+#   nothing is pickled, so loading a checkpoint can't run code; an updated engine continues bit-identically
+#   after loading (a cycle detector that was on starts watching again from the loaded state)
+def saveCheckpoint(engine, filename):
+    f = engine.fortress
+    if engine.scheduler is not None:
+        engine.scheduler.flush()    # bring cur_step and moved_edge of the parked entities up to date
+
+    # species table - the ones of the characters first, then the ones entities have of their own
+    species = {}
+    for s in f.CHARACTER_DICT.values():
+        species.setdefault(s, len(species))
+    ents = list(f.entities.values())
+    for e in ents:
+        species.setdefault(e.species, len(species))
+
+    # edge keys the entities last moved through
+    edge_ids = {}
+    edge_col = [-1 if e.moved_edge is None else edge_ids.setdefault(e.moved_edge, len(edge_ids)) for e in ents]
+
+    meta = {
+        'magic': CHECKPOINT_MAGIC,
+        'version': CHECKPOINT_VERSION,
+        'config': engine.config.asDict(),
+        'config_file': engine.config.filename,
+        'seed': engine.seed,
+        'backend': engine.backend,
+        'sim_tick': engine.sim_tick,
+        'cycles': engine.cycles is not None,
+        'init_ent_str': engine.init_ent_str,
+        'init_ents': hasattr(engine, 'init_ents'),
+        'fortress': {
+            'width': f.width, 'height': f.height, 'border': f.border, 'floor': f.floor, 'seed': f.seed,
+            'steps': f.steps, 'ent_seq': f.ent_seq, 'next_id': f.next_id, 'last_activity': f.last_activity,
+            'end_cause': f.end_cause, 'max_entities': f.max_entities, 'ring_search_min': f.ring_search_min,
+            'max_aggregate_fsm_nodes': f.max_aggregate_fsm_nodes,
+            'max_nodes_per_type': getattr(f, 'max_nodes_per_type', None),
+            'log_level': f.log_level,
+        },
+        'rng': {
+            'sim': f.rng_sim.bit_generator.state,
+            'init': f.rng_init.bit_generator.state,
+            'block': f.rng_block,
+            'compat': f.rng_compat,
+            'dir_i': f.dir_i,
+            'dir_live': f.dir_src is f.rng_sim,     # the words left were drawn from the current rng_sim
+        },
+        'species': [{'char': s.char, 'nodes': s.nodes, 'edges': s.edges, 'avail_node_types': s.avail_node_types}
+                    for s in species],
+        'characters': {c: species[s] for c, s in f.CHARACTER_DICT.items()},
+        'visits': {c: {'nodes': sorted(v['nodes']), 'edges': sorted(v['edges'])} for c, v in f.CHAR_VISIT_TREE.items()},
+        'edge_keys': list(edge_ids),
+        'log': {'capacity': f.log.capacity, 'drop': sorted(f.log.drop), 'block': f.log.block},
+    }
+    events = f.log.events()
+    k = len(events)
+    meta['log']['texts'] = [f.log.texts[f.log._slot(i)] for i in range(k)]
+
+    init_ents = getattr(engine, 'init_ents', [])
+    columns = {
+        'ent_id': np.array([int(e.id, 16) for e in ents], dtype=np.int64),
+        'ent_species': np.array([species[e.species] for e in ents], dtype=np.int32),
+        'ent_pos': np.array([[int(e.pos[0]), int(e.pos[1])] for e in ents], dtype=np.int32).reshape(-1, 2),
+        'ent_seq': np.array([e.seq for e in ents], dtype=np.int64),
+        'ent_step': np.array([e.cur_step for e in ents], dtype=np.int64),
+        'ent_node': np.array([e.cur_node for e in ents], dtype=np.int32),
+        'ent_edge': np.array(edge_col, dtype=np.int32),
+        'fortmap': np.asarray(f.fortmap),
+        'dir_words': np.array(f.dir_words, dtype=np.uint32),
+        'log_events': events,
+        'init_char': np.array([ord(e['char']) for e in init_ents], dtype=np.uint32),
+        'init_pos': np.array([[-1, -1] if e['pos'] is None else [int(e['pos'][0]), int(e['pos'][1])] for e in init_ents],
+                             dtype=np.int32).reshape(-1, 2),
+        'meta': np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8),
+    }
+
+    # written next to the file and moved in place, so a run killed while saving keeps its last checkpoint
+    tmp = filename + ".tmp"
+    with open(tmp, 'wb') as file:
+        np.savez(file, **columns)
+    os.replace(tmp, filename)
+
+
+# put the state saved in a checkpoint in an engine (in place of its config, fortress and backends)
+def loadCheckpoint(engine, filename):
+    with np.load(filename, allow_pickle=False) as data:
+        columns = {k: data[k] for k in data.files}
+    meta = json.loads(columns['meta'].tobytes().decode('utf-8'))
+    assert meta.get('magic') == CHECKPOINT_MAGIC, f"{filename} is not an engine checkpoint"
+    assert meta['version'] == CHECKPOINT_VERSION, (f"Checkpoint version {meta['version']} is not supported"
+                                                   f" (expected {CHECKPOINT_VERSION})")
+
+    # the entities are a handful of new objects each that can't be garbage yet, so the collector is held off until
+    #   they are all in place (otherwise it scans the whole heap over and over on a large fortress)
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        _restore(engine, columns, meta)
+    finally:
+        if enabled:
+            gc.enable()
+
+# rebuild the engine state from the columns and metadata of a checkpoint
+def _restore(engine, columns, meta):
+    # the engine and a fortress with the saved map
+    fm = meta['fortress']
+    engine.config = SimConfig(meta['config'], meta.get('config_file'))
+    engine.seed = meta['seed']
+    engine.backend = meta['backend']
+    engine.sim_tick = meta['sim_tick']
+    engine.init_ent_str = meta['init_ent_str']
+    if meta['init_ents']:
+        engine.init_ents = [{'char': chr(c), 'pos': None if x < 0 else [x, y]}
+                            for c, (x, y) in zip(columns['init_char'].tolist(), columns['init_pos'].tolist())]
+    engine.init_snapshot = None
+
+    f = Fortress(engine.config, fm['width'], fm['height'], fm['border'], fm['floor'], seed=fm['seed'])
+    f.fortmap = columns['fortmap']
+    f.updateWalkable()
+    f.setLogLevel(fm['log_level'])
+    f.max_entities = fm['max_entities']
+    f.ring_search_min = fm['ring_search_min']
+    f.max_aggregate_fsm_nodes = fm['max_aggregate_fsm_nodes']
+    if fm['max_nodes_per_type'] is not None:
+        f.max_nodes_per_type = fm['max_nodes_per_type']
+
+    # species and tree visits
+    species = []
+    for s in meta['species']:
+        sp = Species(f, s['char'], nodes=s['nodes'], edges=s['edges'])
+        sp.avail_node_types = s['avail_node_types']
+        species.append(sp)
+    f.CHARACTER_DICT = {c: species[i] for c, i in meta['characters'].items()}
+    f.CHAR_VISIT_TREE = {c: {'nodes': set(v['nodes']), 'edges': set(v['edges'])} for c, v in meta['visits'].items()}
+
+    # entities and the fortress indexes (built in update order, like the fortress would have added them)
+    edge_keys = meta['edge_keys']
+    ids = ['%04x' % i for i in columns['ent_id'].tolist()]
+    ents = [Entity(f, species=species[s], ent_id=i) for i, s in zip(ids, columns['ent_species'].tolist())]
+    ent_grid, char_ents, char_grid = {}, {}, {}
+    for ent, (x, y), seq, step, node, k in zip(ents, columns['ent_pos'].tolist(), columns['ent_seq'].tolist(),
+                                                columns['ent_step'].tolist(), columns['ent_node'].tolist(),
+                                                columns['ent_edge'].tolist()):
+        ent.pos = [x, y]
+        ent.seq = seq
+        ent.cur_step = step
+        ent.cur_node = node
+        ent.moved_edge = None if k < 0 else edge_keys[k]
+        c = ent.species.char
+        if c not in char_ents:
+            char_ents[c] = {}
+            char_grid[c] = {}
+        char_ents[c][ent.id] = ent
+        ent_grid.setdefault((x, y), []).append(ent)
+        char_grid[c].setdefault((x, y), []).append(ent)
+    f.steps = fm['steps']
+    f.setEntities(dict(zip(ids, ents)), ent_grid, char_ents, char_grid, fm['next_id'])
+    f.ent_seq = fm['ent_seq']
+    f.last_activity = fm['last_activity']
+    f.end_cause = fm['end_cause']
+
+    # random generators, with the direction words drawn but not used yet
+    rng = meta['rng']
+    f.rng_sim.bit_generator.state = rng['sim']
+    f.rng_init.bit_generator.state = rng['init']
+    f.rng_block = rng['block']
+    f.rng_compat = rng['compat']
+    f.dir_words = columns['dir_words'].tolist()
+    f.dir_i = rng['dir_i']
+    f.dir_src = f.rng_sim if rng['dir_live'] else None
+
+    # log
+    lm = meta['log']
+    f.log = EventLog(lm['capacity'], lm['drop'], lm['block'])
+    f.log.restore(columns['log_events'], lm['texts'])
+
+    # backends (they load the entities on their first update)
+    engine.fortress = f
+    engine.soa = SoABackend(f) if engine.backend == 'soa' else None
+    engine.scheduler = Scheduler(f) if engine.backend == 'scheduled' else None
+    f.scheduler = engine.scheduler
+    engine.cycles = None
+    if meta['cycles']:
+        engine.detectCycles()
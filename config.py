@@ -52,10 +52,19 @@ class EvoConfig:
     bcs: list = dataclasses.field(default_factory=lambda: ['n_entities', 'n_nodes'])
     # Number of processes to use for simulation
     n_proc: int = 10
+    # Pool of processes to simulate with (if n_proc != 1): 'ray' or 'local' (multiprocessing on this node, without
+    #   Ray - the genomes and results go through shared memory, see local_pool.py)
+    evaluator: str = "ray"
+    # Steady-state MAP-Elites: the workers are kept busy with mutants that are added to the archive one by one as
+    #   they are evaluated, instead of a generation at a time (a "generation" is then `pop_size` evaluations)
+    steady_state: bool = False
     # Number of simulations to run per evaluation
     n_sims: int = 5
     # Number of steps per episode
     n_steps_per_episode: int = 100
+    # What the fortresses log while they are evaluated: 'all', 'text' or 'none'
+    #   (nothing reads the log during evaluation; rendered fortresses always log everything)
+    log_level: str = "none"
     # Name of hyperparameter sweep (if applicable)
     sweep_name: str = "none"
     # When aggregating archives for cross-evaluation, re-aggregate rather than
@@ -0,0 +1,114 @@
+import math
+
+from entities import EDGE_OPS
+
+
+# detects when the fortress settles into a periodic orbit (e.g. pushers bouncing or a loop of idle and step edges)
+#   keeps a Zobrist-style hash of the state - the XOR of a key per entity hashed from (species, position, node,
+#   step phase) plus keys for the tick phase and the random stream position - updated by the fortress whenever an
+#   entity is added, moved, removed or changes node, so it costs nothing for the entities that stay put
+#   the step phase of an entity is its cur_step mod the LCM of the step edges of its species, which is all the
+#   step edges can see; as every entity is updated every tick, cur_step - tick never changes for an entity
+#   a hash seen at an earlier tick is only a candidate: the exact state is compared again one period later and
+#   the cycle is reported only if it matches, so a repeat is always a real one (a random direction drawn in
+#   between changes the random stream, so only the orbits that draw nothing can repeat)
+class CycleDetector():
+    def __init__(self, fortress):
+        self.fortress = fortress
+        self.periods = {}       # species -> (compiled FSM, LCM of its step edges)
+        self.reset()
+
+    # forget the state and rebuild it from the current entities
+    def reset(self):
+        self.ents = {}          # entity -> (cur_step - tick when added, step period, key in the hash)
+        self.h = 0
+        self.lcm = 1            # LCM of the step edges of every species seen
+        self.seen = {}          # state hash -> last tick it was seen at
+        self.verify = None      # (tick, period, exact state) of a candidate repeat
+        for ent in self.fortress.entities.values():
+            self.entAdded(ent)
+
+    # LCM of the step edges of a species (the step counter only matters modulo this)
+    def _period(self, species):
+        fsm = species.compileFSM()
+        if self.periods.get(species, (None,))[0] is not fsm:
+            p = 1
+            for ops, edges in zip(fsm.edge_ops, fsm.out_edges):
+                for op, (_, args, _, _) in zip(ops, edges):
+                    if op == EDGE_OPS['step'] and args[0] != 0:
+                        p = math.lcm(p, abs(args[0]))
+            self.periods[species] = (fsm, p)
+        return self.periods[species][1]
+
+    # key of an entity in the hash (the tuple hash mixes the features well enough; collisions only cost a check)
+    def _entKey(self, ent, phase):
+        return hash((ent.species, ent.pos[0], ent.pos[1], ent.cur_node, phase))
+
+
+    #######     FORTRESS EVENTS     #######
+
+    def entAdded(self, ent):
+        offset = ent.cur_step - self.fortress.steps
+        period = self._period(ent.species)
+        key = self._entKey(ent, offset % period)
+        self.ents[ent] = (offset, period, key)
+        self.h ^= key
+        if self.lcm % period:
+            # the tick phase is kept modulo a new LCM, so the earlier hashes can't be compared anymore
+            self.lcm = math.lcm(self.lcm, period)
+            self.seen = {}
+            self.verify = None
+
+    # an entity moved or changed node (the edges of an entity that just died still change its node)
+    def entChanged(self, ent):
+        entry = self.ents.get(ent)
+        if entry is None:
+            return
+        offset, period, key = entry
+        new_key = self._entKey(ent, offset % period)
+        self.ents[ent] = (offset, period, new_key)
+        self.h ^= key ^ new_key
+
+    def entRemoved(self, ent):
+        _, _, key = self.ents.pop(ent)
+        self.h ^= key
+
+
+    #######     DETECTION     #######
+
+    # position of the random streams the simulation draws from
+    def _rngPos(self):
+        f = self.fortress
+        return (f.dir_i, len(f.dir_words), str(f.rng_sim.bit_generator.state))
+
+    # hash of the whole state at the current tick
+    def stateHash(self):
+        return self.h ^ hash(('tick', self.fortress.steps % self.lcm, self._rngPos()))
+
+    # the exact state the hash stands for (the entities in update order)
+    def _exactState(self):
+        steps = self.fortress.steps
+        ents = []
+        for e in self.fortress.entities.values():
+            offset, period, _ = self.ents[e]
+            ents.append((e.species, int(e.pos[0]), int(e.pos[1]), e.cur_node, (offset + steps) % period))
+        return tuple(ents), self._rngPos()
+
+    # call after every tick - returns the period once the state is proven to repeat (None until then)
+    #   from then on the state after any number of whole periods is the same as now, and so are the tree visits
+    def check(self):
+        tick = self.fortress.steps
+        h = self.stateHash()
+        if self.verify is not None:
+            v_tick, period, state = self.verify
+            if tick < v_tick + period:
+                self.seen[h] = tick
+                return None
+            self.verify = None
+            if self._exactState() == state:
+                return period
+        t0 = self.seen.get(h)
+        self.seen[h] = tick
+        if t0 is not None:
+            self.verify = (tick, tick - t0, self._exactState())
+        return None
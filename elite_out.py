@@ -1,7 +1,7 @@
 import os
-import pickle
 import numpy as np
 from tqdm import tqdm
+from archive_file import ARCHIVE_EXT, load_archive
 from evo_utils import EvoIndividual
 
 OUTPUT_FOLDER = "QD_EXP/ELITE_CHAR_DEF"
@@ -24,65 +24,64 @@ def convert_pkl_to_txt_def():
     archive_files = []
     for root, dirs, files in os.walk(SAVE_FOLDER):
         for file in files:
-            if file.endswith(".pkl"):
+            if file.endswith(".pkl") or file.endswith(ARCHIVE_EXT):
                 archive_files.append(os.path.join(root, file))
 
           
     for archive_path in archive_files:
         
-        # load each archive pkl file
+        # load each archive file (or pickle)
         archive_name = ""
-        with open(archive_path , 'rb') as f:
-            archive = pickle.load(f)
-            archive_name = archive_path.split("/")[-1].split(".")[0]
-        
-            # get all valid (not None) individuals 
-            valid_xys = np.argwhere(archive != None)
-            valid_inds = [archive[xy[0], xy[1]] for xy in valid_xys]
-            ind: EvoIndividual
-
-            # save the best in each cell based on setup
-
-            # write each individual to a txt file
-            with tqdm(total=(len(valid_inds))) as pbar:         
-                for i in range(len(valid_inds)):
-                    ind = valid_inds[i]
-                    output_filepath = f"{OUTPUT_FOLDER}/{archive_name}_f[{ind.score:.3f}]_xy[{str(valid_xys[i])}]-[{ind.bc_sim_vals[0]:.3f},{ind.bc_sim_vals[1]:.3f}].txt"
-                    f = open(output_filepath, "w")
-                    f.write(ind.engine.init_ent_str)
-                    f.write("\n\n")
-
-
-                    # write the positions string
-                    ind.engine.resetFortress()
-                    f.write("-- INIT ENT POS --\n")
-                    f.write("\n".join(ind.engine.fortress.exportEntPosList()))
-                    f.write("\n\n")
-
-                    # write the fortress string
-                    f.write("-- INIT FORT --\n")
+        archive = load_archive(archive_path)
+        archive_name = archive_path.split("/")[-1].split(".")[0]
+    
+        # get all valid (not None) individuals 
+        valid_xys = np.argwhere(archive != None)
+        valid_inds = [archive[xy[0], xy[1]] for xy in valid_xys]
+        ind: EvoIndividual
+
+        # save the best in each cell based on setup
+
+        # write each individual to a txt file
+        with tqdm(total=(len(valid_inds))) as pbar:         
+            for i in range(len(valid_inds)):
+                ind = valid_inds[i]
+                output_filepath = f"{OUTPUT_FOLDER}/{archive_name}_f[{ind.score:.3f}]_xy[{str(valid_xys[i])}]-[{ind.bc_sim_vals[0]:.3f},{ind.bc_sim_vals[1]:.3f}].txt"
+                f = open(output_filepath, "w")
+                f.write(ind.engine.init_ent_str)
+                f.write("\n\n")
+
+
+                # write the positions string
+                ind.engine.resetFortress()
+                f.write("-- INIT ENT POS --\n")
+                f.write("\n".join(ind.engine.fortress.exportEntPosList()))
+                f.write("\n\n")
+
+                # write the fortress string
+                f.write("-- INIT FORT --\n")
+                f.write(ind.engine.fortress.renderEntities())
+                f.write("\n\n")
+
+                # simulate a bit and show the output fortress
+                if SIMULATE_STEPS > 0:
+                    # set the seed so it doesn't have a cow (this ind pickle uses an old version of the fortress)
+                    ind.engine.fortress.rng_init = np.random.default_rng(7)
+                    ind.engine.fortress.rng_sim = np.random.default_rng(0)
+
+                    ind.simulate_fortress_once(n_steps=SIMULATE_STEPS, early_stop=False)
+                    f.write(f"\n-- FORT @ STEPS {SIMULATE_STEPS} --\n")
                     f.write(ind.engine.fortress.renderEntities())
                     f.write("\n\n")
+                    
+                f.write("\n")
 
-                    # simulate a bit and show the output fortress
-                    if SIMULATE_STEPS > 0:
-                        # set the seed so it doesn't have a cow (this ind pickle uses an old version of the fortress)
-                        ind.engine.fortress.rng_init = np.random.default_rng(7)
-                        ind.engine.fortress.rng_sim = np.random.default_rng(0)
-
-                        ind.simulate_fortress_once(n_steps=SIMULATE_STEPS)
-                        f.write(f"\n-- FORT @ STEPS {SIMULATE_STEPS} --\n")
-                        f.write(ind.engine.fortress.renderEntities())
-                        f.write("\n\n")
-                        
-                    f.write("\n")
-
-                    # check against the superlatives
-                    isBest(ind,output_filepath)
+                # check against the superlatives
+                isBest(ind,output_filepath)
 
-                    pbar.update(1);
+                pbar.update(1);
 
-        
+    
         # print a report for the filename for the highest and lowest of each 
         with open(f"QD_EXP/_REPORT-{archive_name}.txt", "w+") as rpt:
             report = "== REPORT ==\n"
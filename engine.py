@@ -1,20 +1,24 @@
 import datetime
 import random
-import yaml
 
 import numpy as np
 
 from entities import Entity
 from fortress import Fortress
+from soa_backend import SoABackend
+from scheduler import Scheduler
+from cycles import CycleDetector
+from snapshot import FortSnapshot
+from checkpoint import saveCheckpoint, loadCheckpoint
+from simconfig import loadConfig
 
 class Engine():
     fortress: Fortress
 
-    def __init__(self, config_file, init_seed=None):
+    def __init__(self, config_file, init_seed=None, backend=None, log_level=None):
 
-        # load the config file
-        with open(config_file, 'r') as file:
-            self.config = yaml.safe_load(file)
+        # load the config file (parsed once per process and shared, see simconfig.py)
+        self.config = loadConfig(config_file)
 
         # set the random seed
         if init_seed is None:
@@ -33,23 +37,43 @@ class Engine():
         # define the fortress
         self.fortress = Fortress(self.config, width, height, seed=self.seed)
         self.fortress.blankFortress()
-        self.fortress.addLog(f">>> CONFIG FILE: {config_file} <<<")
-        self.fortress.addLog(f">>> TIME: {datetime.datetime.now()} <<<")
-        if init_seed is None:
-            self.fortress.addLog(f">>> USING CONFIG SEED {self.config['seed']} <<<")
-        else:
-            self.fortress.addLog(f">>> USING PARAMETER SEED {init_seed} <<<")
+        if log_level is not None:
+            self.fortress.setLogLevel(log_level)
+        if self.fortress.log_text:
+            self.fortress.addLog(f">>> CONFIG FILE: {config_file} <<<")
+            self.fortress.addLog(f">>> TIME: {datetime.datetime.now()} <<<")
+            if init_seed is None:
+                self.fortress.addLog(f">>> USING CONFIG SEED {self.config['seed']} <<<")
+            else:
+                self.fortress.addLog(f">>> USING PARAMETER SEED {init_seed} <<<")
         # self.fortress.printFortress()
 
         self.sim_tick = 0    # simulation tick
 
+        # how the entities are updated - 'object' (one entity object at a time), 'scheduled' (the entity objects, but
+        #   idle ones are only woken by their step edges or nearby entities, see scheduler.py) or 'soa' (numpy columns, see soa_backend.py)
+        self.backend = backend if backend else self.config.get('backend', 'object')
+        assert self.backend in ('object', 'scheduled', 'soa'), f"Unknown simulation backend {self.backend}"
+        self.soa = SoABackend(self.fortress) if self.backend == 'soa' else None
+        self.scheduler = Scheduler(self.fortress) if self.backend == 'scheduled' else None
+        self.fortress.scheduler = self.scheduler
+        self.cycles = None      # cycle detector (see detectCycles)
+
         self.init_ent_str = ""    # string of all entities at the start of the simulation
+        self.init_snapshot = None   # the entities of init_ents as resetFortress places them (see snapshot.py)
 
     # update the simulation entirely 
     def update(self, tree_visits=False):
         self.sim_tick += 1
         self.fortress.steps = self.sim_tick
 
+        if self.soa is not None:
+            self.soa.update(tree_visits)
+            return
+        if self.scheduler is not None:
+            self.scheduler.update(tree_visits)
+            return
+
         # update all of the entities
         cur_ents = list(self.fortress.entities.keys())
 
@@ -62,6 +86,25 @@ class Engine():
                 if tree_visits:
                     self.fortress.addTreeVisit(ent)
 
+    # start (or stop) watching the fortress for a repeating state (see cycles.py) - returns the detector
+    #   the soa backend doesn't keep the entity objects current during the updates, so it can't be watched
+    def detectCycles(self, on=True):
+        self.cycles = CycleDetector(self.fortress) if on and self.soa is None else None
+        self.fortress.cycles = self.cycles
+        return self.cycles
+
+    # save the whole simulation state to a file to resume the run from (see checkpoint.py)
+    def saveCheckpoint(self, filename):
+        saveCheckpoint(self, filename)
+
+    # continue from a checkpoint - replaces the config, fortress and backends of the engine with the saved ones
+    def loadCheckpoint(self, filename):
+        loadCheckpoint(self, filename)
+
+    # set what the fortress logs ('all', 'text' or 'none', see Fortress.setLogLevel)
+    def setLogLevel(self, level):
+        self.fortress.setLogLevel(level)
+
     # export the log to a file
     def exportLog(self,filename):
         with open(filename, 'w') as file:
@@ -94,7 +137,8 @@ class Engine():
                 self.fortress.addEntity(ent)
 
         self.recordState()   # record the initial state of the fortress
-        self.fortress.addLog(f"Fortress randomly populated with {num_entities}")    # add a log message
+        if self.fortress.log_text:
+            self.fortress.addLog(f"Fortress randomly populated with {num_entities}")    # add a log message
 
     # Store the essential initial info in case we need to replicate/mutate the fortress later.
     def recordState(self):
@@ -105,27 +149,23 @@ class Engine():
 
     # reset the fortress to the initial state
     def resetFortress(self):
-        # Remove all current entities
-        self.fortress.entities = {}
+        self.fortress.steps = 0
+        self.sim_tick = 0
 
         # reset the visits
         self.fortress.resetCharVisit()
 
-        # Add the entities back in
-        for e in self.init_ents:
-            new_ent = self.fortress.CHARACTER_DICT[e['char']].clone(e['pos'])
-            if new_ent:
-                self.fortress.addEntity(new_ent)
+        # Put the initial entities back in place of the current ones (from a snapshot, retaken if init_ents was changed)
+        if self.init_snapshot is None or not self.init_snapshot.matches(self.init_ents):
+            self.init_snapshot = FortSnapshot(self.init_ents)
+        self.init_snapshot.restore(self.fortress)
 
         # reset the log
-        self.fortress.log = [f"============    FORTRESS SEED [{self.seed}]    =========", "Fortress initialized! - <0>"]
-        # self.fortress.addLog(f">>> CONFIG FILE: {self.config} <<<")
-        self.fortress.addLog(f">>> TIME: {datetime.datetime.now()} <<<")
-        self.fortress.addLog(f"Fortress randomly populated with {len(self.init_ents)} entities")    # add a log message
-
-
-        self.fortress.steps = 0
-        self.sim_tick = 0
+        self.fortress.resetLog()
+        if self.fortress.log_text:
+            # self.fortress.addLog(f">>> CONFIG FILE: {self.config} <<<")
+            self.fortress.addLog(f">>> TIME: {datetime.datetime.now()} <<<")
+            self.fortress.addLog(f"Fortress randomly populated with {len(self.init_ents)} entities")    # add a log message
 
 
 
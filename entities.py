@@ -1,64 +1,79 @@
-from functools import partial
 import random
 
 import numpy as np
+from eventlog import EV_MOVE, EV_CHASE, EV_PUSH_FAIL, EV_PUSH, EV_TAKE, EV_DIE, EV_BLOCKED, EV_CLONE_FAIL, EV_CLONE, EV_ADD, EV_TRANSFORM
 # from fortress import Fortress
 # from engine import Engine
 
 
 
+# a single instance of a character on the map
+#   only the per-instance state lives here; the FSM is shared through the species of the character
 class Entity:  
 
+    __slots__ = ('species', 'fortress', 'pos', 'id', 'seq', 'cur_step', 'cur_node', 'moved_edge', 'other_ent')
+
     #######     NODE ACTIONS     #######
 
-    def __init__(self, fortress, char=None, filename=None, nodes=None, edges=None, n_rand_nodes=None):
-        self.char = char if char else '?'
-        self.pos = [None, None]
+    def __init__(self, fortress, char=None, filename=None, nodes=None, edges=None, n_rand_nodes=None, species=None, ent_id=None):
+        # instances made from a species share it; otherwise the entity gets a species of its own
+        if species is None:
+            species = Species(fortress, char, filename, nodes, edges, n_rand_nodes)
+        self.species = species
         self.fortress = fortress  
+        self.pos = [None, None]
 
-        self.id = self.newID()   # generate a new ID for the entity
+        self.id = fortress.newID() if ent_id is None else ent_id   # generate a new ID for the entity (unless it is given one)
+        self.seq = None          # order the entity was added to the fortress in (set by the fortress)
         
         self.cur_step = 0        # the current step the agent is on
         self.cur_node = 0        # the current node the agent is on
         self.moved_edge = None   # the edge that was activated when the node state changed
         self.other_ent = None    # the other entity that was involved in the edge activation
-        self.avail_node_types = fortress.node_types.copy()
-        self.n_node_types = len(self.avail_node_types)
 
-        # get the random seed from the fortress and set it
-        # seed = self.fortress.seed
-        # random.seed(seed)
+    # the character and FSM come from the species
+    @property
+    def char(self):
+        return self.species.char
+
+    @property
+    def nodes(self):
+        return self.species.nodes
+
+    @nodes.setter
+    def nodes(self, nodes):
+        self._ownSpecies()
+        self.species.nodes = nodes
+
+    @property
+    def edges(self):
+        return self.species.edges
+
+    @edges.setter
+    def edges(self, edges):
+        self._ownSpecies()
+        self.species.edges = edges
+
+    # copy the species before changing the FSM of only this instance (copy-on-write)
+    def _ownSpecies(self):
+        self.species = self.species.copy()
+        self.species.fsm = None
+        if self.fortress.scheduler is not None:
+            self.fortress.scheduler.wake(self)
+
+    # print, export, or compile the FSM of the species
+    def printTree(self):
+        return self.species.printTree()
 
-        # define the AI state graph
-        self.nodes = []      # list of nodes; the index position corresponds to the node ID while the function name; saved as a string with the function name followed by any arguments with the value in parentheses
-        self.edges = {}      # dictionary of node -> node activations; the key is the 2 node ID separated by a - and the value is the condition that activates the edge followed by any arguments with the value in parentheses
- 
-        # initalize a new behavior tree or import from a file
-        if filename != None:
-            self.importTree(filename)
-        elif nodes != None and edges != None:
-            self.nodes = nodes
-            self.edges = edges
-        else:
-            # self.makeTree(max_nodes_per_entity=len(fortress.node_types))
-            assert n_rand_nodes is not None
-            self.makeTree(n_nodes=n_rand_nodes)
+    def exportTree(self, filename):
+        self.species.exportTree(filename)
 
-            assert len(self.avail_node_types) == (len(fortress.node_types) - len(self.nodes)), \
-                (f"Number of possible actions {len(self.avail_node_types)}, "
-                    f"does not match number of nodes {len(self.nodes)}. n_nodes {n_rand_nodes}")
+    def compileFSM(self):
+        return self.species.compileFSM()
 
-    # create a new id for the entity
+    # create a new id for the entity (handed out by the fortress)
     def newID(self,id_len=4):
-        all_num = list(range(16**4))
-        all_ids = self.fortress.entities.keys()
-        while len(all_num) > 0:
-            i = f'%{id_len}x' % random.choice(all_num)
-            if i not in all_ids:
-                return i
-            all_num.remove(int(i,16))
-
-        return f'%0{id_len}x' % random.randrange(16**(id_len+1))
+        return self.fortress.newID(id_len)
 
     #######     NODE ACTIONS     #######
 
@@ -72,7 +87,7 @@ class Entity:
         # TODO: currently moves one tile at a tile in a random direction
         pos_mod = [[0,1], [0,-1], [1,0], [-1,0]]
         # rpos = random.choice(pos_mod)
-        rpos = self.fortress.rng_sim.choice(pos_mod)
+        rpos = pos_mod[self.fortress.randDir()]
         new_pos = [self.pos[0] + rpos[0], self.pos[1] + rpos[1]]
         # self.fortress.addLog("Entity trying to move to " + str(new_pos))
         if self.fortress.validPos(new_pos[0], new_pos[1]):
@@ -82,25 +97,13 @@ class Entity:
 
     # create another instance of the entity but with different id and position
     def clone(self,pos=None,transform=False):
-        new_ent = Entity(self.fortress, self.char,nodes=self.nodes.copy(),edges=self.edges.copy())
-        # new_ent.avail_node_types = self.avail_node_types.copy()  # NOTE: only 
-        new_ent.id = self.newID()
-
-        #new_ent.pos = pos if pos else self.fortress.randomPos()
-        new_ent.pos = pos if pos else self._randAdjPos()
-
-        # don't clone if the position is invalid or if something is already there
-        if new_ent.pos == None or (not transform and self.fortress.entAtPos(new_ent.pos[0], new_ent.pos[1])):
-            self.fortress.addLog("Clone failed")
-            return None
-        
-        self.fortress.addEntity(new_ent)
-        self.fortress.addLog(f"[{self.char}.{self.id}] cloned to [{new_ent.char}.{new_ent.id}] at {str(new_ent.pos)}")
-        return new_ent
+        #pos = pos if pos else self.fortress.randomPos()
+        return self.species.clone(pos if pos else self._randAdjPos(), transform, self)
 
     # if entity dies, remove from map
     def die(self):
-        self.fortress.addLog(f"[{self.char}.{self.id}] died")
+        if self.fortress.log_events:
+            self.fortress.logEvent(EV_DIE, self)
         self.fortress.removeFromMap(self)
     
     # if entity takes another entity, remove from map
@@ -112,7 +115,8 @@ class Entity:
 
         other_ent = self._anotherEnt(entityChar)
         if other_ent:
-            self.fortress.addLog(f"[{self.char}.{self.id}] took [{other_ent.char}.{other_ent.id}]")
+            if self.fortress.log_events:
+                self.fortress.logEvent(EV_TAKE, self, other_ent)
             other_ent.die()
 
    
@@ -121,8 +125,9 @@ class Entity:
         new_pos = self._randAdjPos()
         # self.fortress.addLog("Entity trying to move to " + str(new_pos))
         if new_pos:
-            self.pos = new_pos
-            self.fortress.addLog(f"[{self.char}.{self.id}] moved to {str(self.pos)}")
+            self.fortress.moveEntity(self, new_pos)
+            if self.fortress.log_events:
+                self.fortress.logEvent(EV_MOVE, self, None, self.pos[0], self.pos[1])
 
      # if entity moves and entity is not in the way, update position
     def wall(self, entityChar):
@@ -131,10 +136,11 @@ class Entity:
         if new_pos:
             eap = self.fortress.entAtPos(new_pos[0],new_pos[1])   # check if there's an entity at the position and if so, not the specified one
             if not eap or eap.char != entityChar:
-                self.pos = new_pos
-                self.fortress.addLog(f"[{self.char}.{self.id}] moved to {str(self.pos)}")
-            else:
-                self.fortress.addLog(f"[{self.char}.{self.id}] blocked by wall {eap.char}.{eap.id}")
+                self.fortress.moveEntity(self, new_pos)
+                if self.fortress.log_events:
+                    self.fortress.logEvent(EV_MOVE, self, None, self.pos[0], self.pos[1])
+            elif self.fortress.log_events:
+                self.fortress.logEvent(EV_BLOCKED, self, eap)
 
     # moves the entity towards a particular entity on the map
     def chase(self, entityChar):
@@ -166,7 +172,7 @@ class Entity:
         
         # randomly choose a direction to move from the directions need to go in
         # rdir = random.choice(dir)
-        rdir = self.fortress.rng_sim.choice(dir)
+        rdir = dir[self.fortress.randDir(len(dir))]
         if rdir == 'east':
             new_pos[0] += 1
         elif rdir == 'west':
@@ -178,8 +184,9 @@ class Entity:
 
         # check if the new position is valid
         if self.fortress.validPos(new_pos[0], new_pos[1]):
-            self.pos = new_pos
-            self.fortress.addLog(f"[{self.char}.{self.id}] moved to {str(self.pos)} goto {str(pos)}")
+            self.fortress.moveEntity(self, new_pos)
+            if self.fortress.log_events:
+                self.fortress.logEvent(EV_CHASE, self, None, self.pos[0], self.pos[1], pos[0], pos[1])
 
     # check if 2 positions are the same
     def _samePos(self, pos1, pos2):
@@ -197,7 +204,7 @@ class Entity:
         # get the next position over
         pos_mod = [[0,1], [0,-1], [1,0], [-1,0]]
         # rpos = random.choice(pos_mod)
-        rpos = self.fortress.rng_sim.choice(pos_mod)
+        rpos = pos_mod[self.fortress.randDir()]
         new_pos = [self.pos[0] + rpos[0], self.pos[1] + rpos[1]]
 
         # check if the other entity is in the next position
@@ -217,16 +224,18 @@ class Entity:
             new_pos_e = [other_ent.pos[0] + rpos[0], other_ent.pos[1] + rpos[1]]
             if self.fortress.validPos(new_pos_e[0], new_pos_e[1]):
                 # move this entity
-                self.pos = new_pos
+                self.fortress.moveEntity(self, new_pos)
 
                 # move the other entity
-                other_ent.pos = new_pos_e
-                self.fortress.addLog(f"[{self.char}.{self.id}] pushed [{other_ent.char}.{other_ent.id}]")
+                self.fortress.moveEntity(other_ent, new_pos_e)
+                if self.fortress.log_events:
+                    self.fortress.logEvent(EV_PUSH, self, other_ent)
 
         elif self.fortress.validPos(new_pos[0], new_pos[1]):
             # move this entity
-            self.pos = new_pos
-            self.fortress.addLog(f"[{self.char}.{self.id}] moved to {str(self.pos)} - (not able to push)")
+            self.fortress.moveEntity(self, new_pos)
+            if self.fortress.log_events:
+                self.fortress.logEvent(EV_PUSH_FAIL, self, None, self.pos[0], self.pos[1])
 
     # add another entity to the map
     def addEnt(self, entityChar):
@@ -240,7 +249,8 @@ class Entity:
         new_ent = new_ent_def.clone(adj_pos)
         if new_ent:
             self.fortress.addEntity(new_ent)
-            self.fortress.addLog(f"[{self.char}.{self.id}] added [{new_ent.char}.{new_ent.id}] at {str(new_ent.pos)}")
+            if self.fortress.log_events:
+                self.fortress.logEvent(EV_ADD, self, new_ent, new_ent.pos[0], new_ent.pos[1])
 
     # transform this entity into another entity
     def transform(self, entityChar):
@@ -248,7 +258,8 @@ class Entity:
         new_ent = new_ent_def.clone(self.pos,True)
         if new_ent:
             self.fortress.addEntity(new_ent)
-            self.fortress.addLog(f"[{self.char}.{self.id}] transformed into [{new_ent.char}.{new_ent.id}] at {str(new_ent.pos)}")
+            if self.fortress.log_events:
+                self.fortress.logEvent(EV_TRANSFORM, self, new_ent, new_ent.pos[0], new_ent.pos[1])
             self.die()
 
 
@@ -256,12 +267,6 @@ class Entity:
     def noneAct(self):
         pass
 
-    def validate_avail_nodes(self):
-        """For debugging."""
-        assert len(self.avail_node_types) == (self.n_node_types - len(self.nodes)), \
-            (f"Number of possible actions {len(self.avail_node_types)}, "
-                f"does not match number of nodes {len(self.nodes)}")
-
     #######     EDGE CONDITIONS     #######
 
 
@@ -276,30 +281,32 @@ class Entity:
     def touch(self, entityChar):
         # self.fortress.addLog(f"[{self.char}.{self.id}] checking if touching [{entityChar}]")
 
-        # currently returns true if the entity is touching another entity
-        for i,ent in self.fortress.entities.items():
+        # currently returns true if the entity is touching another entity (only the entities on the same cell are checked)
+        touched = None
+        for ent in self.fortress.ent_grid.get((self.pos[0], self.pos[1]), ()):
             # skip self
-            if i == self.id:
+            if ent.id == self.id:
                 continue
-            # check if the entity is touching another entity
-            if ent.char == entityChar:
-                if ent.pos[0] == self.pos[0] and ent.pos[1] == self.pos[1]:
-                    self.other_ent = ent   # save the other entity that was touched
-                    return True
+            # keep the earliest added entity of the character
+            if ent.char == entityChar and (touched is None or ent.seq < touched.seq):
+                touched = ent
+        if touched is not None:
+            self.other_ent = touched   # save the other entity that was touched
+            return True
         return False
     
     # if entity is within x spaces of another entity
     def within(self,entityChar,range):
         range = int(range)
-        for i,ent in self.fortress.entities.items():
+        # only the entities of the character are checked (in insertion order)
+        for i,ent in self.fortress.char_ents.get(entityChar, {}).items():
             # skip self
             if i == self.id:
                 continue
             # check if the entity is touching another entity
-            if ent.char == entityChar:
-                if abs(ent.pos[0] - self.pos[0]) <= range and abs(ent.pos[1] - self.pos[1]) <= range:
-                    self.other_ent = ent
-                    return True
+            if abs(ent.pos[0] - self.pos[0]) <= range and abs(ent.pos[1] - self.pos[1]) <= range:
+                self.other_ent = ent
+                return True
         return False
     
     # if entity is next to another entity
@@ -311,6 +318,106 @@ class Entity:
         return True
         
 
+    #######     UPDATES AND LOOPS    #######
+
+    # update the behavior tree of the entity by looking at the graph and any connections
+    def update(self):
+        # increment the step counter
+        self.cur_step += 1
+
+        species = self.species
+        fsm = species.fsm if species.fsm is not None else species.compileFSM()
+
+        # do whatever is set at the current node first
+        assert self.cur_node < fsm.n_nodes, (f"Current node {self.cur_node}"
+                                             f" is greater than the number of nodes {fsm.n_nodes}")
+        func, args = fsm.node_calls[self.cur_node]
+        func(self, *args)
+
+        # if edges are available that fulfill the condition for crossing from the current node, then do it
+        # order of priority: touch, nextTo, within, step, none
+        # the edges leaving each node are already sorted by priority in the compiled table
+        out_edges = fsm.out_edges[self.cur_node]
+        for cond, args, next_node, edge in out_edges:
+            # check if the condition is met
+            if cond(self, *args):
+                # get the node to transition to
+                self.cur_node = next_node
+                self.moved_edge = edge
+                if self.fortress.cycles is not None:
+                    self.fortress.cycles.entChanged(self)
+                break   # end update
+        else:
+            if out_edges:
+                self.moved_edge = None
+
+        # self.fortress.addLog(f"{self.char} is at node {self.cur_node}")
+
+ 
+
+# the definition of a character shared by all of its instances
+#   holds the FSM, the pool of node types still available to it, and the compiled tables
+class Species:
+
+    def __init__(self, fortress, char=None, filename=None, nodes=None, edges=None, n_rand_nodes=None):
+        self.char = char if char else '?'
+        self.fortress = fortress  
+
+        self.fsm = None          # compiled node and edge tables (built lazily from the nodes and edges)
+        self.avail_node_types = fortress.node_types.copy()
+        self.n_node_types = len(self.avail_node_types)
+
+        # get the random seed from the fortress and set it
+        # seed = self.fortress.seed
+        # random.seed(seed)
+
+        # define the AI state graph
+        self.nodes = []      # list of nodes; the index position corresponds to the node ID while the function name; saved as a string with the function name followed by any arguments with the value in parentheses
+        self.edges = {}      # dictionary of node -> node activations; the key is the 2 node ID separated by a - and the value is the condition that activates the edge followed by any arguments with the value in parentheses
+ 
+        # initalize a new behavior tree or import from a file
+        if filename != None:
+            self.importTree(filename)
+        elif nodes != None and edges != None:
+            self.nodes = nodes
+            self.edges = edges
+        else:
+            # self.makeTree(max_nodes_per_entity=len(fortress.node_types))
+            assert n_rand_nodes is not None
+            self.makeTree(n_nodes=n_rand_nodes)
+
+            assert len(self.avail_node_types) == (len(fortress.node_types) - len(self.nodes)), \
+                (f"Number of possible actions {len(self.avail_node_types)}, "
+                    f"does not match number of nodes {len(self.nodes)}. n_nodes {n_rand_nodes}")
+
+    # a separate species with the same FSM (the compiled tables are never edited in place, so they are shared)
+    def copy(self):
+        new_species = Species(self.fortress, self.char, nodes=self.nodes.copy(), edges=self.edges.copy())
+        new_species.avail_node_types = self.avail_node_types.copy()
+        new_species.fsm = self.fsm
+        return new_species
+
+    # create a new instance of the species at a position (parent is the entity doing the cloning, if any)
+    def clone(self,pos=None,transform=False,parent=None):
+        # don't clone if the position is invalid or if something is already there
+        if pos == None or (not transform and self.fortress.entAtPos(pos[0], pos[1])):
+            if self.fortress.log_events:
+                self.fortress.logEvent(EV_CLONE_FAIL)
+            return None
+
+        new_ent = Entity(self.fortress, species=self)
+        new_ent.pos = pos
+        self.fortress.addEntity(new_ent)
+        if self.fortress.log_events:
+            self.fortress.logEvent(EV_CLONE, parent, new_ent, pos[0], pos[1])
+        return new_ent
+
+    def validate_avail_nodes(self):
+        """For debugging."""
+        assert len(self.avail_node_types) == (self.n_node_types - len(self.nodes)), \
+            (f"Number of possible actions {len(self.avail_node_types)}, "
+                f"does not match number of nodes {len(self.nodes)}")
+
     #######     GRAPH DEVELOPMENT     #######
 
     # return a new random node with the name and parameters provided
@@ -325,18 +432,19 @@ class Entity:
     
     # return a new random edge with the condition and parameters provided
     def newEdge(self):
+        config = self.fortress.CONFIG
         new_edge = ""
-        new_cond = random.choice(self.fortress.CONFIG['edge_conditions'])
+        new_cond = random.choice(config.edge_conditions)
 
         new_edge = f"{new_cond} "
         if EDGE_DICT[new_cond]['args'] != []:
             for arg in EDGE_DICT[new_cond]['args']:
                 if arg == "entityChar":
-                    new_edge += f"{random.choice(self.fortress.CONFIG['character'])} "
+                    new_edge += f"{random.choice(config.chars)} "
                 elif arg == "steps":
-                    new_edge += f"{random.randint(self.fortress.CONFIG['step_range'][0],self.fortress.CONFIG['step_range'][1])} "
+                    new_edge += f"{random.randint(config.step_range[0],config.step_range[1])} "
                 elif arg == "range":
-                    new_edge += f"{random.randint(self.fortress.CONFIG['prox_range'][0],self.fortress.CONFIG['prox_range'][1])} "
+                    new_edge += f"{random.randint(config.prox_range[0],config.prox_range[1])} "
 
 
         return new_edge.strip()
@@ -371,6 +479,7 @@ class Entity:
         if n_nodes > 0:
             # validate the tree
             self.connectOrphanNodes()
+        self.fsm = None
 
 
     # validate the tree
@@ -388,6 +497,7 @@ class Entity:
 
         # sort the edges by key
         self.edges = dict(sorted(self.edges.items()))
+        self.fsm = None
 
     # connect a single orphan node
     def connectAnnieNode(self, node_index):
@@ -400,6 +510,7 @@ class Entity:
         # sort the edges by key
         # print(self.edges.keys())
         self.edges = dict(sorted(self.edges.items()))
+        self.fsm = None
 
 
     # kill the orphan edges
@@ -423,6 +534,7 @@ class Entity:
 
         # update the edges
         self.edges = new_edges
+        self.fsm = None
 
 
     # print the tree out in a nice format
@@ -486,6 +598,7 @@ class Entity:
                 self.edges[e[0]] = e[1]
 
             f.close()
+        self.fsm = None
 
     # imports a tree from a string format
     def importTreeStr(self, str):
@@ -513,104 +626,58 @@ class Entity:
         for i in range(edge_break+1, len(lines)):
             e = lines[i].split(": ")
             self.edges[e[0]] = e[1]
+        self.fsm = None
+
+
+    # compile the node and edge strings into lookup tables (cached until the FSM changes)
+    def compileFSM(self):
+        if self.fsm is None:
+            self.fsm = FSMTable(self.nodes, self.edges)
+        return self.fsm
+
+    # drop the compiled tables after the nodes or edges have been edited in place
+    def invalidateFSM(self):
+        self.fsm = None
+
+    # the nodes and edges an instance could ever add to the tree visits, given the chars that can be on the map
+    #   and the nodes its instances start in - returns (nodes, edges, chars its instances can add to the map)
+    #   an over-approximation: anything left out can never be visited, but not everything kept has to be
+    def reachableFSM(self, chars, start_nodes=(0,)):
+        fsm = self.compileFSM()
+        nodes, edges, spawned = set(), set(), set()
+        seen = set(start_nodes)
+        alive = list(seen)      # nodes an instance can start an update in
+        while alive:
+            n = alive.pop()
+            if n >= fsm.n_nodes:
+                continue    # the next update fails the node assertion
+            op, args = fsm.node_ops[n], fsm.node_args[n]
+            if op == NODE_OPS['clone']:
+                spawned.add(self.char)
+            elif op in (NODE_OPS['add'], NODE_OPS['transform']):
+                spawned.add(args[0])
+
+            # the edges are still checked after the instance dies in the node, but it is never updated again
+            dies = op in (NODE_OPS['die'], NODE_OPS['transform'])
+            stays = True
+            for eop, (_, eargs, dst, key) in zip(fsm.edge_ops[n], fsm.out_edges[n]):
+                # the spatial conditions need an entity of the char on the map
+                if eop in (EDGE_OPS['touch'], EDGE_OPS['nextTo'], EDGE_OPS['within']) and eargs[0] not in chars:
+                    continue
+                edges.add(key)
+                nodes.add(dst)
+                if not dies and dst not in seen:
+                    seen.add(dst)
+                    alive.append(dst)
+                # the edges after one that always fires are never checked
+                if eop == EDGE_OPS['none'] or (eop == EDGE_OPS['step'] and eargs[0] in (1, -1)):
+                    stays = False
+                    break
+            if stays:
+                nodes.add(n)
+        return nodes, edges, spawned
 
 
-
-    #######     UPDATES AND LOOPS    #######
-
-    # update the behavior tree of the entity by looking at the graph and any connections
-    def update(self):
-        # increment the step counter
-        self.cur_step += 1
-
-        # do whatever is set at the current node first
-        assert self.cur_node < len(self.nodes), (f"Current node {self.cur_node}"
-                                                 f" is greater than the number of nodes {len(self.nodes)}")
-        active_node = self.nodes[self.cur_node]
-        act_node_parts = active_node.split(" ")
-
-        # get the function to call
-        func = act_node_parts[0]
-        func = NODE_DICT[func]['func']  # could also use getattr(self, func)
-        func = partial(func, self)
-
-        # call the function with or without arguments
-        if len(act_node_parts) > 1:
-            args = act_node_parts[1:]
-            func(*args)
-        else:
-            func()
-
-        # if edges are available that fulfill the condition for crossing from the current node, then do it
-        # order of priority: touch, nextTo, step, within, none
-
-        # get all the edges that start at the current node
-        edges = [key for key in self.edges.keys() if key.split("-")[0] == str(self.cur_node)]
-
-        # sort the edges by priority
-        # edges = sorted(edges, key=lambda x: EDGE_DICT[self.edges[x].split(" ")[0]]['priority'], reverse=True)
-        
-        # # check if any of the edges are valid
-        # for edge in edges:
-        #     # get the condition
-        #     cond = self.edges[edge].split(" ")[0]
-        #     cond = EDGE_DICT[cond]['func']
-        #     cond = partial(cond, self)
-
-        #     # get the arguments
-        #     args = self.edges[edge].split(" ")[1:]
-
-        #     # check if the condition is met
-        #     if cond(*args):
-        #         # get the node to transition to
-        #         self.cur_node = int(edge.split("-")[1])
-        #         self.moved_edge = edge
-        #         break
-        #     else:
-        #         self.moved_edge = None
-
-
-        ### FASTER EDGE CALCULATION ###
-
-        # divide the edges into priority bins O(# edges @ cur_node)
-        edge_prior = [[] for i in range(len(EDGE_DICT.keys()))]   # assume that the priorities are numerical 0-n
-        for e in edges:
-            edge_prior[EDGE_DICT[self.edges[e].split(" ")[0]]['priority']].append(e)
-
-        # self.fortress.addLog(f"{self.char} -> {edge_prior}")
-
-        # based on the bins enact the first possible priority - reversed order
-        # worst case O(# edges @ cur_node) lower bound 1
-        updated = False
-        for i in range(len(edge_prior)-1,-1,-1):
-            # finished updating
-            if updated:
-                break
-
-            # self.fortress.addLog(f"{self.char}: {i} = {edge_prior[i]}")
-
-            for edge in edge_prior[i]:
-                # get the condition
-                cond = self.edges[edge].split(" ")[0]
-                cond = EDGE_DICT[cond]['func']
-                cond = partial(cond, self)
-
-                # get the arguments
-                args = self.edges[edge].split(" ")[1:]
-
-                # check if the condition is met
-                if cond(*args):
-                    # get the node to transition to
-                    self.cur_node = int(edge.split("-")[1])
-                    self.moved_edge = edge
-                    updated = True
-                    break   # end update
-                else:
-                    self.moved_edge = None
-
-        # self.fortress.addLog(f"{self.char} is at node {self.cur_node}")
-
- 
 # associates names to the functions for the node actions the agent will perform
 NODE_DICT = {
     "idle": {'func':Entity.noneAct, 'args':[]},
@@ -634,4 +701,47 @@ EDGE_DICT = {
     "within": {'func':Entity.within, 'args':['entityChar','range'], 'priority':2},
     "nextTo": {'func':Entity.nextTo, 'args':['entityChar'], 'priority':3},
     "touch": {'func':Entity.touch, 'args':['entityChar'], 'priority':4}
-}
\ No newline at end of file
+}
+
+
+# opcodes of the node actions and edge conditions (index into the dictionaries above)
+NODE_OPS = {name: i for i, name in enumerate(NODE_DICT)}
+EDGE_OPS = {name: i for i, name in enumerate(EDGE_DICT)}
+
+
+# the text FSM of an entity compiled into integer opcode and argument tables
+#   nodes and edges stay the interchange format; this is rebuilt whenever they change
+class FSMTable:
+    def __init__(self, nodes, edges):
+        self.n_nodes = len(nodes)
+
+        # per node: opcode, arguments, and the (function, arguments) pair to call
+        self.node_ops = []
+        self.node_args = []
+        self.node_calls = []
+        for node in nodes:
+            parts = node.split(" ")
+            self.node_ops.append(NODE_OPS[parts[0]])
+            self.node_args.append(tuple(parts[1:]))
+            self.node_calls.append((NODE_DICT[parts[0]]['func'], tuple(parts[1:])))
+
+        # per node: the outgoing edges as (condition function, arguments, next node, edge key)
+        #   sorted from highest to lowest priority (ties keep the edge dictionary order)
+        out_edges = [[] for _ in range(self.n_nodes)]
+        for key, edge in edges.items():
+            src, dst = key.split("-")
+            src = int(src)
+            if src >= self.n_nodes:
+                continue    # can never be the current node
+            parts = edge.split(" ")
+            cond = EDGE_DICT[parts[0]]
+            args = tuple(int(a) if name in ('steps', 'range') else a
+                         for name, a in zip(cond['args'], parts[1:])) + tuple(parts[1+len(cond['args']):])
+            out_edges[src].append((cond['priority'], EDGE_OPS[parts[0]], cond['func'], args, int(dst), key))
+
+        self.edge_ops = []
+        self.out_edges = []
+        for node_edges in out_edges:
+            node_edges.sort(key=lambda e: -e[0])
+            self.edge_ops.append(tuple(e[1] for e in node_edges))
+            self.out_edges.append(tuple(e[2:] for e in node_edges))
@@ -1,7 +1,6 @@
 import numpy as np
-from scipy.stats import entropy
 
-from utils import get_bin_idx
+from utils import get_bin_idx, entropy
 
 
 def gen_entropy_dict(n_fsm_size_bins, n_fsms, n_entropy_bins):
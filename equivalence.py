@@ -0,0 +1,241 @@
+# checks that an alternative simulation backend reproduces the reference engine exactly
+# runs the same scenarios with the same seeds through both and compares a digest of the fortress after every tick
+#   the batch backend (batch_backend.py) runs every scenario and seed at once, as the episodes of a single batch
+# Usage: python equivalence.py [-b backend] [-n n_sim_steps] [-s n_seeds] [-r n_random_forts]
+#   exits with status 1 if any scenario diverges
+#   (tests/test_equivalence.py runs a reduced set of the scenarios under pytest: python -m pytest tests)
+
+import sys
+import glob
+import random
+import hashlib
+import argparse
+import numpy as np
+
+from engine import Engine
+from batch_backend import BatchBackend
+from entities import Species
+
+
+# the state the backends have to agree on - chars, positions and current nodes (in update order) and the tree visits
+def fortressState(fortress):
+    ents = tuple((e.char, int(e.pos[0]), int(e.pos[1]), int(e.cur_node)) for e in fortress.entities.values())
+    visits = tuple((c, tuple(sorted(v['nodes'])), tuple(sorted(v['edges']))) for c, v in sorted(fortress.CHAR_VISIT_TREE.items()))
+    return ents, visits
+
+def fortressDigest(fortress):
+    return stateDigest(fortressState(fortress))
+
+# the same state for an episode of a batch
+def batchState(batch, e):
+    visits = tuple((c, tuple(sorted(v['nodes'])), tuple(sorted(v['edges']))) for c, v in sorted(batch.visitTree(e).items()))
+    return tuple(batch.entStates(e)), visits
+
+def stateDigest(state):
+    return hashlib.sha1(repr(state).encode()).hexdigest()[:16]
+
+
+# every scenario to check - (name, kind, argument)
+def listScenarios(n_random=5):
+    scenarios = [(f, 'fort', f) for f in sorted(glob.glob("FORTS/*.txt"))]
+    scenarios.append(("ENT/*.txt", 'ent', sorted(glob.glob("ENT/*.txt"))))
+    scenarios += [(f"random {i}", 'random', i) for i in range(n_random)]
+    return scenarios
+
+
+# set up a fortress for a scenario
+def setupScenario(engine, kind, arg, seed):
+    fortress = engine.fortress
+    random.seed(seed)
+    np.random.seed(seed)
+
+    # fortress definition file
+    if kind == 'fort':
+        fortress.importEntityFortDef(arg)
+
+    # every entity definition file, with a few instances of each placed randomly
+    elif kind == 'ent':
+        fortress.CHARACTER_DICT = {}
+        fortress.CHAR_VISIT_TREE = {}
+        for filename in arg:
+            species = Species(fortress, filename=filename)
+            fortress.CHARACTER_DICT[species.char] = species
+            fortress.CHAR_VISIT_TREE[species.char] = {'nodes':set(),'edges':set()}
+        for species in fortress.CHARACTER_DICT.values():
+            for _ in range(3):
+                pos = fortress.randomPos()
+                if pos:
+                    species.clone(list(pos))
+
+    # random characters and population
+    elif kind == 'random':
+        random.seed(arg)
+        np.random.seed(arg)
+        engine.populateFortress()
+
+    fortress.rng_sim = np.random.default_rng(seed)
+
+
+# simulate a scenario and return the digest after every tick (and the state at one tick if asked)
+#   an exception ends the run and is recorded in place of the digest
+def runScenario(kind, arg, seed, backend, n_sim_steps=100, config_file="CONFIGS/gamma_config.yaml", state_tick=None):
+    engine = Engine(config_file, init_seed=seed, backend=backend)
+    digests, state = [], None
+    try:
+        setupScenario(engine, kind, arg, seed)
+        fortress = engine.fortress
+        loops = 0
+        while True:
+            digests.append(fortressDigest(fortress))
+            if loops == state_tick:
+                state = fortressState(fortress)
+            if fortress.terminate() or fortress.inactive() or fortress.overpop() or loops >= n_sim_steps:
+                break
+            engine.update(True)
+            loops += 1
+    except Exception as e:
+        digests.append(f"{type(e).__name__}: {e}")
+    return digests, state
+
+
+# simulate each (kind, argument, seed) run as an episode of one batch and return the digests after every tick of each
+#   run (and their states at one tick if asked), as runScenario does
+def runBatch(runs, n_sim_steps=100, config_file="CONFIGS/gamma_config.yaml", state_tick=None):
+    batch = BatchBackend()
+    digests, states, eps = [], [], []
+    for kind, arg, seed in runs:
+        engine = Engine(config_file, init_seed=seed)
+        digests.append([])
+        states.append(None)
+        try:
+            setupScenario(engine, kind, arg, seed)
+            eps.append(batch.addFortress(engine.fortress))
+        except Exception as e:
+            digests[-1].append(f"{type(e).__name__}: {e}")
+            eps.append(None)
+
+    loops = 0
+    running = [e is not None for e in eps]
+    while any(running):
+        for i, e in enumerate(eps):
+            if running[i]:
+                digests[i].append(stateDigest(batchState(batch, e)))
+                if loops == state_tick:
+                    states[i] = batchState(batch, e)
+        batch.stopEnded(n_sim_steps)
+        batch.update()
+        loops += 1
+        for i, e in enumerate(eps):
+            if running[i] and e in batch.errors:
+                error = batch.errors[e]
+                digests[i].append(f"{type(error).__name__}: {error}")
+            running[i] = running[i] and bool(batch.running[e])
+    return digests, states
+
+
+# compare a backend against the reference engine on every scenario and seed
+#   returns the divergences as (scenario name, seed, first divergent tick, description)
+def compareBackends(backend, scenarios, seeds, n_sim_steps=100, config_file="CONFIGS/gamma_config.yaml", verbose=True):
+    divergences = []
+    if backend == 'batch':
+        runs = [(kind, arg, seed) for _, kind, arg in scenarios for seed in seeds]
+        batch_digests = iter(runBatch(runs, n_sim_steps, config_file)[0])
+    for name, kind, arg in scenarios:
+        for seed in seeds:
+            ref, _ = runScenario(kind, arg, seed, 'object', n_sim_steps, config_file)
+            if backend == 'batch':
+                alt = next(batch_digests)
+            else:
+                alt, _ = runScenario(kind, arg, seed, backend, n_sim_steps, config_file)
+            if ref == alt:
+                if verbose:
+                    print(f"OK       {name} [seed {seed}] - {len(ref)-1} ticks")
+                continue
+
+            # find the first divergent tick and describe what differs there
+            tick = next((t for t in range(min(len(ref), len(alt))) if ref[t] != alt[t]), min(len(ref), len(alt)))
+            desc = describeDivergence(kind, arg, seed, backend, n_sim_steps, config_file, tick, ref, alt)
+            divergences.append((name, seed, tick, desc))
+            if verbose:
+                print(f"DIVERGE  {name} [seed {seed}] at tick {tick} - {desc}")
+    return divergences
+
+# compare evo_utils.simulate_batch against simulate_fortress on the same individuals (random ones, and mutants of
+#   them) for each kind of fitness and BCs, over two rounds of episodes
+#   returns the divergences as (setup name, individual, description)
+def compareEvo(n_inds=4, n_new_sims=3, n_sim_steps=100, config_file="CONFIGS/gamma_config.yaml", verbose=True):
+    from evo_utils import EvoIndividual, simulate_batch
+
+    class MutationArgs:
+        edge_coin, node_coin, instance_coin = 0.5, 0.5, 0.5
+
+    divergences = []
+    for fitness_type, bcs in [('tree', ['n_entities', 'n_nodes']), ('tree', ['n_nodes', 'entropy']), ('M', ['n_entities', 'n_nodes'])]:
+        for map_elites, eval_instance_entropy in [(False, False), (True, True)]:
+            name = f"{fitness_type} {'/'.join(bcs)}" + (" map_elites" if map_elites else "") + (" entropy" if eval_instance_entropy else "")
+            random.seed(0)
+            np.random.seed(0)
+            seq = [EvoIndividual(config_file, fitness_type, bcs, init_seed=i, log_level='none') for i in range(n_inds)]
+            for ind in seq[n_inds//2:]:
+                ind.mutate_ind(MutationArgs)
+            batch = [ind.clone() for ind in seq]
+            for _ in range(2):
+                for ind in seq:
+                    ind.simulate_fortress(map_elites=map_elites, n_new_sims=n_new_sims, n_steps_per_episode=n_sim_steps,
+                                          eval_instance_entropy=eval_instance_entropy)
+                simulate_batch(batch, n_new_sims, n_sim_steps, map_elites, eval_instance_entropy)
+
+            n_diverge = len(divergences)
+            for i, (a, b) in enumerate(zip(seq, batch)):
+                ref = (a.score, a.bc_sim_vals, a.n_sims, a.instance_entropy)
+                alt = (b.score, b.bc_sim_vals, b.n_sims, b.instance_entropy)
+                if ref != alt:
+                    divergences.append((name, i, f"score, BCs, episodes and entropy {ref} (simulate_fortress) vs {alt} (simulate_batch)"))
+            if verbose:
+                for _, i, desc in divergences[n_diverge:]:
+                    print(f"DIVERGE  {name} [individual {i}] - {desc}")
+                if len(divergences) == n_diverge:
+                    print(f"OK       {name} - {n_inds} individuals")
+    return divergences
+
+# explain a divergence by rerunning both backends up to the divergent tick
+def describeDivergence(kind, arg, seed, backend, n_sim_steps, config_file, tick, ref, alt):
+    if tick >= len(ref) or tick >= len(alt):
+        return f"run length {len(ref)-1} (reference) vs {len(alt)-1} ({backend})"
+    if ':' in ref[tick] or ':' in alt[tick]:
+        return f"{ref[tick]} (reference) vs {alt[tick]} ({backend})"
+
+    _, ref_state = runScenario(kind, arg, seed, 'object', n_sim_steps, config_file, state_tick=tick)
+    if backend == 'batch':
+        alt_state = runBatch([(kind, arg, seed)], n_sim_steps, config_file, state_tick=tick)[1][0]
+    else:
+        _, alt_state = runScenario(kind, arg, seed, backend, n_sim_steps, config_file, state_tick=tick)
+    ref_ents, ref_visits = ref_state
+    alt_ents, alt_visits = alt_state
+    if len(ref_ents) != len(alt_ents):
+        return f"{len(ref_ents)} entities (reference) vs {len(alt_ents)} ({backend})"
+    for i, (r, a) in enumerate(zip(ref_ents, alt_ents)):
+        if r != a:
+            return f"entity #{i} {r} (reference) vs {a} ({backend})"
+    for r, a in zip(ref_visits, alt_visits):
+        if r != a:
+            return f"tree visits {r} (reference) vs {a} ({backend})"
+    return "tree visits differ"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", "--backend", type=str, default="soa", help='Backend to compare against the reference engine (soa, scheduled or batch)')
+    parser.add_argument("-n", "--n_sim_steps", type=int, default=100, help='Number of simulation steps per scenario')
+    parser.add_argument("-s", "--n_seeds", type=int, default=3, help='Number of seeds per scenario')
+    parser.add_argument("-r", "--n_random", type=int, default=5, help='Number of randomly generated fortresses')
+    parser.add_argument("-c", "--config", type=str, default="CONFIGS/gamma_config.yaml", help='Config file')
+    args = parser.parse_args()
+
+    divergences = compareBackends(args.backend, listScenarios(args.n_random), range(args.n_seeds),
+                                  args.n_sim_steps, args.config)
+    # the batch also evaluates individuals (evo_utils.simulate_batch)
+    if args.backend == 'batch':
+        divergences += compareEvo(n_sim_steps=args.n_sim_steps, config_file=args.config)
+    print(f"{len(divergences)} divergent runs")
+    sys.exit(1 if divergences else 0)
@@ -0,0 +1,103 @@
+"""Persistent evaluation workers, which simulate the genomes of individuals instead of whole individuals.
+
+The workers of a pool are set up once with `init_worker`. They parse the config once and keep one warm engine per
+config file, which every genome of the config is loaded into in turn (see `Genome.load_into`). A task (see
+`make_task`) holds the genome of an individual as plain data, its init seed, its stats so far (the episode seeds
+continue from its number of simulations, as in `simulate_fortress`) and the episode settings. It returns what
+`EvoIndividual.update` takes: the new score and BCs (and instance entropy) and the number of simulations. So the
+traffic of a generation scales with the size of the genomes rather than the size of the engines, and the results
+are the same as simulating the individuals in the main process.
+
+    pool = make_pool(n_proc, config_file)     # a Ray pool, or a local one (see local_pool.py)
+    evaluate_inds(pool, mutants, n_new_sims, n_steps_per_episode, map_elites=True)
+"""
+from concurrent.futures import Future
+from typing import List
+
+from engine import Engine
+from evo_utils import EvoIndividual
+from genome import Genome
+from simconfig import loadConfig
+
+# the state of a worker process - config file -> warm engine
+_engines = {}
+
+
+def init_worker(config_file: str = None):
+    """Set up a worker process (the initializer of the pool), with the engine of a config file ready."""
+    _engines.clear()
+    if config_file is not None:
+        _engines[config_file] = Engine(config_file)
+
+
+def _warm_engine(config_file: str, log_level):
+    engine = _engines.get(config_file)
+    if engine is None:
+        engine = _engines[config_file] = Engine(config_file)
+    if log_level is not None and engine.fortress.log_level != log_level:
+        engine.fortress.setLogLevel(log_level)
+    return engine
+
+
+def make_task(ind: EvoIndividual, n_new_sims: int, n_steps_per_episode: int, map_elites=False,
+              eval_instance_entropy=False):
+    """The task of simulating `n_new_sims` new episodes of an individual on a worker."""
+    genome = ind.genome.as_dict()
+    del genome['init_ent_str']      # only kept for printouts of the individual, the worker doesn't need it
+    stats = (ind.score, ind.bc_sim_vals, ind.n_sims, getattr(ind, 'instance_entropy', 0))
+    return (ind.config_file, ind.fitness_type, ind.bcs, ind.init_seed, ind.log_level, genome, stats,
+            n_new_sims, n_steps_per_episode, map_elites, eval_instance_entropy)
+
+
+def evaluate_genome(task):
+    """Simulate a task made by `make_task` on the warm engine of its config (runs on a worker)."""
+    (config_file, fitness_type, bcs, init_seed, log_level, genome, stats,
+     n_new_sims, n_steps_per_episode, map_elites, eval_instance_entropy) = task
+    engine = _warm_engine(config_file, log_level)
+    genome = Genome.from_dict(genome, loadConfig(config_file))
+    genome.load_into(engine, init_seed)
+
+    ind = EvoIndividual(config_file, fitness_type, bcs, init_seed=init_seed, log_level=log_level, genome=genome)
+    ind.engine = engine
+    ind.score, ind.bc_sim_vals, ind.n_sims, ind.instance_entropy = stats
+    return ind.simulate_fortress(map_elites=map_elites, n_new_sims=n_new_sims,
+                                 n_steps_per_episode=n_steps_per_episode,
+                                 eval_instance_entropy=eval_instance_entropy)
+
+
+def make_pool(n_proc: int, config_file: str, evaluator: str = 'ray'):
+    """A pool of `n_proc` workers set up by `init_worker`: a Ray pool, or with `evaluator='local'` a pool of local
+    processes that pass the tasks and results through shared memory (see local_pool.py)."""
+    assert evaluator in ('ray', 'local'), f"Unknown evaluator {evaluator}"
+    if evaluator == 'local':
+        from local_pool import LocalPool
+        return LocalPool(n_proc, config_file)
+    from ray.util.multiprocessing import Pool
+    return Pool(processes=n_proc, initializer=init_worker, initargs=(config_file,))
+
+
+def iter_results(pool, tasks: list):
+    """The results of tasks made by `make_task`, in order, as the pool of `make_pool` returns them."""
+    if hasattr(pool, 'evaluate_iter'):
+        return pool.evaluate_iter(tasks)
+    return pool.imap(evaluate_genome, tasks)
+
+
+def submit_task(pool, task) -> Future:
+    """Start a task made by `make_task` on the pool of `make_pool` without waiting for it. Returns a future of its
+    result (so the tasks of either pool can be waited on with `concurrent.futures.wait`)."""
+    if hasattr(pool, 'submit'):
+        return pool.submit(task)
+    future = Future()
+    pool.apply_async(evaluate_genome, (task,), callback=future.set_result, error_callback=future.set_exception)
+    return future
+
+
+def evaluate_inds(pool, inds: List[EvoIndividual], n_new_sims: int, n_steps_per_episode: int, map_elites=False,
+                  eval_instance_entropy=False):
+    """Simulate new episodes of individuals on a pool of workers set up by `init_worker`, and update their stats."""
+    tasks = [make_task(ind, n_new_sims, n_steps_per_episode, map_elites, eval_instance_entropy) for ind in inds]
+    rets = list(iter_results(pool, tasks))
+    for ind, ret in zip(inds, rets):
+        ind.update(ret, map_elites, eval_instance_entropy)
+    return rets
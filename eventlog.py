@@ -0,0 +1,190 @@
+import numpy as np
+
+
+# event types of the fortress log
+EV_TEXT = 0         # free text logged with addLog (the tick is added when formatted)
+EV_RAW = 1          # text appended to the log as is
+EV_MOVE = 2
+EV_CHASE = 3        # moved towards the (tx, ty) position
+EV_PUSH_FAIL = 4    # moved without pushing
+EV_PUSH = 5
+EV_TAKE = 6
+EV_DIE = 7
+EV_BLOCKED = 8      # blocked by a wall entity
+EV_CLONE_FAIL = 9
+EV_CLONE = 10       # actor is the parent entity (None for a clone of the species made without one)
+EV_ADD = 11
+EV_TRANSFORM = 12
+
+EVENT_NAMES = ['text', 'raw', 'move', 'chase', 'push_fail', 'push', 'take', 'die', 'blocked', 'clone_fail', 'clone', 'add', 'transform']
+EVENTS = {name: i for i, name in enumerate(EVENT_NAMES)}
+
+# one event of the log - ids are the entity ids read as hex (-1 for none) and chars are code points
+EVENT_DTYPE = np.dtype([('tick', np.int32), ('type', np.uint8), ('actor', np.int32), ('achar', np.uint32),
+                        ('target', np.int32), ('tchar', np.uint32), ('x', np.int32), ('y', np.int32),
+                        ('tx', np.int32), ('ty', np.int32)])
+
+
+# the log of a fortress as typed events in a preallocated ring buffer (the oldest events are overwritten once it is full)
+#   the lines are only formatted when read, and reading works like the list of strings the log used to be
+#   (len, indexing, slicing, iterating and append for free text)
+#   events are staged in a list and written to the buffer in blocks; event types in drop are never recorded
+class EventLog():
+    def __init__(self, capacity=4096, drop=(), block=256):
+        self.capacity = capacity
+        self.drop = set(EVENTS[d] if isinstance(d, str) else d for d in drop)
+        self.block = block
+        self.buf = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self.texts = [None] * capacity     # text of the text events by slot
+        self.n = 0              # number of events written to the buffer so far
+        self.staged = []        # (tick, type, actor id, actor char, target id, target char, x, y, tx, ty, text)
+
+    # record an event (actor and target are entities or None)
+    def add(self, tick, etype, actor=None, target=None, x=-1, y=-1, tx=-1, ty=-1):
+        if etype in self.drop:
+            return
+        self.staged.append((tick, etype, None if actor is None else actor.id, None if actor is None else actor.char,
+                            None if target is None else target.id, None if target is None else target.char,
+                            x, y, tx, ty, None))
+        if len(self.staged) >= self.block:
+            self._flush()
+
+    # record free text (raw text is shown as is, otherwise with the tick)
+    def addText(self, tick, text, raw=False):
+        etype = EV_RAW if raw else EV_TEXT
+        if etype in self.drop:
+            return
+        self.staged.append((tick, etype, None, None, None, None, -1, -1, -1, -1, text))
+        if len(self.staged) >= self.block:
+            self._flush()
+
+    # same as adding a line to the list the log used to be
+    def append(self, text):
+        self.addText(0, text, raw=True)
+
+    # drop every event (the texts of the old slots are overwritten when the slots are used again)
+    def clear(self):
+        self.n = 0
+        self.staged = []
+
+    # write the staged events to the buffer
+    def _flush(self):
+        if not self.staged:
+            return
+        staged = self.staged[-self.capacity:]
+        self.staged = []
+        rows = [(t, e, -1 if a is None else int(a, 16), ord(ac) if ac else 0, -1 if g is None else int(g, 16),
+                 ord(gc) if gc else 0, x, y, tx, ty) for t, e, a, ac, g, gc, x, y, tx, ty, _ in staged]
+        slots = (self.n + np.arange(len(rows))) % self.capacity
+        self.buf[slots] = np.array(rows, dtype=EVENT_DTYPE)
+        for s, ev in zip(slots.tolist(), staged):
+            self.texts[s] = ev[10]
+        self.n += len(rows)
+
+    # the events in the buffer from the oldest one (a view of the buffer for the events that didn't wrap around)
+    def events(self):
+        self._flush()
+        k = min(self.n, self.capacity)
+        start = (self.n - k) % self.capacity
+        if start + k <= self.capacity:
+            return self.buf[start:start+k]
+        return np.concatenate((self.buf[start:], self.buf[:start+k-self.capacity]))
+
+
+    #######     FORMATTING     #######
+
+    # format the event in a slot of the buffer as a log line
+    def _line(self, slot):
+        ev = self.buf[slot]
+        etype, tick = int(ev['type']), int(ev['tick'])
+        if etype == EV_RAW:
+            return self.texts[slot]
+        if etype == EV_TEXT:
+            return f"{self.texts[slot]} -- <{tick}>"
+
+        actor = f"{chr(ev['achar'])}.{_hexID(ev['actor'])}" if ev['actor'] >= 0 else chr(ev['tchar'])
+        target = f"{chr(ev['tchar'])}.{_hexID(ev['target'])}"
+        pos = f"[{int(ev['x'])}, {int(ev['y'])}]"
+        if etype == EV_MOVE:
+            txt = f"[{actor}] moved to {pos}"
+        elif etype == EV_CHASE:
+            txt = f"[{actor}] moved to {pos} goto [{int(ev['tx'])}, {int(ev['ty'])}]"
+        elif etype == EV_PUSH_FAIL:
+            txt = f"[{actor}] moved to {pos} - (not able to push)"
+        elif etype == EV_PUSH:
+            txt = f"[{actor}] pushed [{target}]"
+        elif etype == EV_TAKE:
+            txt = f"[{actor}] took [{target}]"
+        elif etype == EV_DIE:
+            txt = f"[{actor}] died"
+        elif etype == EV_BLOCKED:
+            txt = f"[{actor}] blocked by wall {target}"
+        elif etype == EV_CLONE_FAIL:
+            txt = "Clone failed"
+        elif etype == EV_CLONE:
+            txt = f"[{actor}] cloned to [{target}] at {pos}"
+        elif etype == EV_ADD:
+            txt = f"[{actor}] added [{target}] at {pos}"
+        elif etype == EV_TRANSFORM:
+            txt = f"[{actor}] transformed into [{target}] at {pos}"
+        return f"{txt} -- <{tick}>"
+
+    # slot of the i-th event still in the buffer
+    def _slot(self, i):
+        k = min(self.n, self.capacity)
+        return (self.n - k + i) % self.capacity
+
+    def __len__(self):
+        return min(self.n + len(self.staged), self.capacity)
+
+    def __getitem__(self, i):
+        self._flush()
+        k = len(self)
+        if isinstance(i, slice):
+            return [self._line(self._slot(j)) for j in range(*i.indices(k))]
+        if i < 0:
+            i += k
+        if not 0 <= i < k:
+            raise IndexError("log index out of range")
+        return self._line(self._slot(i))
+
+    def __iter__(self):
+        self._flush()
+        for i in range(len(self)):
+            yield self._line(self._slot(i))
+
+    # all of the lines (the log as the list of strings it used to be)
+    def lines(self):
+        return list(self)
+
+
+    #######     PICKLING     #######
+
+    # only the events still in the buffer are pickled
+    def __getstate__(self):
+        self._flush()
+        k = min(self.n, self.capacity)
+        slots = [self._slot(i) for i in range(k)]
+        state = self.__dict__.copy()
+        state['buf'] = self.events().copy()
+        state['texts'] = [self.texts[s] for s in slots]
+        state['n'] = k
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.restore(state['buf'], state['texts'])
+
+    # replace the events with saved ones (from the oldest one, with the texts of the events)
+    def restore(self, events, texts):
+        k = len(events)
+        self.buf = np.zeros(self.capacity, dtype=EVENT_DTYPE)
+        self.buf[:k] = events
+        self.texts = list(texts) + [None] * (self.capacity - k)
+        self.n = k
+        self.staged = []
+
+
+# entity id from the hex number it was stored as
+def _hexID(i):
+    return '%04x' % i
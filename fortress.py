@@ -1,11 +1,15 @@
 import numpy as np
 import random
 import datetime
-import re
-from entities import NODE_DICT, Entity
+from entities import NODE_DICT, Species
+from eventlog import EventLog
+from simconfig import SimConfig
 from entropy_utils import sum_combinations
 
 
+LOG_LEVELS = ('all', 'text', 'none')
+
+
 # the environment where all of the simulation takes place
 class Fortress():
     def __init__(self, config, width, height, borderChar='#',floorChar='.',seed=None):
@@ -15,35 +19,48 @@ class Fortress():
         self.height = height
         self.max_entities = (width-2) * (height-2) * 2
         self.fortmap = []
+        self.walkmap = None     # boolean grid of the floor tiles of fortmap (rebuilt by updateWalkable)
+        self.walk_rows = []     # the same grid as nested lists (faster for single tile lookups)
 
         self.entities = {}   # dictionary of entities
+        self.ent_grid = {}   # occupancy index of (x,y) position -> list of entities on that cell
+        self.ent_seq = 0     # insertion counter used to break ties between entities on the same cell
+        self.char_ents = {}  # entities bucketed by character (char -> {id: entity}, in insertion order)
+        self.char_grid = {}  # occupancy index per character (char -> {(x,y): list of entities})
+        self.scheduler = None   # event scheduler told about added / moved / removed entities (see scheduler.py)
+        self.cycles = None      # cycle detector told about the same events and node changes (see cycles.py)
+        self.ring_search_min = 16   # number of candidates above which closestEnt searches rings of cells instead of scanning
+        self.next_id = 0     # counter the entity IDs are allocated from
         self.CHARACTER_DICT = {}    # definition of all of the characters classes in the simulation 
         self.CHAR_VISIT_TREE = {}   # stores the tree node visits of each entity instance per class
         self.max_aggregate_fsm_nodes = None   # the maximum number of nodes and edges over all entity types
 
-        self.CONFIG = config  # a dictionary of values for configuration
+        self.CONFIG = config if isinstance(config, SimConfig) else SimConfig(config)  # the configuration (read-only, see simconfig.py)
         self.seed = random.randint(0,1000000) if seed == None else seed
 
         self.rng_init = np.random.default_rng(seed)
         # Seed for determining random movement dynamics during an episode
         self.rng_sim = np.random.default_rng(0)
+        self.rng_block = 256      # number of 32-bit words drawn from rng_sim at a time for the random directions (see randDir)
+        self.rng_compat = False   # draw every random direction from rng_sim directly (see randDir)
+        self.dir_words = []       # words drawn from rng_sim that have not been used yet
+        self.dir_i = 0
+        self.dir_src = None       # the generator the words were drawn from
 
         # random.seed(self.seed)
         # np.random.seed(self.seed)
 
-        self.log = [f"============    FORTRESS SEED [{seed}]    =========", "Fortress initialized! - <0>"]
+        # the log of the simulation events (see eventlog.py)
+        self.log = EventLog(config.get('log_capacity', 4096), config.get('log_drop', ()))
+        self.log.append(f"============    FORTRESS SEED [{seed}]    =========")
+        self.log.append("Fortress initialized! - <0>")
+        self.setLogLevel(config.get('log_level', 'all'))
         self.steps = 0
+        self.last_activity = 0  # last tick an entity was added, moved or removed (see inactive)
         self.end_cause = "Code Interruption"
 
-        # self.node_types = set()
-        self.node_types = []
-        for node in NODE_DICT:
-            if NODE_DICT[node]['args'] == []:
-                # self.node_types.add(node)
-                self.node_types.append(node)
-            elif NODE_DICT[node]['args'] == ['entityChar']:
-                # [self.node_types.add(f"{node} {c}") for c in self.CONFIG['character']]
-                self.node_types += [f"{node} {c}" for c in self.CONFIG['character']]
+        # every node a species can have (worked out once per config)
+        self.node_types = list(self.CONFIG.node_types)
 
 
     # create a blank fortress
@@ -53,6 +70,12 @@ class Fortress():
         self.fortmap[-1,:] = self.border
         self.fortmap[:,0] = self.border
         self.fortmap[:,-1] = self.border
+        self.updateWalkable()
+
+    # rebuild the walkability grid from the map (call after editing fortmap)
+    def updateWalkable(self):
+        self.walkmap = self.fortmap == self.floor
+        self.walk_rows = self.walkmap.tolist()
         
 
     # print the fortress to the console
@@ -63,7 +86,100 @@ class Fortress():
 
     # add an entity to the map
     def addEntity(self, ent):
-        self.entities[ent.id] = ent
+        if ent.id not in self.entities:
+            ent.seq = self.ent_seq
+            self.ent_seq += 1
+            if ent.char not in self.char_ents:
+                self.char_ents[ent.char] = {}
+                self.char_grid[ent.char] = {}
+            self.char_ents[ent.char][ent.id] = ent
+            self._gridAdd(ent)
+            self.entities[ent.id] = ent
+            self.last_activity = self.steps
+            if self.scheduler is not None:
+                self.scheduler.entAdded(ent)
+            if self.cycles is not None:
+                self.cycles.entAdded(ent)
+        else:
+            self.entities[ent.id] = ent
+
+    # move an entity to a new position and keep the occupancy index current
+    def moveEntity(self, ent, pos):
+        if ent.id in self.entities:
+            self._gridRemove(ent)
+            ent.pos = pos
+            self._gridAdd(ent)
+            self.last_activity = self.steps
+            if self.scheduler is not None:
+                self.scheduler.entMoved(ent)
+            if self.cycles is not None:
+                self.cycles.entChanged(ent)
+        else:
+            ent.pos = pos
+
+    # remove every entity from the map
+    def clearEntities(self):
+        self.entities = {}
+        self.ent_grid = {}
+        self.ent_seq = 0
+        self.char_ents = {}
+        self.char_grid = {}
+        self.next_id = 0
+        if self.scheduler is not None:
+            self.scheduler.reset()
+        if self.cycles is not None:
+            self.cycles.reset()
+
+    # replace the entities and their indexes with new ones built elsewhere (e.g. restored from a snapshot, see
+    #   snapshot.py) - entities in update order with their seq set; next_id is where the ID counter continues from
+    def setEntities(self, entities, ent_grid, char_ents, char_grid, next_id):
+        self.entities = entities
+        self.ent_grid = ent_grid
+        self.char_ents = char_ents
+        self.char_grid = char_grid
+        self.ent_seq = len(entities)
+        self.next_id = next_id
+        if entities:
+            self.last_activity = self.steps
+        if self.scheduler is not None:
+            self.scheduler.reset()
+        if self.cycles is not None:
+            self.cycles.reset()
+
+    # allocate a new entity ID - a counter rendered as hex that wraps around and skips IDs still in use
+    #   the same sequence of calls always gives the same IDs, and resetting the entities restarts the counter
+    def newID(self, id_len=4):
+        n_ids = 16**id_len
+        if len(self.entities) >= n_ids:
+            # every short ID is taken, so fall back to a longer one
+            i = self.next_id
+            self.next_id += 1
+            return f'%0{id_len+1}x' % (n_ids + i)
+
+        while True:
+            i = f'%0{id_len}x' % (self.next_id % n_ids)
+            self.next_id += 1
+            if i not in self.entities:
+                return i
+
+    # add an entity to the buckets of the cell it is on
+    def _gridAdd(self, ent):
+        cell = (ent.pos[0], ent.pos[1])
+        for grid in (self.ent_grid, self.char_grid[ent.char]):
+            if cell in grid:
+                grid[cell].append(ent)
+            else:
+                grid[cell] = [ent]
+
+    # remove an entity from the buckets of the cell it is on
+    def _gridRemove(self, ent):
+        cell = (ent.pos[0], ent.pos[1])
+        for grid in (self.ent_grid, self.char_grid[ent.char]):
+            bucket = grid[cell]
+            if len(bucket) == 1:
+                del grid[cell]
+            else:
+                bucket.remove(ent)
 
     # returns the entities sorted by character
     def getEntCharSet(self):
@@ -78,6 +194,13 @@ class Fortress():
     def removeFromMap(self, ent):
         if ent.id in self.entities:
             del self.entities[ent.id]
+            del self.char_ents[ent.char][ent.id]
+            self._gridRemove(ent)
+            self.last_activity = self.steps
+            if self.scheduler is not None:
+                self.scheduler.entRemoved(ent)
+            if self.cycles is not None:
+                self.cycles.entRemoved(ent)
 
 
     # render the entities on the map
@@ -101,11 +224,47 @@ class Fortress():
         if x < 0 or x >= self.width or y < 0 or y >= self.height:
             return False
 
-        if self.fortmap[y,x] == self.floor:
-            return True
-        else:
-            return False
+        return self.walk_rows[y][x]
         
+    # return a random direction index in [0, n) for the entities (n is a power of 2, 4 for the adjacent cells)
+    #   determinism contract: the directions come from a stream of 32-bit words drawn from rng_sim in blocks of
+    #   rng_block words; each direction uses the top bits of one word (n=1 uses none), which is the same value
+    #   rng_sim.integers(0, n) or rng_sim.choice on n options would give, so the directions only depend on the seed
+    #   of rng_sim and the order of the calls, and not on the block size. Replacing rng_sim starts a new stream.
+    #   The directions are the same as the per-call draws of older versions as long as nothing else draws from
+    #   rng_sim while the simulation runs; set rng_compat to draw every direction from rng_sim directly instead
+    def randDir(self, n=4):
+        if n == 1:
+            return 0
+        if self.rng_compat:
+            return int(self.rng_sim.integers(0, n))
+        if self.dir_i >= len(self.dir_words) or self.dir_src is not self.rng_sim:
+            self._drawDirWords()
+        w = self.dir_words[self.dir_i]
+        self.dir_i += 1
+        return w >> (33 - n.bit_length())
+
+    # return k random direction indices in [0, n) (the same as k calls of randDir)
+    def randDirs(self, k, n=4):
+        if n == 1:
+            return np.zeros(k, dtype=np.int64)
+        if self.rng_compat:
+            return self.rng_sim.integers(0, n, size=k)
+        words = []
+        while len(words) < k:
+            if self.dir_i >= len(self.dir_words) or self.dir_src is not self.rng_sim:
+                self._drawDirWords()
+            take = min(k - len(words), len(self.dir_words) - self.dir_i)
+            words += self.dir_words[self.dir_i:self.dir_i+take]
+            self.dir_i += take
+        return np.array(words, dtype=np.int64) >> (33 - n.bit_length())
+
+    # draw the next block of direction words from rng_sim (a new generator drops the words left from the old one)
+    def _drawDirWords(self):
+        self.dir_words = self.rng_sim.integers(0, 2**32, size=self.rng_block, dtype=np.uint32).tolist()
+        self.dir_i = 0
+        self.dir_src = self.rng_sim
+
     # return a random position in the fortress
     def randomPos(self,inc_ent=True):
         all_pos = [(x,y) for x in range(1,self.width-1) for y in range(1,self.height-1)]
@@ -119,46 +278,80 @@ class Fortress():
         # if no valid position is found
         return None
     
-    # check if an entity is at a position
+    # check if an entity is at a position (the earliest added one if several share the cell)
     def entAtPos(self, x, y):
-        for ent in self.entities.values():
-            if ent.pos[0] == x and ent.pos[1] == y:
-                return ent
-        return None
+        bucket = self.ent_grid.get((x, y))
+        if not bucket:
+            return None
+        if len(bucket) == 1:
+            return bucket[0]
+        return min(bucket, key=lambda e: e.seq)
     
-    # find the closest entity character from a specific position
+    # find the closest entity character from a specific position (ties go to the earliest added entity)
     def closestEnt(self, x,y, c, eid=None):
         # find all of the characters (not including self)
-        all_c = []
-        for ent in self.entities.values():
-            if ent.char == c and (eid == None or ent.id != eid):
-                all_c.append(ent)
+        all_c = self.char_ents.get(c)
+        if not all_c:
+            return None
+        n_cand = len(all_c) - (eid in all_c)
 
         # no entities left in the map
-        if len(all_c) == 0:
+        if n_cand == 0:
             return None
-        
-        # calculate distances from all of the positions
-        dist = {}
-        for e in all_c:
-            dist[e] = abs(e.pos[0]-x) + abs(e.pos[1]-y)
-        
-        # return entity with the smallest distance
-        return sorted(dist.items(), key=lambda x:x[1])[0][0]
-        
+
+        # few candidates - scan them in insertion order
+        if n_cand <= self.ring_search_min:
+            best, best_dist = None, None
+            for e in all_c.values():
+                if e.id == eid:
+                    continue
+                d = abs(e.pos[0]-x) + abs(e.pos[1]-y)
+                if best_dist is None or d < best_dist:
+                    best, best_dist = e, d
+            return best
+
+        # many candidates - search outward one Manhattan ring of cells at a time
+        ring = self._ringSearch(self.char_grid[c], x, y, eid)
+        if ring is not None:
+            return ring
+
+        # only reached if the candidates are off the map
+        best, best_dist = None, None
+        for e in all_c.values():
+            if e.id == eid:
+                continue
+            d = abs(e.pos[0]-x) + abs(e.pos[1]-y)
+            if best_dist is None or d < best_dist:
+                best, best_dist = e, d
+        return best
+
+    # return the earliest added entity in the nearest non-empty Manhattan ring of cells around (x,y)
+    def _ringSearch(self, grid, x, y, eid=None):
+        max_d = max(x, self.width-1-x) + max(y, self.height-1-y)
+        for d in range(max_d+1):
+            best = None
+            for dx in range(max(-d, -x), min(d, self.width-1-x)+1):
+                dy = d - abs(dx)
+                for cy in ((y+dy, y-dy) if dy else (y,)):
+                    for e in grid.get((x+dx, cy), ()):
+                        if e.id != eid and (best is None or e.seq < best.seq):
+                            best = e
+            if best is not None:
+                return best
+        return None
 
 
 
     # create new trees for every character in the config file
     def makeCharacters(self, init_strat='n_nodes', entropy_dict=None):
-        n_ent_types = len(self.CONFIG['character'])
+        n_ent_types = len(self.CONFIG.chars)
         n_node_types = len(self.node_types)
         self.max_nodes_per_type = len(self.node_types)
         self.max_aggregate_fsm_nodes = n_ent_types * n_node_types
 
         self.CHARACTER_DICT = {}
         self.CHAR_VISIT_TREE = {}
-        char_list = self.CONFIG['character'].copy()
+        char_list = list(self.CONFIG.chars)
 
         if init_strat == 'entropy':
             # Sample uniformly over possible entropy values
@@ -252,12 +445,11 @@ class Fortress():
         self.rng_init.shuffle(char_list)
         for i, c in enumerate(char_list):
             n_nodes = ents_n_nodes[i]
-            ent = Entity(self,char=c, n_rand_nodes=n_nodes)
-            ent.pos = [-1,-1]
-            self.CHARACTER_DICT[c] = ent
+            self.CHARACTER_DICT[c] = Species(self,char=c, n_rand_nodes=n_nodes)
             self.CHAR_VISIT_TREE[c] = {'nodes':set(),'edges':set()}
 
-        self.addLog(f"{len(self.CHARACTER_DICT)} Unique character trees created")
+        if self.log_text:
+            self.addLog(f"{len(self.CHARACTER_DICT)} Unique character trees created")
 
     # def get_max_aggregate_fsm_nodes(self):
     #     n_ent_types = len(self.CHARACTER_DICT)
@@ -280,20 +472,11 @@ class Fortress():
             return True
         return False
     
-    # check if no activity has occurred in the fortress (based on the log information)
+    # check if no activity has occurred in the fortress (no entity added, moved or removed for too long)
     def inactive(self):
-        limit = self.CONFIG['inactive_limit']
-
-        # check if over time from start
-        if len(self.log) < 2 and self.steps > limit:
-            return True
-
-        # check if over time from last log
-        last_log_time = re.match(r' -- <(\d+)>', self.log[-1])
-        if (last_log_time) and (self.steps - int(last_log_time.groups()[0])) > limit:
+        if self.steps - self.last_activity > self.CONFIG.inactive_limit:
             self.end_cause = "Inactivity"
             return True
-        
         return False
     
     # check if too many entities in the simulation
@@ -304,9 +487,29 @@ class Fortress():
         return False
 
         
+    # what is logged - 'all' (the entity events and the messages), 'text' (only the messages) or 'none'
+    #   the call sites check log_events / log_text before building anything, so a level that skips them costs nothing
+    #   (lines appended to the log directly, like the summaries of the experiments, are always kept)
+    def setLogLevel(self, level):
+        assert level in LOG_LEVELS, f"Unknown log level {level}"
+        self.log_level = level
+        self.log_text = level != 'none'
+        self.log_events = level == 'all'
+
     # adds a message to the log
     def addLog(self, txt):
-        self.log.append(f"{txt} -- <{self.steps}>")
+        if self.log_text:
+            self.log.addText(self.steps, txt)
+
+    # add an event of an entity to the log (formatted only when the log is read, the callers check log_events first)
+    def logEvent(self, etype, actor=None, target=None, x=-1, y=-1, tx=-1, ty=-1):
+        self.log.add(self.steps, etype, actor, target, x, y, tx, ty)
+
+    # start the log over
+    def resetLog(self):
+        self.log.clear()
+        self.log.append(f"============    FORTRESS SEED [{self.seed}]    =========")
+        self.log.append("Fortress initialized! - <0>")
 
     # record the tree visits per entity and save it
     def addTreeVisit(self, ent):
@@ -320,13 +523,44 @@ class Fortress():
             self.CHAR_VISIT_TREE[c]['nodes'] = set()
             self.CHAR_VISIT_TREE[c]['edges'] = set()
 
+    # the nodes and edges per char that can still be added to the tree visits from the current entities (same
+    #   format as CHAR_VISIT_TREE) - the chars that can appear on the map grow until no species adds a new one
+    def reachableTree(self):
+        start = {}      # species -> nodes its entities are in
+        for ent in self.entities.values():
+            start.setdefault(ent.species, {0}).add(ent.cur_node)
+        chars = set(ent.char for ent in self.entities.values())
+        reach = {c: {'nodes':set(),'edges':set()} for c in self.CHAR_VISIT_TREE}
+        while True:
+            for c in chars:
+                if c in self.CHARACTER_DICT and self.CHARACTER_DICT[c] not in start:
+                    start[self.CHARACTER_DICT[c]] = {0}
+            spawned = set()
+            for species, nodes in start.items():
+                r_nodes, r_edges, r_spawned = species.reachableFSM(chars, nodes)
+                r = reach.setdefault(species.char, {'nodes':set(),'edges':set()})
+                r['nodes'] |= r_nodes
+                r['edges'] |= r_edges
+                spawned |= set(c for c in r_spawned if c in self.CHARACTER_DICT)
+            if spawned <= chars:
+                return reach
+            chars |= spawned
+
+    # if every reachable node and edge has been visited (nothing left for the visits to gain)
+    def treeSaturated(self, reach):
+        for c, r in reach.items():
+            v = self.CHAR_VISIT_TREE.get(c)
+            if v is None or not (v['nodes'] >= r['nodes'] and v['edges'] >= r['edges']):
+                return False
+        return True
+
 
     # imports a fortress from entity class definition list
     def importEntityFortDef(self, filename):
         # reset everything
         self.CHARACTER_DICT = {}
         self.CHAR_VISIT_TREE = {}
-        self.entities = {}
+        self.clearEntities()
 
         with open(filename, "r") as f:
             lines = f.read()
@@ -352,22 +586,22 @@ class Fortress():
                         self.setFortStateStr(estr,"fort")
                 # import the entity definition
                 else:
-                    ent = Entity(self,n_rand_nodes=1)  #dummy n_rand_nodes to allow import
-                    ent.importTreeStr(estr)
-                    ent.pos = [-1,-1]
-                    self.CHARACTER_DICT[ent.char] = ent
-                    self.CHAR_VISIT_TREE[ent.char] = {'nodes':set(),'edges':set()}
+                    species = Species(self,n_rand_nodes=1)  #dummy n_rand_nodes to allow import
+                    species.importTreeStr(estr)
+                    self.CHARACTER_DICT[species.char] = species
+                    self.CHAR_VISIT_TREE[species.char] = {'nodes':set(),'edges':set()}
 
     # sets a fortress state based on a string
     # essentially the same as engine.resetFortress
     def setFortStateStr(self,fort_str,type_init):
         # Remove all current entities
-        self.entities = {}
+        self.clearEntities()
 
         # reset the visits
         self.resetCharVisit()
 
         if(type_init == "fort"):
+            self.fortStr2Map(fort_str.split("\n")[1:])                  # copy the walls of the fortress string
             init_ents = self.fortStr2EntPos(fort_str.split("\n")[1:])   # parse the fortress string
         if(type_init == "pos"):
             init_ents = self.posStr2EntPos(fort_str)    # parse the entity position string
@@ -379,10 +613,11 @@ class Fortress():
                 self.addEntity(new_ent)
 
         # reset the log
-        self.log = [f"============    FORTRESS SEED [{self.seed}]    =========", "Fortress initialized! - <0>"]
-        # self.addLog(f">>> CONFIG FILE: {self.CONFIG} <<<")
-        self.addLog(f">>> TIME: {datetime.datetime.now()} <<<")
-        self.addLog(f"Fortress randomly populated with {len(init_ents)} entities")    # add a log message
+        self.resetLog()
+        if self.log_text:
+            # self.addLog(f">>> CONFIG FILE: {self.CONFIG} <<<")
+            self.addLog(f">>> TIME: {datetime.datetime.now()} <<<")
+            self.addLog(f"Fortress randomly populated with {len(init_ents)} entities")    # add a log message
 
 
         self.steps = 0
@@ -404,6 +639,15 @@ class Fortress():
         return pos_set
 
 
+    # copies the wall and floor tiles of a raw string format of the fortress onto the map
+    def fortStr2Map(self, lines):
+        for r in range(min(len(lines), self.height)):
+            cols = list(lines[r].strip())
+            for c in range(min(len(cols), self.width)):
+                self.fortmap[r,c] = self.border if cols[c] == self.border else self.floor
+        self.updateWalkable()
+
+
     # converts a list of entity positions to the initial position set
     def posStr2EntPos(self,s):
         pos_set = []
@@ -0,0 +1,102 @@
+from typing import Dict, List
+
+import numpy as np
+
+from engine import Engine
+from entities import Species
+from soa_backend import SoABackend
+from scheduler import Scheduler
+
+
+class Genome():
+    """The heritable part of an individual: the FSM of every species and the initial placement of its entities.
+
+    This is all a mutant inherits, so cloning an individual only copies its genome (the engine, with its map, log
+    and live entities, is rebuilt from the genome the first time the mutant is simulated, see `build_engine`).
+    While no engine is built, the species point to the genome instead of a fortress - it has the config and the
+    node types they need to mutate (`CONFIG` and `node_types`, like a fortress).
+    """
+
+    def __init__(self, config, species: Dict[str, Species], init_ents: List[dict], width: int, height: int,
+                 max_entities: int, init_ent_str: str = ""):
+        self.CONFIG = config
+        self.node_types = list(config.node_types)
+        self.species = species          # char -> species (the CHARACTER_DICT of the engine built from the genome)
+        self.init_ents = init_ents      # the {'char', 'pos'} entities placed at the start of every episode
+        self.width = width
+        self.height = height
+        self.max_entities = max_entities
+        self.init_ent_str = init_ent_str    # the trees of the species when the first individual was made
+
+    @classmethod
+    def from_engine(cls, engine: Engine):
+        """The genome of a populated engine (shares its species and initial entities, which the mutations edit)."""
+        f = engine.fortress
+        return cls(f.CONFIG, f.CHARACTER_DICT, engine.init_ents, f.width, f.height, f.max_entities,
+                   engine.init_ent_str)
+
+    def as_dict(self):
+        """The genome as plain lists and dictionaries (e.g. to encode as JSON), with the species in their order."""
+        return {
+            'species': [{'char': s.char, 'nodes': s.nodes, 'edges': s.edges, 'avail_node_types': s.avail_node_types}
+                        for s in self.species.values()],
+            'init_ents': [[e['char'], None if e['pos'] is None else [int(e['pos'][0]), int(e['pos'][1])]]
+                          for e in self.init_ents],
+            'width': self.width,
+            'height': self.height,
+            'max_entities': self.max_entities,
+            'init_ent_str': self.init_ent_str,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict, config):
+        """The genome of a dictionary made by `as_dict`, for the given config (a SimConfig)."""
+        genome = cls(config, {}, [{'char': c, 'pos': pos} for c, pos in d['init_ents']], d['width'], d['height'],
+                     d['max_entities'], d.get('init_ent_str', ""))
+        for s in d['species']:
+            species = Species(genome, s['char'], nodes=s['nodes'], edges=s['edges'])
+            species.avail_node_types = s['avail_node_types']
+            genome.species[s['char']] = species
+        return genome
+
+    def clone(self):
+        """A copy of the genome that can be mutated on its own (the compiled FSMs stay shared until edited)."""
+        genome = Genome.__new__(Genome)
+        genome.__dict__.update(self.__dict__)
+        genome.species = {c: s.copy() for c, s in self.species.items()}
+        for s in genome.species.values():
+            s.fortress = genome
+        genome.init_ents = [{'char': e['char'], 'pos': None if e['pos'] is None else [e['pos'][0], e['pos'][1]]}
+                            for e in self.init_ents]
+        return genome
+
+    def build_engine(self, config_file: str, seed: int, log_level='all'):
+        """A new engine with the species and initial entities of the genome (placed when the fortress is reset)."""
+        engine = Engine(config_file, init_seed=seed, log_level=log_level)
+        self.load_into(engine)
+        return engine
+
+    def load_into(self, engine: Engine, seed: int = None):
+        """Put the species and initial entities of the genome in an existing engine of the same config, in place of
+        the ones it has (e.g. to reuse one engine for many genomes, see eval_workers.py). The next episode of the
+        engine runs as it would on a new engine built from the genome (with `seed` as its init seed, if given)."""
+        f = engine.fortress
+        if seed is not None:
+            engine.seed = f.seed = seed
+            f.rng_init = np.random.default_rng(seed)
+        f.CHARACTER_DICT = self.species
+        f.CHAR_VISIT_TREE = {c: {'nodes':set(),'edges':set()} for c in self.species}
+        for s in self.species.values():
+            s.fortress = f
+        f.max_nodes_per_type = len(f.node_types)
+        f.max_aggregate_fsm_nodes = len(f.CONFIG.chars) * len(f.node_types)
+        f.end_cause = "Code Interruption"
+        engine.init_ents = self.init_ents
+        engine.init_ent_str = self.init_ent_str
+        engine.init_snapshot = None
+
+        # the backends and the cycle detector start over with the new species (like those of a new engine)
+        engine.soa = SoABackend(f) if engine.soa is not None else None
+        engine.scheduler = Scheduler(f) if engine.scheduler is not None else None
+        f.scheduler = engine.scheduler
+        engine.detectCycles(False)
@@ -76,7 +76,8 @@ def hillclimb(config_file: str):
                 print("")
 
             best_score = ind.score
-            best_ind = ind.clone()
+            # the individual itself, which keeps the fortress of its last episode for the final report
+            best_ind = ind
         
         # print the stats of the generation
         print(f"[ GENERATION {generation} ]")
@@ -91,6 +92,7 @@ def hillclimb(config_file: str):
         entity_num_history.append(len(ind.engine.fortress.entities))
 
 
+        # the next mutant (a clone only carries the genome and stats, not the simulated fortress)
         ind = best_ind.clone()
         generation+=1
 
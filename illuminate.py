@@ -1,29 +1,27 @@
 """Evolve fortress configurations to maximize the complexity of entities' finite state machines."""
 import argparse
 import copy
-import curses
 import os
 import random
 import math
-import pickle
 import shutil
 from timeit import default_timer as timer
 from typing import List
 import hydra
-import yaml
 
 from config import EvoConfig
-import matplotlib.pyplot as plt
 import numpy as np
-from ray.util.multiprocessing import Pool
-from tensorboardX import SummaryWriter
-from tqdm import tqdm
 from entropy_utils import gen_entropy_dict
 
+from archive_file import ARCHIVE_EXT, load_archive, save_archive
+from eval_workers import evaluate_inds, iter_results, make_pool, make_task, submit_task
 from evo_utils import EvoIndividual
 from utils import get_bin_idx
+from simconfig import loadConfig
 
 # NOTE: Need to turn off `DEBUG` in `main.py` lest curses interfere with printouts.
+# NOTE: Plotting, Ray, TensorBoard and tqdm are imported where they are used, so the workers that only simulate
+#   don't load them (`python benchmark.py -i` checks the simulation modules stay light).
 
 # Create argparser with boolean flag for rendering
 # parser = argparse.ArgumentParser()
@@ -65,8 +63,10 @@ def eval_cheese(config: EvoConfig, archive, bc_bounds, exp_dir,
     # of ETA). E.g. more entities generally more expensive to compute sim steps.
     np.random.shuffle(valid_xys)
 
+    # the progress bar and the pool are only loaded for the evaluation (see the note on imports at the top)
+    from tqdm import tqdm
     if config.n_proc != 1:
-        pool = Pool(processes=config.n_proc)
+        pool = make_pool(config.n_proc, config.config_file, config.evaluator)
 
     if config.n_proc == 1:
         # Use tqdm to show a progress bar
@@ -82,10 +82,10 @@ def eval_cheese(config: EvoConfig, archive, bc_bounds, exp_dir,
     
     else:
         valid_inds = [archive[tuple(xy)] for xy in valid_xys]
-        rets = list(tqdm(pool.imap(lambda ind: ind.simulate_fortress(
-            show_prints=False, map_elites=True, n_new_sims=config.n_sims,
-            n_steps_per_episode=config.n_steps_per_episode, verbose=False,
-        ), valid_inds), desc="Evaluating elites"))
+        # the workers get the genomes of the elites (see eval_workers.py)
+        tasks = [make_task(ind, n_new_sims=config.n_sims, n_steps_per_episode=config.n_steps_per_episode,
+                           map_elites=True) for ind in valid_inds]
+        rets = list(tqdm(iter_results(pool, tasks), total=len(tasks), desc="Evaluating elites"))
         [ind.update(ret, map_elites=True) for ind, ret in zip(valid_inds, rets)]
             
     for xy in valid_xys:
@@ -100,9 +100,8 @@ def eval_cheese(config: EvoConfig, archive, bc_bounds, exp_dir,
             print((f"Added mutant formerly at {xy} to the archive at {xy_new},"
                    f" with score {score_i}"))
 
-    # Save the archive as a pickle
-    with open(os.path.join(exp_dir, f"{cheese_name}_archive.pkl"), 'wb') as f:
-        pickle.dump(swiss_archive, f)
+    # Save the archive
+    save_archive(swiss_archive, os.path.join(exp_dir, f"{cheese_name}_archive{ARCHIVE_EXT}"))
 
     heatmap_filename = os.path.join(exp_dir, f"{cheese_name}_heatmap.png")
     plot_archive_heatmap(config, swiss_fits, bc_bounds=bc_bounds,
@@ -110,6 +109,7 @@ def eval_cheese(config: EvoConfig, archive, bc_bounds, exp_dir,
 
 
 def plot_archive_heatmap(config: EvoConfig, fits, bc_bounds, heatmap_filename):
+    import matplotlib.pyplot as plt
 
     if config.fitness_type == "M":
         y_label, x_label = "n. entities", "n. @-type entities"
@@ -177,7 +177,7 @@ def get_exp_dir(config: EvoConfig):
 def get_archive_files(exp_dir: str):
     """Find any existing archive files."""
     archive_files = ([f for f in os.listdir(exp_dir) 
-                      if f.startswith("archive_gen-")] 
+                      if f.startswith("archive_gen-") and not f.endswith(".tmp")] 
                         if os.path.exists(exp_dir) else [])
     return archive_files
 
@@ -187,17 +187,130 @@ def load_latest_archive(exp_dir: str, archive_files: List[str]):
     archive_files = sorted(archive_files,
                            key=lambda f: int(f.split("-")[1].split(".")[0]))
     latest_archive_file = archive_files[-1]
-    # Load it
+    # Load it (an archive file, or a pickle of an older run)
     try:
-        with open(os.path.join(exp_dir, latest_archive_file), 'rb') as f:
-            archive = pickle.load(f)
+        archive = load_archive(os.path.join(exp_dir, latest_archive_file))
     except EOFError:
         latest_archive_file = archive_files[-2]
-        with open(os.path.join(exp_dir, latest_archive_file), 'rb') as f:
-            archive = pickle.load(f)
+        archive = load_archive(os.path.join(exp_dir, latest_archive_file))
     return archive
 
 
+def add_to_archive(config: EvoConfig, archive, fits, bc_bounds, ind: EvoIndividual, label):
+    """Put an evaluated individual in the cell of its BCs if it beats the incumbent. Returns whether it did."""
+    xy = get_xy_from_bcs(ind.bc_sim_vals, bc_bounds, config.x_bins, config.y_bins)
+    incumbent = archive[xy]
+    if incumbent is None or ind.score > incumbent.score:
+        archive[xy] = ind
+        fits[xy] = ind.score
+        print(f"Added mutant {label} to the archive at {xy}, with score {ind.score}")
+        return True
+    return False
+
+
+def report_generation(config: EvoConfig, generation: int, archive, fits, bc_bounds, exp_dir: str, tb_writer,
+                      best_score: float, gen_start_time: float, evo_start_time: float,
+                      total_timesteps_since_reload: int):
+    """Print the stats of a generation, log them to TensorBoard, and plot and save the archive when it is due."""
+    archive_size = len(np.argwhere(archive != None))
+    qd_score = np.nansum(fits)
+    # print the stats of the generation
+    print(f"[ GENERATION {generation} ]")
+    print(f'> Best fortress score: {best_score}')
+    # print(f"> Total entities: {len(best_ind.engine.fortress.entities)}")
+    print(f'> Archive size: {archive_size}')
+    print(f"> QD score: {qd_score}")
+    print(f"> Time elapsed: {timer() - gen_start_time:.2f} seconds")
+    print(f"> Running FPS: {total_timesteps_since_reload / (timer() - evo_start_time):.2f}")
+    print("")
+
+    tb_writer.add_scalar("qd_score", qd_score, generation)
+    tb_writer.add_scalar("archive_size", archive_size, generation)
+    tb_writer.add_scalar("best_score", best_score, generation)
+
+    if generation % config.plot_frequency == 0:
+        heatmap_filename = os.path.join(exp_dir, f"heatmap_gen-{generation}.png")
+        plot_archive_heatmap(config, fits, bc_bounds, heatmap_filename)
+
+    if generation % config.checkpoint_frequency == 0:
+        # Save the archive (the genomes and stats of the elites, see archive_file.py)
+        save_archive(archive, os.path.join(exp_dir, f"archive_gen-{generation}{ARCHIVE_EXT}"))
+        for ext in (ARCHIVE_EXT, ".pkl"):
+            old_archive_file = os.path.join(exp_dir, f"archive_gen-{generation - config.checkpoint_frequency * 2}{ext}")
+            if os.path.exists(old_archive_file):
+                os.remove(old_archive_file)
+
+
+def run_steady_state(config: EvoConfig, archive, fits, bc_bounds, exp_dir: str, tb_writer, pool,
+                     init_inds: List[EvoIndividual], generation: int, best_ind, best_score: float):
+    """Steady-state MAP-Elites: keep the workers busy with mutants, and add each one to the archive as soon as it
+    has been evaluated (instead of waiting for a whole generation, so a slow fortress only holds up its own worker).
+
+    About two mutants per worker are in flight at any time; a new one is made (from a parent of the archive as it is
+    then, or at random) whenever one comes back. The initial individuals go first. Every `pop_size` evaluations count
+    as a generation for the reports, plots and checkpoints, and the run stops after `generations` of them. The order
+    the results come back in depends on the timing of the workers, so runs aren't reproducible. Without a pool
+    (n_proc == 1), the mutants are evaluated here one at a time.
+
+    Returns the generation reached, and the best individual and its score."""
+    from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+    init_inds = list(init_inds)
+
+    def new_mutant():
+        if len(init_inds) > 0:
+            return init_inds.pop(0)
+        nonempty_cells = np.argwhere(archive != None)
+        if len(nonempty_cells) == 0 or random.random() < config.percent_random:
+            return EvoIndividual(config.config_file, fitness_type=config.fitness_type, bcs=config.bcs,
+                                 render=config.render, log_level=config.log_level)
+        xy = random.choice(nonempty_cells)
+        mutant = archive[xy[0], xy[1]].clone()
+        mutant.mutate_ind(config)
+        return mutant
+
+    n_evals_total = (config.generations - generation) * config.pop_size
+    max_in_flight = 1 if pool is None else 2 * config.n_proc
+    in_flight = {}      # future of the result -> mutant
+    n_started = 0
+    n_evals = 0
+    evo_start_time = gen_start_time = timer()
+    while n_evals < n_evals_total:
+        while n_started < n_evals_total and len(in_flight) < max_in_flight:
+            mutant = new_mutant()
+            if pool is None:
+                mutant.simulate_fortress(
+                    show_prints=False, map_elites=True, n_new_sims=config.n_sims,
+                    n_steps_per_episode=config.n_steps_per_episode,
+                )
+                future = Future()
+                future.set_result(None)
+            else:
+                future = submit_task(pool, make_task(mutant, n_new_sims=config.n_sims,
+                                                     n_steps_per_episode=config.n_steps_per_episode, map_elites=True))
+            in_flight[future] = mutant
+            n_started += 1
+
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            mutant = in_flight.pop(future)
+            if pool is not None:
+                mutant.update(future.result(), map_elites=True)
+            n_evals += 1
+            if add_to_archive(config, archive, fits, bc_bounds, mutant, n_evals) and mutant.score > best_score:
+                best_score = mutant.score
+                best_ind = mutant
+
+            if n_evals % config.pop_size == 0:
+                report_generation(config, generation, archive, fits, bc_bounds, exp_dir, tb_writer, best_score,
+                                  gen_start_time, evo_start_time,
+                                  n_evals * config.n_sims * config.n_steps_per_episode)
+                generation += 1
+                gen_start_time = timer()
+
+    return generation, best_ind, best_score
+
+
 @hydra.main(version_base="1.3", config_path="conf", config_name="evolve")
 def illuminate(config: EvoConfig):
     config_file: str = config.config_file
@@ -218,8 +331,7 @@ def illuminate(config: EvoConfig):
             n_entropy_bins = config.y_bins
         # Load config yaml
         config_file = os.path.join(config.config_file)
-        config_file_dict = yaml.safe_load(open(config_file, 'r'))
-        n_ent_types = len(config_file_dict['character'])
+        n_ent_types = len(loadConfig(config_file).chars)
 
 
         entropy_dict = gen_entropy_dict(
@@ -234,11 +346,13 @@ def illuminate(config: EvoConfig):
     mutants: List[EvoIndividual]
     mutants = [EvoIndividual(config_file, fitness_type=config.fitness_type, 
                              bcs=config.bcs, render=config.render,
-                             init_strat=init_strat, entropy_dict=entropy_dict)
+                             init_strat=init_strat, entropy_dict=entropy_dict,
+                             log_level=config.log_level)
                              for _ in range(config.pop_size)]
     bc_bounds = mutants[0].get_bc_bounds()
     exp_dir = get_exp_dir(config)
 
+    from tensorboardX import SummaryWriter
     tb_writer = SummaryWriter(log_dir=exp_dir)
 
     archive_files = get_archive_files(exp_dir)
@@ -297,11 +411,18 @@ def illuminate(config: EvoConfig):
     # entity_num_history = []
 
     if config.n_proc != 1:
-        pool = Pool(processes=config.n_proc)
+        # persistent workers, each with a warm engine the genomes of the mutants are loaded into (see eval_workers.py)
+        pool = make_pool(config.n_proc, config_file, config.evaluator)
 
     evo_start_time = timer()
     total_timesteps_since_reload = 0
 
+    if config.steady_state:
+        # the mutants are evaluated and added to the archive one by one (and the generational loop is skipped)
+        generation, best_ind, best_score = run_steady_state(
+            config, archive, fits, bc_bounds, exp_dir, tb_writer, pool if config.n_proc != 1 else None,
+            mutants if generation == 0 else [], generation, best_ind, best_score)
+
     # while best_score < ind.max_score:
     while generation < config.generations:
         gen_start_time = timer()
@@ -314,7 +435,7 @@ def illuminate(config: EvoConfig):
             parent_xys = random.choices(nonempty_cells, k=n_parents)
             mutants = [archive[xy[0], xy[1]].clone() for xy in parent_xys]
             [m.mutate_ind(config) for m in mutants]
-            rand_inds = [EvoIndividual(config_file, fitness_type=config.fitness_type, bcs=config.bcs, render=config.render) \
+            rand_inds = [EvoIndividual(config_file, fitness_type=config.fitness_type, bcs=config.bcs, render=config.render, log_level=config.log_level) \
                             for _ in range(n_rand_inds)]
             mutants += rand_inds
             show_prints = generation % 25 == 0
@@ -326,59 +447,19 @@ def illuminate(config: EvoConfig):
             ) for ind in mutants]
         else:
             # User ray to parallelize the simulation
-            # Notice how the individuals in `mutants` aren't updated by this function. Why?
-            rets = pool.map(lambda ind: ind.simulate_fortress(
-                show_prints=False, map_elites=True, n_new_sims=config.n_sims,
-                n_steps_per_episode=config.n_steps_per_episode,
-            ), mutants)
-            [ind.update(ret, map_elites=True) for ind, ret in zip(mutants, rets)]
-
-        mutant_xys = [
-            get_xy_from_bcs(
-                ind.bc_sim_vals, bc_bounds, config.x_bins, config.y_bins
-            ) 
-                for ind in mutants]
-
+            # The workers only get the genomes and stats of the mutants, and send back the new stats (the mutants'
+            #   engines stay here, and are only built if a mutant is simulated here later)
+            evaluate_inds(pool, mutants, n_new_sims=config.n_sims,
+                          n_steps_per_episode=config.n_steps_per_episode, map_elites=True)
 
         for i, ind_i in enumerate(mutants):
-            score_i = ind_i.score
-            xy_i = mutant_xys[i]
-            incumbent = archive[xy_i]
-            if incumbent is None or score_i > incumbent.score:
-                archive[xy_i] = ind_i
-                fits[xy_i] = score_i
-                print(f"Added mutant {i} to the archive at {xy_i}, with score {score_i}")
-                if score_i > best_score:
-                    best_score = score_i
-                    best_ind = ind_i
+            if add_to_archive(config, archive, fits, bc_bounds, ind_i, i) and ind_i.score > best_score:
+                best_score = ind_i.score
+                best_ind = ind_i
         
         total_timesteps_since_reload += config.pop_size * (config.n_sims * config.n_steps_per_episode)
-        archive_size = len(np.argwhere(archive != None))
-        qd_score = np.nansum(fits)
-        # print the stats of the generation
-        print(f"[ GENERATION {generation} ]")
-        print(f'> Best fortress score: {best_score}')
-        # print(f"> Total entities: {len(best_ind.engine.fortress.entities)}")
-        print(f'> Archive size: {archive_size}')
-        print(f"> QD score: {qd_score}")
-        print(f"> Time elapsed: {timer() - gen_start_time:.2f} seconds")
-        print(f"> Running FPS: {total_timesteps_since_reload / (timer() - evo_start_time):.2f}")
-        print("")
-
-        tb_writer.add_scalar("qd_score", qd_score, generation)
-        tb_writer.add_scalar("archive_size", archive_size, generation)
-        tb_writer.add_scalar("best_score", best_score, generation)
-
-        if generation % config.plot_frequency == 0:
-            heatmap_filename = os.path.join(exp_dir, f"heatmap_gen-{generation}.png")
-            plot_archive_heatmap(config, fits, bc_bounds, heatmap_filename)
-
-        if generation % config.checkpoint_frequency == 0:
-            # Save the archive as a pickle
-            with open(os.path.join(exp_dir, f"archive_gen-{generation}.pkl"), 'wb') as f:
-                pickle.dump(archive, f)
-            if os.path.exists(os.path.join(exp_dir, f"archive_gen-{generation - config.checkpoint_frequency * 2}.pkl")):
-                os.remove(os.path.join(exp_dir, f"archive_gen-{generation - config.checkpoint_frequency * 2}.pkl"))
+        report_generation(config, generation, archive, fits, bc_bounds, exp_dir, tb_writer, best_score,
+                          gen_start_time, evo_start_time, total_timesteps_since_reload)
 
         generation+=1
 
@@ -431,6 +512,7 @@ def illuminate(config: EvoConfig):
         best_ind.expEvoInd(f"EVO_IND/MAP-Elites_{best_ind.fitness_type}_f-{best_score:.2f}_[{best_ind.engine.seed}].pkl")
 
         # export the histories to a matplotlib graph
+        import matplotlib.pyplot as plt
         plt.figure(figsize=(15,10))
         # plt.plot(best_score_history, label="Best Score", color="red")
         # plt.plot(entity_num_history, label="Entity Count", color="green")
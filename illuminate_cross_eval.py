@@ -1,15 +1,23 @@
 import json
 import os
-import pickle
 
 import hydra
 import numpy as np
 
+from archive_file import ARCHIVE_EXT, load_archive, save_archive
 from config import EvoConfig
 from evo_utils import EvoIndividual, bc_funcs
 from illuminate import get_archive_files, get_exp_dir, load_latest_archive, plot_archive_heatmap
 
 
+def find_archive(exp_dir: str, name: str):
+    """The archive file of an experiment, or its pickle if the experiment was run before archive files."""
+    archive_file = os.path.join(exp_dir, f"{name}{ARCHIVE_EXT}")
+    if not os.path.exists(archive_file):
+        archive_file = os.path.join(exp_dir, f"{name}.pkl")
+    return archive_file
+
+
 def ill_cross_eval(cfg: EvoConfig, sweep_configs, sweep_params):
     # Create a directory for the results of the cross-evaluation.
     eval_dir = (f"cross_evals/{cfg.sweep_name}_ss-{cfg.n_steps_per_episode}")
@@ -22,27 +30,18 @@ def ill_cross_eval(cfg: EvoConfig, sweep_configs, sweep_params):
     # assert ("bcs" not in sweep_params) or (len(sweep_params["bcs"]) == 1)
     # assert ("x_bins" not in sweep_params) and ("y_bins" not in sweep_params)
     # Create an archive to contain the best individuals over all sweeps
-    sweep_archive_path = os.path.join(eval_dir, "sweep_archive.pkl") 
+    sweep_archive_path = os.path.join(eval_dir, f"sweep_archive{ARCHIVE_EXT}")
 
     if cfg.reuse_sweep_archive:
-        with open(sweep_archive_path, "rb") as f:
-            sweep_archive = pickle.load(f)
+        sweep_archive = load_archive(find_archive(eval_dir, "sweep_archive"))
     else:
         sweep_archive = np.full((cfg.x_bins, cfg.y_bins), None, dtype=object)
         for exp_cfg in sweep_configs:
             exp_dir = get_exp_dir(exp_cfg)
             if cfg.eval_swiss_cheese:
-                archive_file = os.path.join(
-                    exp_dir, "swiss_cheese_archive.pkl"
-                )
-                with open(archive_file, "rb") as f:
-                    exp_archive = pickle.load(f)
+                exp_archive = load_archive(find_archive(exp_dir, "swiss_cheese_archive"))
             elif cfg.eval_cheesestring:
-                archive_file = os.path.join(
-                    exp_dir, "cheesestring_archive.pkl"
-                )
-                with open(archive_file, "rb") as f:
-                    exp_archive = pickle.load(f)
+                exp_archive = load_archive(find_archive(exp_dir, "cheesestring_archive"))
             else:
                 archive_files = get_archive_files(exp_dir)
                 if len(archive_files) == 0:
@@ -70,8 +69,7 @@ def ill_cross_eval(cfg: EvoConfig, sweep_configs, sweep_params):
                         sweep_archive[x, y] = best_ind
 
         # Save the sweep archive and a heatmap
-        with open(sweep_archive_path, "wb") as f:
-            pickle.dump(sweep_archive, f)
+        save_archive(sweep_archive, sweep_archive_path)
 
     # Evaluate 
     if cfg.eval_sweep_archive:
@@ -109,9 +107,8 @@ def ill_cross_eval(cfg: EvoConfig, sweep_configs, sweep_params):
             reeval_sweep_archive[xy] = ind
 
         # Save the reevaluated sweep archive and a heatmap
-        reeval_sweep_archive_path = os.path.join(eval_dir, "reeval_sweep_archive.pkl")
-        with open(reeval_sweep_archive_path, "wb") as f:
-            pickle.dump(reeval_sweep_archive, f)
+        reeval_sweep_archive_path = os.path.join(eval_dir, f"reeval_sweep_archive{ARCHIVE_EXT}")
+        save_archive(reeval_sweep_archive, reeval_sweep_archive_path)
 
         reeval_sweep_fits = np.vectorize(
             lambda x: x.score if x is not None else np.nan)(reeval_sweep_archive)
@@ -1,12 +1,11 @@
 """Evolve fortress configurations to maximize the complexity of entities' finite state machines."""
 import os
-import pickle
 
 from config import EvoConfig
 import numpy as np
-from ray.util.multiprocessing import Pool
-from tqdm import tqdm
 
+from archive_file import ARCHIVE_EXT, save_archive
+from eval_workers import iter_results, make_pool, make_task
 from evo_utils import EvoIndividual, bc_funcs
 from utils import get_bin_idx, plot_archive_heatmap
 
@@ -156,8 +155,9 @@ def eval_cheese(config: EvoConfig, archive, bc_bounds, exp_dir,
     # of ETA). E.g. more entities generally more expensive to compute sim steps.
     np.random.shuffle(valid_xys)
 
+    from tqdm import tqdm
     if config.n_proc != 1:
-        pool = Pool(processes=config.n_proc)
+        pool = make_pool(config.n_proc, config.config_file, config.evaluator)
 
     if config.n_proc == 1:
         # Use tqdm to show a progress bar
@@ -174,11 +174,10 @@ def eval_cheese(config: EvoConfig, archive, bc_bounds, exp_dir,
     
     else:
         valid_inds = [archive[tuple(xy)] for xy in valid_xys]
-        rets = list(tqdm(pool.imap(lambda ind: ind.simulate_fortress(
-            show_prints=False, map_elites=True, n_new_sims=config.n_sims,
-            n_steps_per_episode=config.n_steps_per_episode, verbose=False,
-            eval_instance_entropy=True,
-        ), valid_inds), desc="Evaluating elites"))
+        # the workers get the genomes of the elites (see eval_workers.py)
+        tasks = [make_task(ind, n_new_sims=config.n_sims, n_steps_per_episode=config.n_steps_per_episode,
+                           map_elites=True, eval_instance_entropy=True) for ind in valid_inds]
+        rets = list(tqdm(iter_results(pool, tasks), total=len(tasks), desc="Evaluating elites"))
         [ind.update(ret, map_elites=True, eval_instance_entropy=True)
          for ind, ret in zip(valid_inds, rets)]
             
@@ -194,9 +193,8 @@ def eval_cheese(config: EvoConfig, archive, bc_bounds, exp_dir,
             print((f"Added mutant formerly at {xy} to the archive at {xy_new},"
                    f" with score {score_i}"))
 
-    # Save the archive as a pickle
-    with open(os.path.join(exp_dir, f"{cheese_name}_archive.pkl"), 'wb') as f:
-        pickle.dump(swiss_archive, f)
+    # Save the archive
+    save_archive(swiss_archive, os.path.join(exp_dir, f"{cheese_name}_archive{ARCHIVE_EXT}"))
 
     heatmap_filename = os.path.join(exp_dir, f"{cheese_name}_heatmap.png")
     plot_archive_heatmap(config, swiss_fits, bc_bounds=bc_bounds,
@@ -0,0 +1,142 @@
+"""A local pool of evaluation workers on `concurrent.futures`, for runs without Ray (`evaluator=local` in EvoConfig).
+
+The workers are the persistent workers of eval_workers.py (one warm engine per config file). The tasks of a batch
+(see `eval_workers.make_task`) are encoded as JSON into one shared memory block. Its layout is the int64 offsets of
+the n tasks (n + 1 of them), then the encoded tasks. The workers get only the names of the blocks and a range of
+rows. They read their tasks from the block and write their results into a shared float64 array, one row of
+`RESULT_COLS` per task. So no Python object is pickled either way, and the results are read back as one array.
+Single tasks started with `LocalPool.submit` (e.g. by the steady-state loop of illuminate.py) go as their encoded
+JSON, and come back as their row.
+"""
+import json
+import math
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from typing import List
+
+import numpy as np
+
+from eval_workers import evaluate_genome, init_worker
+
+RESULT_COLS = ('score', 'bc_0', 'bc_1', 'n_sims', 'instance_entropy')
+
+
+def _flags(task):
+    """map_elites and eval_instance_entropy of a task."""
+    return task[-2], task[-1]
+
+
+def _ret_to_row(ret, map_elites: bool, eval_instance_entropy: bool) -> list:
+    """The row of RESULT_COLS of what `simulate_fortress` returned (NaN for what it doesn't return)."""
+    ret, n_sims = ret
+    ie = ret[-1] if eval_instance_entropy else math.nan
+    if map_elites:
+        score, bcs = ret[0], ret[1]
+    else:
+        score, bcs = (ret[0] if eval_instance_entropy else ret), (math.nan, math.nan)
+    return [score, bcs[0], bcs[1], n_sims, ie]
+
+
+def _row_to_ret(row, map_elites: bool, eval_instance_entropy: bool):
+    """What `simulate_fortress` returned, from its row (the inverse of `_ret_to_row`)."""
+    score, bc_0, bc_1, n_sims, ie = row.tolist()
+    ret = (score, (bc_0, bc_1)) if map_elites else score
+    if eval_instance_entropy:
+        ret = (*ret, ie) if map_elites else (ret, ie)
+    return ret, int(n_sims)
+
+
+def _run_rows(tasks_name: str, results_name: str, n_tasks: int, i0: int, i1: int):
+    """Evaluate rows i0 to i1 of a batch (runs on a worker)."""
+    tasks_shm = shared_memory.SharedMemory(name=tasks_name)
+    results_shm = shared_memory.SharedMemory(name=results_name)
+    try:
+        offsets = np.ndarray((n_tasks + 1,), dtype=np.int64, buffer=tasks_shm.buf)
+        results = np.ndarray((n_tasks, len(RESULT_COLS)), dtype=np.float64, buffer=results_shm.buf)
+        for i in range(i0, i1):
+            task = json.loads(bytes(tasks_shm.buf[offsets[i]:offsets[i + 1]]).decode('utf-8'))
+            results[i] = _ret_to_row(evaluate_genome(task), *_flags(task))
+        del offsets, results    # release the views of the buffers before closing them
+    finally:
+        tasks_shm.close()
+        results_shm.close()
+
+
+def _run_task(encoded: bytes) -> list:
+    """Evaluate a single encoded task (runs on a worker)."""
+    task = json.loads(encoded.decode('utf-8'))
+    return _ret_to_row(evaluate_genome(task), *_flags(task))
+
+
+class LocalPool():
+    """A pool of `n_proc` local worker processes, set up like the Ray pool of eval_workers.py.
+
+    `evaluate_iter(tasks)` yields the results of the tasks of a batch in order, in the format `simulate_fortress`
+    returns them (and `EvoIndividual.update` takes), and `submit(task)` starts a single task.
+    """
+
+    def __init__(self, n_proc: int, config_file: str = None, start_method: str = None, chunks_per_proc: int = 4):
+        self.n_proc = n_proc
+        self.chunks_per_proc = chunks_per_proc     # rows of a batch are split in about this many jobs per worker
+        self.executor = ProcessPoolExecutor(max_workers=n_proc, mp_context=multiprocessing.get_context(start_method),
+                                            initializer=init_worker, initargs=(config_file,))
+
+    def evaluate(self, tasks: List[tuple]) -> list:
+        return list(self.evaluate_iter(tasks))
+
+    def evaluate_iter(self, tasks: List[tuple]):
+        n = len(tasks)
+        if n == 0:
+            return
+        encoded = [json.dumps(task).encode('utf-8') for task in tasks]
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        offsets[0] = (n + 1) * 8
+        offsets[1:] = offsets[0] + np.cumsum([len(e) for e in encoded])
+        tasks_shm = shared_memory.SharedMemory(create=True, size=int(offsets[-1]))
+        results_shm = shared_memory.SharedMemory(create=True, size=n * len(RESULT_COLS) * 8)
+        futures = []
+        results = None
+        try:
+            tasks_shm.buf[:offsets[0]] = offsets.tobytes()
+            tasks_shm.buf[offsets[0]:offsets[-1]] = b''.join(encoded)
+            results = np.ndarray((n, len(RESULT_COLS)), dtype=np.float64, buffer=results_shm.buf)
+            results[:] = math.nan
+
+            # contiguous ranges of rows, small enough to balance the workers and large enough to keep the number of
+            #   jobs (the only messages between the processes) low
+            chunk = max(1, math.ceil(n / (self.n_proc * self.chunks_per_proc)))
+            futures = [(i, min(i + chunk, n), self.executor.submit(_run_rows, tasks_shm.name, results_shm.name, n, i,
+                                                                   min(i + chunk, n)))
+                       for i in range(0, n, chunk)]
+            for i0, i1, future in futures:
+                future.result()
+                for i in range(i0, i1):
+                    yield _row_to_ret(results[i], *_flags(tasks[i]))
+        finally:
+            # if the results weren't all read, the jobs left are dropped (or waited for) before the blocks go away
+            for _, _, future in futures:
+                future.cancel()
+            wait([future for _, _, future in futures])
+            results = None      # release the view of the buffer before closing it
+            tasks_shm.close()
+            tasks_shm.unlink()
+            results_shm.close()
+            results_shm.unlink()
+
+    def submit(self, task: tuple) -> Future:
+        """Start a single task without waiting for it. Returns a future of its result."""
+        future = Future()
+        flags = _flags(task)
+
+        def done(job):
+            if job.exception() is not None:
+                future.set_exception(job.exception())
+            else:
+                future.set_result(_row_to_ret(np.array(job.result()), *flags))
+
+        self.executor.submit(_run_task, json.dumps(task).encode('utf-8')).add_done_callback(done)
+        return future
+
+    def close(self):
+        self.executor.shutdown()
@@ -8,7 +8,7 @@ import argparse
 
 from engine import Engine
 from fortress import Fortress
-from entities import Entity
+from entities import Entity, Species
 
 DEBUG = False   # shows in curses if FALSE
 SEED = None     # set the seed (external from config)
@@ -16,6 +16,9 @@ ENGINE = None   # the engine
 TEST = ""       # test a specific setup
 FORTRESS_FILE = ""   # fortress file to import (if it is passed)
 RENDER_SPEED = None
+CHECKPOINT_FILE = ""     # file the simulation state is saved to every CHECKPOINT_EVERY ticks (if passed)
+CHECKPOINT_EVERY = 100
+RESUME_FILE = ""         # checkpoint to resume the simulation from (if passed)
 
 
 # main functionå
@@ -31,9 +34,15 @@ def main(config_file):
     if not DEBUG:
         screen_set, screen_dims = render.init_screens()
 
+    ######  RESUME A RUN  ######
+
+    if RESUME_FILE != "":
+        ENGINE.loadCheckpoint(RESUME_FILE)
+        ENGINE.fortress.addLog(f">>> Resumed from [{RESUME_FILE}] at tick {ENGINE.sim_tick} <<<")
+
     ######  IMPORT A FORT  ######
 
-    if FORTRESS_FILE != "":
+    elif FORTRESS_FILE != "":
         ENGINE.fortress.importEntityFortDef(FORTRESS_FILE)
 
 
@@ -140,7 +149,7 @@ def main(config_file):
         ENGINE.fortress.addEntity(b4)
 
         # add to the list to spawn later
-        ENGINE.fortress.CHARACTER_DICT['$'] = Entity(ENGINE.fortress, char='$', nodes=["idle"], edges={'0-0':'none'})
+        ENGINE.fortress.CHARACTER_DICT['$'] = Species(ENGINE.fortress, char='$', nodes=["idle"], edges={'0-0':'none'})
 
         ENGINE.fortress.addLog(">>> Running [BLUPEE] test <<<")
 
@@ -155,7 +164,7 @@ def main(config_file):
         ENGINE.fortress.addEntity(k)
 
         # add to the list to spawn later
-        ENGINE.fortress.CHARACTER_DICT['$'] = Entity(ENGINE.fortress, char='$', nodes=["idle"], edges={'0-0':'none'})
+        ENGINE.fortress.CHARACTER_DICT['$'] = Species(ENGINE.fortress, char='$', nodes=["idle"], edges={'0-0':'none'})
 
         ENGINE.fortress.addLog(">>> Running [KOROK] test <<<")
 
@@ -180,6 +189,8 @@ def main(config_file):
         loops = 0
         while not (ENGINE.fortress.terminate() or ENGINE.fortress.inactive() or ENGINE.fortress.overpop()) :
             ENGINE.update()
+            if CHECKPOINT_FILE != "" and ENGINE.sim_tick % CHECKPOINT_EVERY == 0:
+                ENGINE.saveCheckpoint(CHECKPOINT_FILE)
             render.curses_render_loop(screen_set, screen_dims, ENGINE, ENGINE.config['min_view'])
             time.sleep(RENDER_SPEED if not RENDER_SPEED is None else ENGINE.config['sim_speed'])
 
@@ -210,6 +221,9 @@ if __name__ == "__main__":
     parser.add_argument("-e", "--render_speed", dest='render_speed', type=float, default=None, help="Render speed of the simulation (seconds per frame)")
     parser.add_argument("-d", "--debug", dest='debug', action="store_true", help="Debug mode on?")
     parser.add_argument("-c", "--config", dest='config', type=str, default="CONFIGS/gamma_config.yaml", help="Configuration file to use for the simulation")
+    parser.add_argument("-k", "--checkpoint", dest='checkpoint', type=str, default="", help="File to save the simulation state to (to resume the run from later)")
+    parser.add_argument("-K", "--checkpoint_every", dest='checkpoint_every', type=int, default=100, help="Number of ticks between checkpoints")
+    parser.add_argument("-r", "--resume", dest='resume', type=str, default="", help="Checkpoint file to resume the simulation from")
     arg_men = parser.parse_args()
 
     conf_file = arg_men.config
@@ -218,6 +232,9 @@ if __name__ == "__main__":
     DEBUG = arg_men.debug
     SEED = arg_men.seed
     RENDER_SPEED = arg_men.render_speed
+    CHECKPOINT_FILE = arg_men.checkpoint
+    CHECKPOINT_EVERY = arg_men.checkpoint_every
+    RESUME_FILE = arg_men.resume
 
 
     # Initialize the screen
@@ -1,5 +1,6 @@
 # simulates a fortress from a definition file
 # Usage: python offline_sim.py [fortress_def_filename] (exportFile?) (alternate_export_label)
+#   a long run can save checkpoints (-k) and be resumed from one (-r, the fortress file and seed are then ignored)
 
 import sys
 import random
@@ -12,7 +13,7 @@ from entities import Entity
 
 
 # shows the fortress initialization and steps in between
-def showFortress(filename, seed, n_sim_steps=100, show_step=20, toFile=False,label=None):
+def showFortress(filename, seed, n_sim_steps=100, show_step=20, toFile=False,label=None,checkpoint=None,checkpoint_every=100,resume=None):
     # ----- SETUP ----- #
 
     # make the engine
@@ -21,8 +22,11 @@ def showFortress(filename, seed, n_sim_steps=100, show_step=20, toFile=False,lab
     np.random.seed(seed)
     random.seed(seed)
 
-    # import the fortress and populate randomly
-    ENGINE.fortress.importEntityFortDef(filename)
+    # import the fortress and populate randomly (or continue a run from a checkpoint)
+    if resume:
+        ENGINE.loadCheckpoint(resume)
+    else:
+        ENGINE.fortress.importEntityFortDef(filename)
     # print(ENGINE.fortress.CHARACTER_DICT)
     # ENGINE.populateFortress(make_char=False)
 
@@ -31,16 +35,18 @@ def showFortress(filename, seed, n_sim_steps=100, show_step=20, toFile=False,lab
     fort_str = f"{filename} - SEED: {seed} - SIM_NUM : {n_sim_steps}\n\n"
 
     # print the initial state
-    fort_str += "> GENERATION: 0\n"
+    loops = ENGINE.sim_tick
+    fort_str += f"> GENERATION: {loops}\n" if resume else "> GENERATION: 0\n"
     fort_str += ENGINE.fortress.renderEntities()
     fort_str += "\n\n"
 
     # simulate 
-    loops = 0
     while not (ENGINE.fortress.terminate() or ENGINE.fortress.inactive() or \
                 ENGINE.fortress.overpop() or loops >= n_sim_steps):
         loops+=1
         ENGINE.update(True)
+        if checkpoint and loops % checkpoint_every == 0:
+            ENGINE.saveCheckpoint(checkpoint)
         if(loops % show_step == 0):
             fort_str += f"> GENERATION {loops}\n"
             fort_str += ENGINE.fortress.renderEntities()
@@ -96,7 +102,11 @@ if __name__ == "__main__":
     parser.add_argument("-p", "--show_step", type=int, default=20, help='Number of steps between prints')
     parser.add_argument("-e", "--export", action="store_true", help="Export to file")
     parser.add_argument("-l", "--label", type=str, default=None, help="Alternate label for export file")
+    parser.add_argument("-k", "--checkpoint", type=str, default=None, help="File to save the simulation state to (to resume the run from later)")
+    parser.add_argument("-K", "--checkpoint_every", type=int, default=100, help="Number of steps between checkpoints")
+    parser.add_argument("-r", "--resume", type=str, default=None, help="Checkpoint file to resume the simulation from")
 
     a = parser.parse_args()
-    showFortress(a.fortress,a.seed,a.n_sim_steps,a.show_step,toFile=a.export,label=a.label)
+    showFortress(a.fortress,a.seed,a.n_sim_steps,a.show_step,toFile=a.export,label=a.label,
+                 checkpoint=a.checkpoint,checkpoint_every=a.checkpoint_every,resume=a.resume)
     
\ No newline at end of file
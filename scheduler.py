@@ -0,0 +1,257 @@
+import heapq
+
+from entities import NODE_OPS, EDGE_OPS
+
+
+# event-scheduled updates for the entity objects
+#   an entity sitting in an idle node can only leave it through its edges, so instead of polling it every tick it is
+#   parked until the first tick one of its step edges can fire (kept in a timer wheel of tick -> entities) or until
+#   an entity of a character one of its touch / nextTo / within edges looks for arrives in range (or it is moved itself)
+#   a woken entity is updated like any other one, so the results are the same as updating every entity every tick
+#   (cur_step and moved_edge of a parked entity are brought up to date when it wakes)
+class Scheduler():
+    def __init__(self, fortress):
+        self.fortress = fortress
+        self.plans = {}     # (compiled FSM, node) -> how an entity in the node is parked (None if it can't be)
+        self.reset()
+
+    # forget every entity (the fortress entities were cleared)
+    def reset(self):
+        self.active = {}        # entity -> None for the entities updated every tick
+        self.parked = {}        # entity -> (tick parked, cur_step when parked, wake tick, watched chars, visit key, has edges, cell)
+        self.wheel = {}         # tick -> entities to wake at the start of the tick (stale entries are skipped)
+        self.watchers = {}      # char -> {range: {(x,y): {entity: None}}} of the parked entities looking for that char
+        self.visits = {}        # (char, node, edge) -> number of parked entities that add the visit every tick
+        self.park_fsm = {}      # species -> compiled FSM when an entity of it was parked
+        self.to_clear = []      # entities parked in the last tick whose moved_edge clears in the next one
+        self.woken = []         # heap of (seq, entity) woken during the tick before their turn
+        self.in_tick = False
+        self.cur_seq = -1       # order of the entity being updated
+        self.seq_limit = 0      # entities added from here on are not updated this tick
+        for ent in self.fortress.entities.values():
+            self.active[ent] = None
+
+
+    #######     FORTRESS EVENTS     #######
+
+    # a new entity was added to the fortress
+    def entAdded(self, ent):
+        self.active[ent] = None
+        self._arrived(ent)
+
+    # an entity was moved to a new position
+    def entMoved(self, ent):
+        if ent in self.parked:
+            self.wake(ent)
+        self._arrived(ent)
+
+    # an entity was removed from the fortress
+    def entRemoved(self, ent):
+        if ent in self.parked:
+            self._unpark(ent)
+        self.active.pop(ent, None)
+
+    # wake the parked entities whose range an entity of a character is now in
+    #   (parked entities don't move, so they are bucketed by the cell they are on)
+    def _arrived(self, ent):
+        watchers = self.watchers.get(ent.char)
+        if not watchers:
+            return
+        x, y = ent.pos
+        woken = []
+        for rng, cells in watchers.items():
+            if (2*rng+1)**2 <= len(cells):
+                for cx in range(x-rng, x+rng+1):
+                    for cy in range(y-rng, y+rng+1):
+                        if (cx, cy) in cells:
+                            woken += cells[(cx, cy)]
+            else:
+                for (cx, cy), ents in cells.items():
+                    if abs(cx - x) <= rng and abs(cy - y) <= rng:
+                        woken += ents
+        for w in woken:
+            if w is not ent:
+                self.wake(w)
+
+
+    #######     PARKING     #######
+
+    # how an entity in a node is parked - (step edge intervals, (char, range) of the spatial edges, visit edge)
+    #   only idle nodes without a none edge (which always fires in the next tick) can be parked
+    def _plan(self, fsm, node):
+        key = (fsm, node)
+        if key in self.plans:
+            return self.plans[key]
+        plan = None
+        if node < fsm.n_nodes and fsm.node_ops[node] == NODE_OPS['idle']:
+            steps, watch = [], {}
+            for op, (_, args, _, _) in zip(fsm.edge_ops[node], fsm.out_edges[node]):
+                if op == EDGE_OPS['none'] or (op == EDGE_OPS['step'] and args[0] <= 0):
+                    break
+                elif op == EDGE_OPS['step']:
+                    steps.append(args[0])
+                else:
+                    rng = args[1] if op == EDGE_OPS['within'] else (1 if op == EDGE_OPS['nextTo'] else 0)
+                    watch[args[0]] = max(rng, watch.get(args[0], rng))
+            else:
+                plan = (steps, list(watch.items()), len(fsm.out_edges[node]) > 0)
+        self.plans[key] = plan
+        return plan
+
+    # park an entity after its update if nothing can make it leave its node in the next tick
+    def _afterUpdate(self, ent, tick):
+        fsm = ent.species.fsm
+        plan = self._plan(fsm, ent.cur_node)
+        if plan is None:
+            return
+        steps, watch, has_edges = plan
+
+        # a spatial edge that can already fire keeps it updating
+        for c, rng in watch:
+            if self._inRange(ent, c, rng):
+                return
+
+        # first tick a step edge fires (the step counter is cur_step + 1 in the next tick)
+        wake = None
+        if steps:
+            wake = tick + min((-ent.cur_step) % n or n for n in steps)
+            if wake == tick + 1:
+                return
+
+        visit = (ent.char, ent.cur_node, None if has_edges else ent.moved_edge)
+        cell = (int(ent.pos[0]), int(ent.pos[1]))
+        self.parked[ent] = (tick, ent.cur_step, wake, watch, visit, has_edges, cell)
+        del self.active[ent]
+        if wake is not None:
+            self.wheel.setdefault(wake, []).append(ent)
+        for c, rng in watch:
+            self.watchers.setdefault(c, {}).setdefault(rng, {}).setdefault(cell, {})[ent] = None
+        self.visits[visit] = self.visits.get(visit, 0) + 1
+        self.park_fsm[ent.species] = fsm
+        if has_edges:
+            self.to_clear.append(ent)
+
+    # if an entity of a character (other than the entity itself) is within a range of the entity
+    def _inRange(self, ent, c, rng):
+        f = self.fortress
+        x, y = ent.pos
+        ents = f.char_ents.get(c)
+        if not ents:
+            return False
+        if (2*rng+1)**2 < len(ents):
+            grid = f.char_grid[c]
+            for cx in range(x-rng, x+rng+1):
+                for cy in range(y-rng, y+rng+1):
+                    for e in grid.get((cx, cy), ()):
+                        if e is not ent:
+                            return True
+            return False
+        for e in ents.values():
+            if e is not ent and abs(e.pos[0] - x) <= rng and abs(e.pos[1] - y) <= rng:
+                return True
+        return False
+
+    # take an entity out of the parked structures (the timer wheel entry is skipped when its tick comes)
+    def _unpark(self, ent):
+        entry = self.parked.pop(ent)
+        cell = entry[6]
+        for c, rng in entry[3]:
+            cells = self.watchers[c][rng]
+            del cells[cell][ent]
+            if not cells[cell]:
+                del cells[cell]
+        self.visits[entry[4]] -= 1
+        if self.visits[entry[4]] == 0:
+            del self.visits[entry[4]]
+        return entry
+
+    # wake a parked entity so it is updated from its next turn on (this tick if its turn has not come yet)
+    def wake(self, ent):
+        if ent not in self.parked:
+            return
+        tick, step, _, _, _, has_edges, _ = self._unpark(ent)
+        now = self.fortress.steps
+        if self.in_tick and self.cur_seq < ent.seq < self.seq_limit:
+            heapq.heappush(self.woken, (ent.seq, ent))
+            next_tick = now
+        else:
+            self.active[ent] = None
+            next_tick = now + 1
+
+        # catch up on the ticks it was skipped in
+        skipped = next_tick - 1 - tick
+        ent.cur_step = step + skipped
+        if skipped > 0 and has_edges:
+            ent.moved_edge = None
+
+
+    #######     UPDATES AND LOOPS    #######
+
+    # update the entities due this tick (same order and result as updating every entity)
+    def update(self, tree_visits=False):
+        f = self.fortress
+        tick = f.steps
+        self.seq_limit = f.ent_seq
+        self.woken = []
+        self.in_tick = True
+
+        # an edited FSM may change how its parked entities leave their nodes
+        for species, fsm in self.park_fsm.items():
+            if species.fsm is not fsm:
+                for ent in list(self.parked):
+                    self.wake(ent)
+                self.park_fsm = {}
+                break
+
+        # the step edges that fire this tick
+        for ent in self.wheel.pop(tick, ()):
+            entry = self.parked.get(ent)
+            if entry is not None and entry[2] == tick:
+                self.wake(ent)
+
+        # the entities parked last tick would have cleared their last edge by now
+        for ent in self.to_clear:
+            entry = self.parked.get(ent)
+            if entry is not None and entry[0] == tick - 1:
+                ent.moved_edge = None
+        self.to_clear = []
+
+        # go through the active entities in order (plus the ones woken before their turn)
+        order = sorted((e for e in self.active if e.seq < self.seq_limit), key=lambda e: e.seq)
+        i = 0
+        while True:
+            if self.woken and (i >= len(order) or self.woken[0][0] < order[i].seq):
+                _, ent = heapq.heappop(self.woken)
+                self.active[ent] = None
+            elif i < len(order):
+                ent = order[i]
+                i += 1
+            else:
+                break
+            self.cur_seq = ent.seq
+
+            # if still alive
+            if f.entities.get(ent.id) is not ent:
+                continue
+            ent.update()
+            if tree_visits:
+                f.addTreeVisit(ent)
+            if f.entities.get(ent.id) is ent:
+                self._afterUpdate(ent, tick)
+        self.in_tick = False
+        self.cur_seq = -1
+
+        # the parked entities stay in their node (and keep adding it to the visits)
+        if tree_visits:
+            for (c, node, edge) in self.visits:
+                f.CHAR_VISIT_TREE[c]['nodes'].add(node)
+                if edge != None:
+                    f.CHAR_VISIT_TREE[c]['edges'].add(edge)
+
+    # bring the step counter of every parked entity up to date (e.g. before reading it outside of an update)
+    def flush(self):
+        now = self.fortress.steps
+        for ent, (tick, step, _, _, _, has_edges, _) in self.parked.items():
+            ent.cur_step = step + now - tick
+            if has_edges and now > tick:
+                ent.moved_edge = None
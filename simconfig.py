@@ -0,0 +1,123 @@
+import os
+
+from entities import NODE_DICT, EDGE_DICT, NODE_OPS, EDGE_OPS
+
+
+# parsed configs by file, shared by every engine of the process - path -> ((mtime, size), config)
+_CONFIG_CACHE = {}
+
+
+# the parsed config file of a simulation - read-only, and shared by the engines that load the same file
+#   reads like the dictionary yaml gives (config['key'], config.get, in, iterating) with the lists as tuples,
+#   and keeps the lookups the fortress and the species use over and over as attributes
+class SimConfig():
+    def __init__(self, values, filename=None):
+        self.__dict__['_values'] = {k: _freeze(v) for k, v in values.items()}
+        self.__dict__['filename'] = filename
+        self._check()
+
+        v = self._values
+        actions = v.get('action_space', tuple(NODE_DICT))
+        self.__dict__.update(
+            chars=v['character'],
+            char_index={c: i for i, c in enumerate(v['character'])},
+            action_space=actions,
+            action_ops={a: NODE_OPS[a] for a in actions},
+            edge_conditions=v['edge_conditions'],
+            edge_ops={e: EDGE_OPS[e] for e in v['edge_conditions']},
+            step_range=v['step_range'],
+            prox_range=v['prox_range'],
+            inactive_limit=v['inactive_limit'],
+            node_types=_nodeTypes(v['character']),
+        )
+
+    # check the values the simulation relies on
+    def _check(self):
+        v = self._values
+        for key in ('character', 'edge_conditions', 'step_range', 'prox_range', 'inactive_limit'):
+            assert key in v, f"Config {self.filename} is missing '{key}'"
+        assert len(set(v['character'])) == len(v['character']), f"Config {self.filename} has repeated characters"
+        for a in v.get('action_space', ()):
+            assert a in NODE_DICT, f"Unknown action '{a}' in config {self.filename}"
+        for e in v['edge_conditions']:
+            assert e in EDGE_DICT, f"Unknown edge condition '{e}' in config {self.filename}"
+        for key in ('step_range', 'prox_range'):
+            assert len(v[key]) == 2 and v[key][0] <= v[key][1], f"Bad {key} {v[key]} in config {self.filename}"
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SimConfig is read-only")
+
+    # the dictionary interface of the parsed yaml
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def keys(self):
+        return self._values.keys()
+
+    def items(self):
+        return self._values.items()
+
+    def values(self):
+        return self._values.values()
+
+    # a plain (editable) dictionary of the values, with the tuples back as lists
+    def asDict(self):
+        return {k: list(v) if isinstance(v, tuple) else v for k, v in self._values.items()}
+
+    # read-only, so copies (e.g. of an engine) can share it
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (SimConfig, (self.asDict(), self.filename))
+
+    def __repr__(self):
+        return f"SimConfig({self.filename!r}, {self._values!r})"
+
+
+# the config of a file, parsed once per version of the file (a file that is edited is parsed again)
+def loadConfig(filename):
+    path = os.path.abspath(filename)
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _CONFIG_CACHE.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    import yaml     # only needed the first time a file is parsed
+    with open(path, 'r') as file:
+        config = SimConfig(yaml.safe_load(file), filename)
+    _CONFIG_CACHE[path] = (stamp, config)
+    return config
+
+
+# every node a species can have - the actions without arguments, and the ones on a char once per char
+def _nodeTypes(chars):
+    node_types = []
+    for node in NODE_DICT:
+        if NODE_DICT[node]['args'] == []:
+            node_types.append(node)
+        elif NODE_DICT[node]['args'] == ['entityChar']:
+            node_types += [f"{node} {c}" for c in chars]
+    return tuple(node_types)
+
+
+# lists as tuples, so nothing can edit the shared values in place
+def _freeze(value):
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
@@ -0,0 +1,53 @@
+from entities import Entity
+
+
+# the entities a fortress starts its episodes with, taken once so resetting the fortress doesn't clone them again
+#   holds the entities cloning the initial entity list in order would place (an entity on a cell that is already
+#   taken is skipped, like Species.clone does) as columns of char index and cell, with the IDs a cleared fortress
+#   gives them and the rows of each char - restoring builds the entity objects and the fortress indexes straight
+#   from the columns, without the ID search, occupancy check and log line per entity
+class FortSnapshot():
+    def __init__(self, init_ents):
+        self.src = self._key(init_ents)     # the initial entity list the snapshot was taken from
+        self.chars = []         # char index -> character (in the order the chars first appear)
+        self.rows = []          # char index -> rows of the entities of the char
+        self.cid = []           # row -> char index
+        self.cells = []         # row -> (x,y)
+        char_idx = {}
+        taken = set()
+        for c, pos in self.src:
+            if pos is None or pos in taken:
+                continue
+            taken.add(pos)
+            if c not in char_idx:
+                char_idx[c] = len(self.chars)
+                self.chars.append(c)
+                self.rows.append([])
+            self.rows[char_idx[c]].append(len(self.cid))
+            self.cid.append(char_idx[c])
+            self.cells.append((int(pos[0]), int(pos[1])))
+        self.ids = ['%04x' % i for i in range(len(self.cid))]
+
+    # (char, position) of every entry of an initial entity list ({'char', 'pos'} dictionaries)
+    @staticmethod
+    def _key(init_ents):
+        return [(e['char'], None if e['pos'] is None else (e['pos'][0], e['pos'][1])) for e in init_ents]
+
+    # if the snapshot was taken from the same initial entities (they are edited in place by the mutations)
+    def matches(self, init_ents):
+        return len(init_ents) == len(self.src) and self._key(init_ents) == self.src
+
+    # put the entities of the snapshot in the fortress in place of its current ones (with the species the fortress
+    #   has for their characters now)
+    def restore(self, fortress):
+        species = [fortress.CHARACTER_DICT[c] for c in self.chars]
+        ents = [Entity(fortress, species=species[s], ent_id=i) for i, s in zip(self.ids, self.cid)]
+        for seq, (ent, cell) in enumerate(zip(ents, self.cells)):
+            ent.pos = [cell[0], cell[1]]
+            ent.seq = seq
+        cells, ids = self.cells, self.ids
+        fortress.setEntities(dict(zip(ids, ents)),
+                             {cell: [ent] for cell, ent in zip(cells, ents)},
+                             {c: {ids[r]: ents[r] for r in rows} for c, rows in zip(self.chars, self.rows)},
+                             {c: {cells[r]: [ents[r]] for r in rows} for c, rows in zip(self.chars, self.rows)},
+                             len(ents))
@@ -0,0 +1,617 @@
+import numpy as np
+
+from entities import Entity, NODE_OPS, EDGE_OPS
+from eventlog import EV_MOVE, EV_CHASE, EV_PUSH_FAIL, EV_PUSH, EV_TAKE, EV_DIE, EV_BLOCKED, EV_CLONE_FAIL, EV_CLONE, EV_ADD, EV_TRANSFORM
+
+
+# node action and edge condition opcodes (see entities.NODE_DICT and entities.EDGE_DICT)
+OP_IDLE = NODE_OPS['idle']
+OP_MOVE = NODE_OPS['move']
+OP_DIE = NODE_OPS['die']
+OP_CLONE = NODE_OPS['clone']
+OP_TAKE = NODE_OPS['take']
+OP_CHASE = NODE_OPS['chase']
+OP_PUSH = NODE_OPS['push']
+OP_ADD = NODE_OPS['add']
+OP_TRANSFORM = NODE_OPS['transform']
+OP_WALL = NODE_OPS['move_wall']
+
+E_NONE = EDGE_OPS['none']
+E_STEP = EDGE_OPS['step']
+E_WITHIN = EDGE_OPS['within']
+E_NEXTTO = EDGE_OPS['nextTo']
+E_TOUCH = EDGE_OPS['touch']
+
+E_NEAR = -2     # within, nextTo and touch are all "another entity of a character in range" (range 1 and 0 for the last two)
+E_PAD = -1      # empty slot in the padded edge table
+
+# the node actions that can run on a whole chunk of entities at once (the rest run one entity at a time)
+BATCH_OPS = (OP_IDLE, OP_MOVE, OP_DIE)
+
+# the random adjacent moves in the same order as Entity._randAdjPos
+POS_MOD = np.array([[0,1], [0,-1], [1,0], [-1,0]])
+
+
+# the compiled FSMs of a list of species flattened into padded tables indexed by global node, for the backends that
+#   keep the entities as rows of numpy columns
+#   the species (self.species and self.sp_fsm, by species id) and the ids of the chars and edge keys they use are
+#   registered by the backend, which then builds the tables
+class FSMTables():
+    def _charId(self, c):
+        if c not in self.char_ids:
+            self.char_ids[c] = len(self.chars)
+            self.chars.append(c)
+        return self.char_ids[c]
+
+    def _keyId(self, s, key):
+        if (s, key) not in self.key_ids:
+            self.key_ids[(s, key)] = len(self.keys)
+            self.keys.append((s, key))
+        return self.key_ids[(s, key)]
+
+    # flatten the compiled FSMs of every species into padded tables indexed by global node (node_base[species] + node)
+    def _buildTables(self):
+        n_nodes = [fsm.n_nodes for fsm in self.sp_fsm]
+        self.sp_nodes = np.array(n_nodes, dtype=np.int64)
+        self.node_base = np.concatenate(([0], np.cumsum(n_nodes)[:-1])).astype(np.int64) if n_nodes else np.zeros(0, dtype=np.int64)
+        self.sp_cid = np.array([self._charId(s.char) for s in self.species], dtype=np.int64)
+        n_g = sum(n_nodes)
+        n_k = max([len(e) for fsm in self.sp_fsm for e in fsm.edge_ops] + [1])
+
+        self.g_op = np.zeros(n_g, dtype=np.int64)               # node action
+        self.g_carg = np.full(n_g, -1, dtype=np.int64)          # char id of the node action argument
+        self.g_targets = np.zeros(n_g, dtype=object)            # bit mask of the char ids whose positions decide which edge is taken
+        self.g_has_edges = np.zeros(n_g, dtype=bool)
+        self.e_op = np.full((n_g, n_k), E_PAD, dtype=np.int64)  # edge condition (in priority order)
+        self.e_carg = np.full((n_g, n_k), -1, dtype=np.int64)   # char id of the edge condition argument
+        self.e_narg = np.zeros((n_g, n_k), dtype=np.int64)      # steps or range of the edge condition
+        self.e_dst = np.zeros((n_g, n_k), dtype=np.int64)       # node the edge goes to
+        self.e_key = np.full((n_g, n_k), -1, dtype=np.int64)    # edge key id
+        self.g_edges = [[] for _ in range(n_g)]                 # the same edges as (condition, char id, steps or range, next node, edge key id) lists
+
+        for s, fsm in enumerate(self.sp_fsm):
+            for i in range(fsm.n_nodes):
+                g = self.node_base[s] + i
+                self.g_op[g] = fsm.node_ops[i]
+                if fsm.node_args[i]:
+                    self.g_carg[g] = self._charId(fsm.node_args[i][0])
+                self.g_has_edges[g] = len(fsm.out_edges[i]) > 0
+                for k, (op, (_, args, dst, key)) in enumerate(zip(fsm.edge_ops[i], fsm.out_edges[i])):
+                    if op == E_NONE:
+                        self.e_op[g,k] = E_NONE
+                    elif op == E_STEP:
+                        self.e_op[g,k] = E_STEP
+                        self.e_narg[g,k] = args[0]
+                    else:
+                        self.e_op[g,k] = E_NEAR
+                        self.e_carg[g,k] = self._charId(args[0])
+                        self.e_narg[g,k] = args[1] if op == E_WITHIN else (1 if op == E_NEXTTO else 0)
+                        self.g_targets[g] |= 1 << int(self.e_carg[g,k])
+                    self.e_dst[g,k] = dst
+                    self.e_key[g,k] = self._keyId(s, key)
+                    self.g_edges[g].append((int(self.e_op[g,k]), int(self.e_carg[g,k]), int(self.e_narg[g,k]), dst, int(self.e_key[g,k])))
+
+
+# struct-of-arrays simulation backend
+#   keeps every entity of the fortress as rows of numpy columns (in the order the fortress updates them)
+#   and runs a tick with vectorized kernels per node action and edge condition
+#   actions that depend on the state other entities left behind (take, chase, push, add, clone, transform, move_wall)
+#   run one entity at a time, so a tick gives the same result as updating the entity objects one by one
+class SoABackend(FSMTables):
+    def __init__(self, fortress):
+        self.fortress = fortress
+        self.ent_dict = None    # the entity dictionary of the fortress the columns were loaded from
+        self.n = 0              # number of rows in use (dead rows are kept until the columns are compacted)
+
+    #######     LOADING     #######
+
+    # load the entities of the fortress into the columns
+    def load(self):
+        f = self.fortress
+        self.chars = []         # char id -> character
+        self.char_ids = {}      # character -> char id
+        self.species = []       # species id -> species
+        self.species_ids = {}   # species -> species id
+        self.sp_fsm = []        # species id -> compiled FSM the tables were built from
+        self.keys = []          # edge key id -> (species id, edge key)
+        self.key_ids = {}       # (species id, edge key) -> edge key id
+
+        ents = list(f.entities.values())
+        self._alloc(max(16, 2*len(ents)))
+        self.n = 0
+        for ent in ents:
+            self._addSpecies(ent.species)
+        self._buildTables()
+        for ent in ents:
+            self._append(ent, int(ent.pos[0]), int(ent.pos[1]))
+            r = self.n - 1
+            self.node[r] = ent.cur_node
+            self.step[r] = ent.cur_step
+            self.medge[r] = -1 if ent.moved_edge is None else self._keyId(self.sp[r], ent.moved_edge)
+
+        # entity counts per character and cell (only kept if every entity is on the map)
+        on_map = bool(np.all((self.x[:self.n] >= 0) & (self.x[:self.n] < f.width) &
+                             (self.y[:self.n] >= 0) & (self.y[:self.n] < f.height)))
+        self.counts = None
+        if on_map:
+            self.counts = np.zeros((len(self.chars), f.height, f.width), dtype=np.int64)
+            np.add.at(self.counts, (self.cid[:self.n], self.y[:self.n], self.x[:self.n]), 1)
+        self.ent_dict = f.entities
+        self.ent_seq = f.ent_seq
+        self.n_alive = len(f.entities)
+
+    # check if the fortress was changed outside of the backend since the last tick
+    def _stale(self):
+        f = self.fortress
+        if self.ent_dict is not f.entities or self.ent_seq != f.ent_seq or self.n_alive != len(f.entities):
+            return True
+        for species, fsm in zip(self.species, self.sp_fsm):
+            if species.fsm is not fsm:
+                return True
+        return False
+
+    # allocate the columns
+    def _alloc(self, size):
+        self.x = np.zeros(size, dtype=np.int64)        # position
+        self.y = np.zeros(size, dtype=np.int64)
+        self.ox = np.zeros(size, dtype=np.int64)       # position the entity object was last synced to
+        self.oy = np.zeros(size, dtype=np.int64)
+        self.sp = np.zeros(size, dtype=np.int64)       # species id
+        self.cid = np.zeros(size, dtype=np.int64)      # char id
+        self.node = np.zeros(size, dtype=np.int64)     # current node
+        self.step = np.zeros(size, dtype=np.int64)     # current step
+        self.medge = np.full(size, -1, dtype=np.int64) # edge key id of the last edge taken (-1 for none)
+        self.alive = np.zeros(size, dtype=bool)
+        self.ents = []                                 # the entity object of each row
+
+    # double the size of the columns
+    def _grow(self):
+        for name in ('x', 'y', 'ox', 'oy', 'sp', 'cid', 'node', 'step', 'medge', 'alive'):
+            col = getattr(self, name)
+            new_col = np.full(2*len(col), -1 if name == 'medge' else 0, dtype=col.dtype)
+            new_col[:self.n] = col[:self.n]
+            setattr(self, name, new_col)
+
+    # drop the dead rows (keeps the update order)
+    def _compact(self):
+        keep = np.flatnonzero(self.alive[:self.n])
+        for name in ('x', 'y', 'ox', 'oy', 'sp', 'cid', 'node', 'step', 'medge', 'alive'):
+            col = getattr(self, name)
+            col[:len(keep)] = col[keep]
+        self.medge[len(keep):] = -1
+        self.alive[len(keep):] = False
+        self.ents = [self.ents[r] for r in keep]
+        self.n = len(keep)
+
+    # add a row for an entity object
+    def _append(self, ent, x, y):
+        if self.n == len(self.x):
+            self._grow()
+        r = self.n
+        self.x[r] = self.ox[r] = x
+        self.y[r] = self.oy[r] = y
+        self.sp[r] = self.species_ids[ent.species]
+        self.cid[r] = self.sp_cid[self.sp[r]]
+        self.node[r] = 0
+        self.step[r] = 0
+        self.medge[r] = -1
+        self.alive[r] = True
+        self.ents.append(ent)
+        self.n += 1
+        return r
+
+    # register a species (the tables have to be rebuilt afterwards)
+    def _addSpecies(self, species):
+        if species in self.species_ids:
+            return False
+        self.species_ids[species] = len(self.species)
+        self.species.append(species)
+        self.sp_fsm.append(species.compileFSM())
+        self._charId(species.char)
+        return True
+
+
+    #######     UPDATES AND LOOPS    #######
+
+    # update every living entity once (same order and result as Engine.update on the entity objects)
+    def update(self, tree_visits=False):
+        f = self.fortress
+        if self._stale():
+            self.load()
+        elif self.n > 64 and 2*self.n_alive < self.n:
+            self._compact()
+
+        # the entities alive at the start of the tick (entities created during the tick are not updated)
+        rows = np.flatnonzero(self.alive[:self.n])
+        bad = self.node[rows] >= self.sp_nodes[self.sp[rows]]
+        assert not bad.any(), (f"Current node {self.node[rows[bad][0]]}"
+                               f" is greater than the number of nodes {self.sp_nodes[self.sp[rows[bad][0]]]}")
+        g = self.node_base[self.sp[rows]] + self.node[rows]
+        ops = self.g_op[g]
+        targets = self.g_targets[g]
+        changer = (ops == OP_MOVE) | (ops == OP_DIE)
+        batch = np.isin(ops, BATCH_OPS)
+        updated = np.zeros(self.n, dtype=bool)
+
+        # runs of entities whose actions can be batched, split by the entities that run alone
+        i, m = 0, len(rows)
+        alone = np.flatnonzero(~batch)
+        for j in list(alone) + [m]:
+            if j > i:
+                self._runBatch(rows[i:j], ops[i:j], targets[i:j], changer[i:j], updated)
+            if j < m and self.alive[rows[j]]:
+                r = rows[j]
+                self._runAlone(r, ops[j], g[j])
+                self.step[r] += 1
+                self._evalEdges(np.array([r]))
+                updated[r] = True
+            i = j + 1
+
+        if tree_visits:
+            self._addTreeVisits(np.flatnonzero(updated))
+        self._sync(updated)
+
+    # run a run of batchable entities as chunks
+    #   every entity must see the state left by the entities before it and none of the ones after it;
+    #   so a chunk ends before an entity that moves or dies if an entity earlier in the chunk checks where its character is
+    def _runBatch(self, rows, ops, targets, changer, updated):
+        live = self.alive[rows]
+        rows, ops, targets, changer = rows[live], ops[live], targets[live], changer[live]
+        n = len(rows)
+        if n == 0:
+            return
+
+        cuts = [0]
+        if targets.any():
+            mask = 0
+            for k, (t, ch, c) in enumerate(zip(targets.tolist(), changer.tolist(), self.cid[rows].tolist())):
+                if ch and mask >> c & 1:
+                    cuts.append(k)
+                    mask = 0
+                mask |= t
+        cuts.append(n)
+
+        for a, b in zip(cuts[:-1], cuts[1:]):
+            self._runChunk(rows[a:b], ops[a:b])
+            updated[rows[a:b]] = True
+
+    # run the node actions and then the edge conditions of a chunk of entities
+    def _runChunk(self, rows, ops):
+        f = self.fortress
+
+        # move - one random direction per mover, drawn in update order
+        movers = rows[ops == OP_MOVE]
+        moved = np.zeros(0, dtype=np.int64)
+        if len(movers):
+            d = f.randDirs(len(movers))
+            nx = self.x[movers] + POS_MOD[d,0]
+            ny = self.y[movers] + POS_MOD[d,1]
+            ok = (nx >= 0) & (nx < f.width) & (ny >= 0) & (ny < f.height)
+            ok[ok] = f.walkmap[ny[ok], nx[ok]]
+            moved = movers[ok]
+            if self.counts is not None:
+                np.subtract.at(self.counts, (self.cid[moved], self.y[moved], self.x[moved]), 1)
+                np.add.at(self.counts, (self.cid[moved], ny[ok], nx[ok]), 1)
+            self.x[moved] = nx[ok]
+            self.y[moved] = ny[ok]
+            if len(moved):
+                f.last_activity = f.steps
+
+        # die
+        dead = rows[ops == OP_DIE]
+        if len(dead):
+            self.alive[dead] = False
+            if self.counts is not None:
+                np.subtract.at(self.counts, (self.cid[dead], self.y[dead], self.x[dead]), 1)
+
+        # log in update order (without the log only the dead have to be taken off the map)
+        if f.log_events and (len(moved) or len(dead)):
+            log_rows = np.sort(np.concatenate((moved, dead)))
+            is_dead = np.isin(log_rows, dead)
+            for r, died in zip(log_rows.tolist(), is_dead.tolist()):
+                ent = self.ents[r]
+                if died:
+                    f.logEvent(EV_DIE, ent)
+                    f.removeFromMap(ent)
+                else:
+                    f.logEvent(EV_MOVE, ent, None, int(self.x[r]), int(self.y[r]))
+        elif len(dead):
+            for r in dead.tolist():
+                f.removeFromMap(self.ents[r])
+
+        self.step[rows] += 1
+        self._evalEdges(rows)
+
+    # run the node action of a single entity
+    def _runAlone(self, r, op, g):
+        f = self.fortress
+        ent = self.ents[r]
+        c = self.g_carg[g]
+
+        if op == OP_TAKE:
+            o = self._closest(r, c)
+            if o >= 0:
+                other = self.ents[o]
+                if f.log_events:
+                    f.logEvent(EV_TAKE, ent, other)
+                self._die(o)
+
+        elif op == OP_CHASE:
+            o = self._closest(r, c)
+            if o < 0:
+                return
+            x, y, tx, ty = int(self.x[r]), int(self.y[r]), int(self.x[o]), int(self.y[o])
+            dirs = []
+            if tx > x:
+                dirs.append((1,0))      # east
+            elif tx < x:
+                dirs.append((-1,0))     # west
+            if ty > y:
+                dirs.append((0,1))      # south
+            elif ty < y:
+                dirs.append((0,-1))     # north
+            if len(dirs) == 0:
+                return
+            dx, dy = dirs[f.randDir(len(dirs))]
+            if f.validPos(x+dx, y+dy):
+                self._setPos(r, x+dx, y+dy)
+                if f.log_events:
+                    f.logEvent(EV_CHASE, ent, None, x+dx, y+dy, tx, ty)
+
+        elif op == OP_PUSH:
+            o = self._closest(r, c)
+            if o < 0:
+                return
+            dx, dy = POS_MOD[f.randDir()].tolist()
+            nx, ny = int(self.x[r]) + dx, int(self.y[r]) + dy
+            if nx == self.x[o] and ny == self.y[o]:
+                ex, ey = nx + dx, ny + dy
+                if f.validPos(ex, ey):
+                    self._setPos(r, nx, ny)
+                    self._setPos(o, ex, ey)
+                    other = self.ents[o]
+                    if f.log_events:
+                        f.logEvent(EV_PUSH, ent, other)
+            elif f.validPos(nx, ny):
+                self._setPos(r, nx, ny)
+                if f.log_events:
+                    f.logEvent(EV_PUSH_FAIL, ent, None, nx, ny)
+
+        elif op == OP_WALL:
+            p = self._randAdjPos(r)
+            if p:
+                e = self._entAtPos(p[0], p[1]) if self._occupied(p[0], p[1]) else -1
+                if e < 0 or self.cid[e] != c:
+                    self._setPos(r, p[0], p[1])
+                    if f.log_events:
+                        f.logEvent(EV_MOVE, ent, None, p[0], p[1])
+                elif f.log_events:
+                    f.logEvent(EV_BLOCKED, ent, self.ents[e])
+
+        elif op == OP_CLONE:
+            p = self._randAdjPos(r)
+            if p is None or self._occupied(p[0], p[1]):
+                if f.log_events:
+                    f.logEvent(EV_CLONE_FAIL)
+                return
+            new = self._birth(ent.species, p)
+            if f.log_events:
+                f.logEvent(EV_CLONE, ent, new, p[0], p[1])
+
+        elif op == OP_ADD:
+            species = f.CHARACTER_DICT[self.chars[c]]
+            p = self._randAdjPos(r)
+            if not p or self._occupied(p[0], p[1]):
+                return
+            new = self._birth(species, p)
+            if f.log_events:
+                f.logEvent(EV_CLONE, None, new, p[0], p[1])
+                f.logEvent(EV_ADD, ent, new, p[0], p[1])
+
+        elif op == OP_TRANSFORM:
+            species = f.CHARACTER_DICT[self.chars[c]]
+            p = (int(self.x[r]), int(self.y[r]))
+            new = self._birth(species, p)
+            if f.log_events:
+                f.logEvent(EV_CLONE, None, new, p[0], p[1])
+                f.logEvent(EV_TRANSFORM, ent, new, p[0], p[1])
+            self._die(r)
+
+    # evaluate the edges leaving the current node of each entity (highest priority first, the first one that holds is taken)
+    def _evalEdges(self, rows):
+        if len(rows) == 1:
+            self._evalEdgesOne(int(rows[0]))
+            return
+        g = self.node_base[self.sp[rows]] + self.node[rows]
+        fired = np.zeros(len(rows), dtype=bool)
+        near = None
+        for k in range(self.e_op.shape[1]):
+            op = self.e_op[g,k]
+            todo = (op != E_PAD) & ~fired
+            if not todo.any():
+                break
+            cond = op == E_NONE
+            sel = todo & (op == E_STEP)
+            if sel.any():
+                cond[sel] = self.step[rows[sel]] % self.e_narg[g[sel],k] == 0
+            sel = todo & (op == E_NEAR)
+            if sel.any():
+                if near is None:
+                    near = self._nearCounter(len(rows))
+                cond[sel] = near(rows[sel], self.e_carg[g[sel],k], self.e_narg[g[sel],k])
+            hit = todo & cond
+            self.node[rows[hit]] = self.e_dst[g[hit],k]
+            self.medge[rows[hit]] = self.e_key[g[hit],k]
+            fired |= hit
+        # the last edge taken is cleared only if the node has edges and none of them held
+        self.medge[rows[self.g_has_edges[g] & ~fired]] = -1
+
+    # evaluate the edges leaving the current node of a single entity
+    def _evalEdgesOne(self, r):
+        edges = self.g_edges[self.node_base[self.sp[r]] + self.node[r]]
+        for op, c, n, dst, k in edges:
+            if op == E_NONE:
+                hit = True
+            elif op == E_STEP:
+                hit = self.step[r] % n == 0
+            else:
+                hit = self._nearOne(r, c, n)
+            if hit:
+                self.node[r] = dst
+                self.medge[r] = k
+                return
+        if edges:
+            self.medge[r] = -1
+
+    # check if another living entity of a char id is within a range of a single entity
+    def _nearOne(self, r, c, rng):
+        if self.counts is None:
+            near = (self.alive[:self.n] & (self.cid[:self.n] == c) & (np.abs(self.x[:self.n] - self.x[r]) <= rng) &
+                    (np.abs(self.y[:self.n] - self.y[r]) <= rng))
+            near[r] = False
+            return near.any()
+        if rng < 0:
+            return False
+        x, y = self.x[r], self.y[r]
+        if rng == 0:
+            hits = self.counts[c,y,x]
+        else:
+            hits = self.counts[c, max(y-rng, 0):y+rng+1, max(x-rng, 0):x+rng+1].sum()
+        if self.alive[r] and self.cid[r] == c:
+            hits -= 1
+        return hits > 0
+
+    # returns a function that checks if another living entity of a character is within a range of each entity
+    #   (uses summed-area tables of the entity counts per character when there are many entities to check)
+    def _nearCounter(self, n_checks):
+        f = self.fortress
+
+        def self_count(rows, c, rng):
+            return (self.alive[rows] & (self.cid[rows] == c) & (rng >= 0)).astype(np.int64)
+
+        if self.counts is not None and n_checks * 64 <= self.counts.size:
+            def near(rows, c, rng):
+                return np.array([self._nearOne(r, ci, ri) for r, ci, ri in zip(rows.tolist(), c.tolist(), rng.tolist())], dtype=bool)
+            return near
+
+        if self.counts is None:
+            live = np.flatnonzero(self.alive[:self.n])
+            lx, ly, lc = self.x[live], self.y[live], self.cid[live]
+
+            def near(rows, c, rng):
+                x, y = self.x[rows], self.y[rows]
+                hits = ((lc[None,:] == c[:,None]) & (np.abs(lx[None,:] - x[:,None]) <= rng[:,None]) &
+                        (np.abs(ly[None,:] - y[:,None]) <= rng[:,None])).sum(axis=1)
+                return hits - self_count(rows, c, rng) > 0
+            return near
+
+        sat = np.zeros((len(self.chars), f.height+1, f.width+1), dtype=np.int64)
+        sat[:,1:,1:] = self.counts.cumsum(axis=1).cumsum(axis=2)
+
+        def near(rows, c, rng):
+            x, y = self.x[rows], self.y[rows]
+            x0, x1 = np.maximum(x-rng, 0), np.minimum(x+rng, f.width-1)
+            y0, y1 = np.maximum(y-rng, 0), np.minimum(y+rng, f.height-1)
+            empty = (x0 > x1) | (y0 > y1)
+            x0, x1, y0, y1 = np.where(empty, 0, x0), np.where(empty, 0, x1), np.where(empty, 0, y0), np.where(empty, 0, y1)
+            hits = sat[c,y1+1,x1+1] - sat[c,y0,x1+1] - sat[c,y1+1,x0] + sat[c,y0,x0]
+            hits = np.where(empty, 0, hits)
+            return hits - self_count(rows, c, rng) > 0
+        return near
+
+
+    #######     SINGLE ENTITY HELPERS     #######
+
+    # nearest living entity of a char id, not counting the entity itself (ties go to the earliest row)
+    def _closest(self, r, c):
+        cand = self.alive[:self.n] & (self.cid[:self.n] == c)
+        cand[r] = False
+        if not cand.any():
+            return -1
+        d = np.abs(self.x[:self.n] - self.x[r]) + np.abs(self.y[:self.n] - self.y[r])
+        return int(np.argmin(np.where(cand, d, np.iinfo(np.int64).max)))
+
+    # check if any living entity is on a position
+    def _occupied(self, x, y):
+        if self.counts is None:
+            return self._entAtPos(x, y) >= 0
+        return self.counts[:,y,x].any()
+
+    # earliest living entity on a position
+    def _entAtPos(self, x, y):
+        on = np.flatnonzero(self.alive[:self.n] & (self.x[:self.n] == x) & (self.y[:self.n] == y))
+        return int(on[0]) if len(on) else -1
+
+    # random adjacent position (or None if it is not walkable)
+    def _randAdjPos(self, r):
+        dx, dy = POS_MOD[self.fortress.randDir()].tolist()
+        x, y = int(self.x[r]) + dx, int(self.y[r]) + dy
+        return (x, y) if self.fortress.validPos(x, y) else None
+
+    # move a single entity
+    def _setPos(self, r, x, y):
+        if self.counts is not None:
+            c = self.cid[r]
+            self.counts[c,self.y[r],self.x[r]] -= 1
+            self.counts[c,y,x] += 1
+        self.x[r], self.y[r] = x, y
+        self.fortress.last_activity = self.fortress.steps
+
+    # remove an entity from the map
+    def _die(self, r):
+        ent = self.ents[r]
+        if self.fortress.log_events:
+            self.fortress.logEvent(EV_DIE, ent)
+        self.alive[r] = False
+        if self.counts is not None:
+            self.counts[self.cid[r],self.y[r],self.x[r]] -= 1
+        self.fortress.removeFromMap(ent)
+
+    # create a new entity of a species on the map
+    def _birth(self, species, p):
+        if self._addSpecies(species):
+            self._buildTables()
+            self.cid[:self.n] = self.sp_cid[self.sp[:self.n]]
+            if self.counts is not None and len(self.counts) < len(self.chars):
+                self.counts = np.concatenate((self.counts, np.zeros((len(self.chars) - len(self.counts),) + self.counts.shape[1:], dtype=np.int64)))
+        new_ent = Entity(self.fortress, species=species)
+        new_ent.pos = [p[0], p[1]]
+        self.fortress.addEntity(new_ent)
+        r = self._append(new_ent, p[0], p[1])
+        if self.counts is not None:
+            self.counts[self.cid[r],p[1],p[0]] += 1
+        return new_ent
+
+
+    #######     FORTRESS SYNC     #######
+
+    # record the visited nodes and taken edges of the updated entities
+    def _addTreeVisits(self, rows):
+        visit_tree = self.fortress.CHAR_VISIT_TREE
+        sp = self.sp[rows]
+        for s, node in np.unique(np.stack((sp, self.node[rows]), axis=1), axis=0).tolist():
+            visit_tree[self.species[s].char]['nodes'].add(node)
+        for k in np.unique(self.medge[rows]).tolist():
+            if k >= 0:
+                s, key = self.keys[k]
+                visit_tree[self.species[s].char]['edges'].add(key)
+
+    # write the columns back to the entity objects and the occupancy index of the fortress
+    def _sync(self, updated):
+        f = self.fortress
+        n = self.n
+        moved = np.flatnonzero(self.alive[:n] & ((self.x[:n] != self.ox[:n]) | (self.y[:n] != self.oy[:n])))
+        for r, x, y in zip(moved.tolist(), self.x[moved].tolist(), self.y[moved].tolist()):
+            f.moveEntity(self.ents[r], [x, y])
+        self.ox[moved] = self.x[moved]
+        self.oy[moved] = self.y[moved]
+
+        rows = np.flatnonzero(updated)
+        for r, node, step, k in zip(rows.tolist(), self.node[rows].tolist(), self.step[rows].tolist(), self.medge[rows].tolist()):
+            ent = self.ents[r]
+            ent.cur_node = node
+            ent.cur_step = step
+            ent.moved_edge = None if k < 0 else self.keys[k][1]
+
+        self.ent_seq = f.ent_seq
+        self.n_alive = len(f.entities)
@@ -0,0 +1,39 @@
+"""The alternative simulation backends against the reference engine, on a reduced set of the scenarios of
+equivalence.py (`python equivalence.py` runs the full set), and the batch simulation of individuals against
+simulating them one at a time."""
+import glob
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from equivalence import compareBackends, compareEvo
+
+# a few fortress files, every entity file and a few random fortresses - (name, kind, argument) as in listScenarios
+SCENARIOS = [(f, 'fort', f) for f in ["FORTS/HYRULE.txt", "FORTS/LOCK_N_KEY.txt", "FORTS/equilibrium.txt"]]
+SCENARIOS.append(("ENT/*.txt", 'ent', sorted(glob.glob("ENT/*.txt", root_dir=ROOT))))
+SCENARIOS += [(f"random {i}", 'random', i) for i in range(3)]
+SEEDS = range(2)
+N_SIM_STEPS = 50
+
+
+@pytest.fixture(autouse=True)
+def repo_dir(monkeypatch):
+    # the scenarios and configs are found relative to the root of the repo
+    monkeypatch.chdir(ROOT)
+
+
+@pytest.mark.parametrize("scenario", SCENARIOS, ids=lambda s: s[0])
+@pytest.mark.parametrize("backend", ["soa", "scheduled", "batch"])
+def test_backend_matches_reference(backend, scenario):
+    divergences = compareBackends(backend, [scenario], SEEDS, N_SIM_STEPS, verbose=False)
+    assert not divergences, "\n".join(f"{name} [seed {seed}] diverges at tick {tick} - {desc}"
+                                      for name, seed, tick, desc in divergences)
+
+
+def test_simulate_batch_matches_simulate_fortress():
+    divergences = compareEvo(n_inds=2, n_new_sims=2, n_sim_steps=N_SIM_STEPS, verbose=False)
+    assert not divergences, "\n".join(f"{name} [individual {i}] diverges - {desc}" for name, i, desc in divergences)
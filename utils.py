@@ -1,38 +1,47 @@
 import os
-import pickle
-import random
-from typing import List
+from typing import List, TYPE_CHECKING
 
-import matplotlib.pyplot as plt
 import numpy as np
 
-from config import EvoConfig
+# only for the annotations (the config module loads Hydra)
+if TYPE_CHECKING:
+    from config import EvoConfig
 
 
-# create a new id for the entity (copied from `entities.py` but abstracted a bit so we can use it for the reference)
+# create a new id for the entity (same scheme as `Fortress.newID` but abstracted a bit so we can use it for the reference)
+#   counts up from the number of IDs in use and skips any that are taken
 def newID(all_ids,id_len=4):
-    all_num = list(range(16**4))
-    while len(all_num) > 0:
-        i = f'%{id_len}x' % random.choice(all_num)
+    n_ids = 16**id_len
+    if len(all_ids) >= n_ids:
+        return f'%0{id_len+1}x' % (n_ids + len(all_ids))
+
+    n = len(all_ids)
+    while True:
+        i = f'%0{id_len}x' % (n % n_ids)
         if i not in all_ids:
             return i
-        all_num.remove(int(i,16))
-
-    return f'%0{id_len}x' % random.randrange(16**(id_len+1))
+        n += 1
 
 
 def get_bin_idx(val, bounds, n_bins):
     return int((val - bounds[0]) / (bounds[1] - bounds[0]) * (n_bins - 1))
 
 
+# scipy.stats.entropy, with SciPy only imported the first time it is needed (it takes about a second to import)
+def entropy(pk, base=None, axis=0):
+    from scipy.stats import entropy as scipy_entropy
+    return scipy_entropy(pk, base=base, axis=axis)
+
+
 def get_xy_from_bcs(bc: tuple, bc_bounds: tuple, x_bins: int, y_bins: int):
     x = get_bin_idx(bc[0], bc_bounds[0], x_bins)
     y = get_bin_idx(bc[1], bc_bounds[1], y_bins)
     return (x, y)
 
 
-def plot_archive_heatmap(config: EvoConfig, fits, bc_bounds, heatmap_filename,
+def plot_archive_heatmap(config: 'EvoConfig', fits, bc_bounds, heatmap_filename,
                          cbar_label="% FSMs explored"):
+    import matplotlib.pyplot as plt
 
     if config.fitness_type == "M":
         y_label, x_label = "n. entities", "n. @-type entities"
@@ -83,7 +92,7 @@ def plot_archive_heatmap(config: EvoConfig, fits, bc_bounds, heatmap_filename,
     plt.savefig(heatmap_filename)
 
 
-def get_exp_dir(config: EvoConfig):
+def get_exp_dir(config: 'EvoConfig'):
     exp_dir = os.path.join("saves", 
                            (f"ME_fit-{config.fitness_type}"
                             f"_bcs-{config.bcs[0]}-{config.bcs[1]}"
@@ -101,7 +110,7 @@ def get_exp_dir(config: EvoConfig):
 def get_archive_files(exp_dir: str):
     """Find any existing archive files."""
     archive_files = ([f for f in os.listdir(exp_dir) 
-                      if f.startswith("archive_gen-")] 
+                      if f.startswith("archive_gen-") and not f.endswith(".tmp")] 
                         if os.path.exists(exp_dir) else [])
     return archive_files
 
@@ -111,12 +120,11 @@ def load_latest_archive(exp_dir: str, archive_files: List[str]):
     archive_files = sorted(archive_files,
                            key=lambda f: int(f.split("-")[1].split(".")[0]))
     latest_archive_file = archive_files[-1]
-    # Load it
+    # Load it (an archive file, or a pickle of an older run)
+    from archive_file import load_archive
     try:
-        with open(os.path.join(exp_dir, latest_archive_file), 'rb') as f:
-            archive = pickle.load(f)
+        archive = load_archive(os.path.join(exp_dir, latest_archive_file))
     except EOFError:
         latest_archive_file = archive_files[-2]
-        with open(os.path.join(exp_dir, latest_archive_file), 'rb') as f:
-            archive = pickle.load(f)
+        archive = load_archive(os.path.join(exp_dir, latest_archive_file))
     return archive
\ No newline at end of file